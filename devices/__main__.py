@@ -0,0 +1,229 @@
+"""Launcher and supervisor of the simulator suite
+
+Starts a `flask run` process for every device listed in `_host.FLEET` (all of them
+at once), waits until each of them accepts connections and restarts the ones that
+exit, with increasing delay. Simulators are advertised with zeroconf, with `dns-sd`
+if there is one, otherwise with the built-in mDNS responder:
+
+    python -m devices
+    python -m devices -k shutterbox
+"""
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from ._host import FLEET
+from ._mdns import Responder
+
+# seconds to wait for the first restart, doubled on every next one
+MIN_BACKOFF = 1
+MAX_BACKOFF = 60
+# seconds after which a running simulator is considered healthy again
+STABLE_AFTER = 30
+# warning every `flask run` prints on start, dropped from the output of simulators
+BANNER = b"This is a development server"
+
+
+class Simulator:
+    """Simulator process of a single device"""
+    def __init__(self, port: int, module: str, options: dict, reload: bool = False, state_dir: str = None):
+        self.port = port
+        self.module = module
+        self.options = options
+        self.reload = reload
+        self.state_dir = state_dir
+        self.process = None
+        self.started = None
+        self.ready = False
+        self.backoff = MIN_BACKOFF
+        self.restart_at = None
+
+    def env(self) -> dict:
+        # note: device modules read their options from the environment, see from_env()
+        env = dict(os.environ)
+        for name in ("mode", "variant", "faulty"):
+            if name in self.options:
+                env[name.upper()] = str(int(self.options[name]) if name == "faulty" else self.options[name])
+        if self.reload:
+            env["RELOAD"] = "1"
+        if self.state_dir:
+            env["STATE_LOG"] = os.path.join(self.state_dir, f"{self.port}-{self.module}.log")
+        # note: output goes through forward(), it would be held back in a buffer otherwise
+        env["PYTHONUNBUFFERED"] = "1"
+        return env
+
+    def start(self):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "flask", "--app", f"devices.{self.module}", "run", "--port", str(self.port)],
+            env=self.env(),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+        )
+        threading.Thread(target=forward, args=(self.process.stdout,), daemon=True).start()
+        self.started = time.monotonic()
+        self.ready = False
+        self.restart_at = None
+
+    def is_listening(self) -> bool:
+        try:
+            with socket.create_connection(("127.0.0.1", self.port), timeout=0.2):
+                return True
+        except OSError:
+            return False
+
+    def check(self, now: float):
+        """Notice readiness and exits of the process, restart it when it's time"""
+        if self.restart_at is not None:
+            if now >= self.restart_at:
+                print(f"port[{self.port}]: {self.module} restarting", flush=True)
+                self.start()
+            return
+
+        code = self.process.poll()
+        if code is None:
+            if not self.ready:
+                self.ready = self.is_listening()
+            return
+
+        if now - self.started >= STABLE_AFTER:
+            self.backoff = MIN_BACKOFF
+
+        print(f"port[{self.port}]: {self.module} exited with {code}, restart in {self.backoff}s", flush=True)
+        self.restart_at = now + self.backoff
+        self.backoff = min(self.backoff * 2, MAX_BACKOFF)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+
+def forward(output):
+    """Pass output of a simulator on, except the dev-server banner"""
+    with output:
+        for line in output:
+            if BANNER not in line:
+                sys.stdout.buffer.write(line)
+                sys.stdout.buffer.flush()
+
+
+def rss(pids: list[int]) -> int:
+    """Return total resident set size of given processes in KiB"""
+    if not pids:
+        return 0
+    output = subprocess.run(
+        ["ps", "-o", "rss=", "-p", ",".join(map(str, pids))], capture_output=True, text=True
+    ).stdout
+    return sum(int(line) for line in output.split())
+
+
+def advertise(simulators: list[Simulator]) -> list[subprocess.Popen]:
+    """Register simulators with zeroconf, if dns-sd is available (macOS)"""
+    if shutil.which("dns-sd") is None:
+        return []
+    return [
+        subprocess.Popen(["dns-sd", "-P", s.module, "_bbxsrv", "local.", str(s.port), "localhost", "127.0.0.1"])
+        for s in simulators
+    ]
+
+
+def respond(simulators: list[Simulator]) -> Responder | None:
+    """Advertise simulators with the built-in mDNS responder, where there's no dns-sd"""
+    responder = Responder([(f"{s.module}@127.0.0.1:{s.port}", "127.0.0.1", s.port) for s in simulators])
+    try:
+        responder.serve_in_background()
+    except OSError as e:
+        print(f"simulators are not advertised, mDNS responder failed: {e}", flush=True)
+        return None
+    return responder
+
+
+def wait_ready(simulators: list[Simulator], timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while not all(s.ready for s in simulators):
+        now = time.monotonic()
+        if now >= deadline:
+            return False
+
+        for simulator in simulators:
+            simulator.check(now)
+        time.sleep(0.05)
+    return True
+
+
+def supervise(simulators: list[Simulator], interval: float = 0.5):
+    while True:
+        time.sleep(interval)
+        now = time.monotonic()
+        for simulator in simulators:
+            simulator.check(now)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m devices",
+        description="Run all simulators, each in its own process",
+        epilog="devices:\n" + "\n".join(f"  port[{port}]: {module}" for port, module, _ in FLEET),
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("-k", "--filter", help="filter devices by name")
+    parser.add_argument(
+        "--reload", action="store_true",
+        help="reload device modules when they change, keeping device state (see devices/_reload.py)"
+    )
+    parser.add_argument(
+        "--state-dir", metavar="DIR",
+        help="log device state in DIR, so it survives restarts of simulators (see devices/_statelog.py)"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30,
+        help="seconds to wait for simulators to accept connections (default: %(default)s)"
+    )
+    args = parser.parse_args()
+    if args.state_dir:
+        os.makedirs(args.state_dir, exist_ok=True)
+
+    simulators = [
+        Simulator(port, module, options, args.reload, args.state_dir)
+        for port, module, options in FLEET
+        if not args.filter or args.filter in module
+    ]
+
+    started = time.monotonic()
+    for simulator in simulators:
+        print(f"port[{simulator.port}]: {simulator.module}", flush=True)
+        simulator.start()
+
+    advertisers = advertise(simulators)
+    responder = respond(simulators) if not advertisers else None
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        ready = wait_ready(simulators, args.timeout)
+        elapsed = time.monotonic() - started
+        memory = rss([s.process.pid for s in simulators if s.process.poll() is None] + [os.getpid()])
+        print(
+            f"{'ready' if ready else 'NOT ready'}: {sum(s.ready for s in simulators)}/{len(simulators)} "
+            f"simulators in {elapsed:.2f}s, {memory / 1024:.0f} MiB RSS total",
+            flush=True,
+        )
+        supervise(simulators)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if responder is not None:
+            responder.shutdown()
+        for simulator in simulators:
+            simulator.stop()
+        for process in advertisers:
+            process.terminate()
+        for process in [*(s.process for s in simulators), *advertisers]:
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Devices served on one port, each at its own loopback address
+
+Real devices all listen on port 80, each at its own ip address. Whole 127.0.0.0/8
+is routed to the loopback interface (on Linux, on macOS add aliases of lo0 first),
+so every simulated device can get its own 127.x.y.z address instead of a port.
+
+Rather than binding a socket per address, a single socket bound to all addresses
+accepts connections of all devices and each request is dispatched by the local
+address its client connected to. That takes one file descriptor no matter how many
+devices there are:
+
+    index = AddressIndex()
+    for ip, device in zip(loopback_addresses("127.1.0.0/16"), devices):
+        device.ip = ip                    # reported in /info and friends
+        index.add(ip, device)
+    bound = server.bind("0.0.0.0", 80, index.wsgi_app)
+    restrict_to_loopback(bound.socket)
+
+The socket is tied to the loopback interface, so it's not reachable from the
+network even though it's bound to all addresses.
+"""
+import ipaddress
+import socket
+
+DEFAULT_NETWORK = "127.1.0.0/16"
+DEFAULT_PORT = 80
+LOOPBACK_INTERFACE = "lo"
+
+
+def loopback_addresses(network: str = DEFAULT_NETWORK):
+    """Return (lazily) addresses of given loopback network, to be assigned to devices"""
+    net = ipaddress.ip_network(network)
+    if not net.is_loopback:
+        raise ValueError(f"{network} is not a loopback network")
+    return (str(ip) for ip in net.hosts())
+
+
+def restrict_to_loopback(sock: socket.socket) -> bool:
+    """Let socket bound to all addresses take connections to loopback addresses only
+
+    Returns False where the system can't do that (e.g. macOS), clients on the network
+    may connect then (and get 404, none of the devices has their address).
+    """
+    if not hasattr(socket, "SO_BINDTODEVICE"):
+        return False
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BINDTODEVICE, LOOPBACK_INTERFACE.encode())
+    except OSError:
+        # note: unprivileged processes may only do it since Linux 5.7
+        return False
+    return True
+
+
+class AddressIndex:
+    """Devices by their ip address, served as one WSGI app"""
+    def __init__(self):
+        self.devices = {}
+
+    def add(self, ip: str, device):
+        if ip in self.devices:
+            raise ValueError(f"address {ip} is already taken")
+        self.devices[ip] = device
+
+    def start(self, scheduler=None):
+        for device in self.devices.values():
+            device.start(scheduler)
+
+    def wsgi_app(self, environ, start_response):
+        # note: SERVER_NAME is the local address of the connection, see
+        #       KeepAliveRequestHandler
+        device = self.devices.get(environ["SERVER_NAME"])
+        if device is None:
+            body = f"no device at {environ['SERVER_NAME']}\n".encode()
+            start_response("404 Not Found", [("Content-Type", "text/plain"), ("Content-Length", str(len(body)))])
+            return [body]
+        return device.wsgi_app(environ, start_response)
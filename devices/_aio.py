@@ -0,0 +1,214 @@
+"""asyncio serving engine for device apps
+
+All devices are served from one event loop (running in a background thread), which
+copes much better than threads with thousands of mostly idle keep-alive
+connections of polling clients. Route handlers are short and never block, so the
+device WSGI apps are called directly on the loop. Time-driven devices are ticked
+with loop timers instead of OS threads.
+
+    server = AsyncServer()
+    server.bind("127.0.0.1", 5151, shutter)
+    server.serve_in_background()
+"""
+import asyncio
+import io
+import logging
+import socket
+import sys
+import threading
+from urllib.parse import unquote_to_bytes
+
+from werkzeug.exceptions import InternalServerError
+
+from ._device import Device
+from ._scheduler import AsyncScheduler
+from ._server import DEFAULT_KEEPALIVE
+
+logger = logging.getLogger(__name__)
+
+MAX_HEADER_SIZE = 64 * 1024
+# note: devices take small JSON documents, nothing near this
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class BadRequestLine(Exception):
+    pass
+
+
+def make_environ(method: str, target: str, version: str, headers: list, body: bytes, sockname, peername) -> dict:
+    path, _, query = target.partition("?")
+    environ = {
+        "REQUEST_METHOD": method,
+        "SCRIPT_NAME": "",
+        "PATH_INFO": unquote_to_bytes(path).decode("latin-1"),
+        "QUERY_STRING": query,
+        "SERVER_NAME": sockname[0],
+        "SERVER_PORT": str(sockname[1]),
+        "SERVER_PROTOCOL": version,
+        "REMOTE_ADDR": peername[0],
+        "REMOTE_PORT": peername[1],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": "http",
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": False,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in headers:
+        key = name.upper().replace("-", "_")
+        if key in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            environ[key] = value
+            continue
+
+        key = f"HTTP_{key}"
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+
+    return environ
+
+
+def call_app(app, environ: dict) -> tuple[str, list, bytes]:
+    response = []
+
+    def start_response(status, headers, exc_info=None):
+        response[:] = [status, headers]
+
+    result = app(environ, start_response)
+    try:
+        body = b"".join(result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+    status, headers = response
+    return status, headers, body
+
+
+def parse_head(head: bytes):
+    request_line, *header_lines = head.decode("latin-1").split("\r\n")
+
+    try:
+        method, target, version = request_line.split(" ")
+    except ValueError:
+        raise BadRequestLine(request_line)
+
+    headers = []
+    for line in header_lines:
+        if not line:
+            continue
+        name, _, value = line.partition(":")
+        headers.append((name.strip(), value.strip()))
+
+    return method, target, version, headers
+
+
+class AsyncServer:
+    def __init__(self, keepalive: float = DEFAULT_KEEPALIVE):
+        self.keepalive = keepalive
+        self.bindings = []
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+
+    def bind(self, host: str, port: int, device: Device, logger: logging.Logger = None, reuse_port: bool = False):
+        sock = socket.create_server((host, port), backlog=1024, reuse_port=reuse_port)
+        sock.setblocking(False)
+        self.bindings.append((sock, device, logger))
+        return sock
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, device: Device, access_log):
+        sockname = writer.get_extra_info("sockname")
+        peername = writer.get_extra_info("peername")
+
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.keepalive)
+                except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    return
+
+                try:
+                    method, target, version, headers = parse_head(head)
+                except BadRequestLine:
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    return
+
+                fields = {name.lower(): value for name, value in headers}
+                if "chunked" in fields.get("transfer-encoding", ""):
+                    writer.write(b"HTTP/1.1 411 Length Required\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    return
+
+                try:
+                    length = int(fields.get("content-length", 0) or 0)
+                    if length < 0:
+                        raise ValueError(length)
+                except ValueError:
+                    writer.write(b"HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    return
+
+                if length > MAX_BODY_SIZE:
+                    writer.write(b"HTTP/1.1 413 Content Too Large\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                    return
+
+                try:
+                    body = await asyncio.wait_for(reader.readexactly(length), self.keepalive)
+                except asyncio.TimeoutError:
+                    return
+                environ = make_environ(method, target, version, headers, body, sockname, peername)
+
+                connection = fields.get("connection", "").lower()
+                keep_alive = connection != "close" and (version == "HTTP/1.1" or connection == "keep-alive")
+
+                try:
+                    status, response_headers, response_body = call_app(device.wsgi_app, environ)
+                except Exception:
+                    logger.exception("error on request %s %s", method, environ["PATH_INFO"])
+                    # note: as in the threads engine, the connection is not trusted after
+                    keep_alive = False
+                    status, response_headers, response_body = call_app(InternalServerError(), environ)
+
+                if not any(name.lower() == "content-length" for name, _ in response_headers):
+                    response_headers.append(("Content-Length", str(len(response_body))))
+                response_headers.append(("Connection", "keep-alive" if keep_alive else "close"))
+
+                writer.write(
+                    f"HTTP/1.1 {status}\r\n".encode("latin-1")
+                    + "".join(f"{name}: {value}\r\n" for name, value in response_headers).encode("latin-1")
+                    + b"\r\n"
+                    + (response_body if method != "HEAD" else b"")
+                )
+                await writer.drain()
+
+                if access_log:
+                    access_log.info(f"{peername[0]} - \"{method} {target} {version}\" {status.split(' ', 1)[0]} -")
+
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        scheduler = AsyncScheduler(self.loop)
+        for sock, device, logger in self.bindings:
+            await asyncio.start_server(
+                lambda r, w, device=device, logger=logger: self.handle(r, w, device, logger),
+                sock=sock,
+                limit=MAX_HEADER_SIZE,
+            )
+            device.start(scheduler)
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.start())
+        self.loop.run_forever()
+
+    def serve_in_background(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="fakebox-loop", daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,326 @@
+"""Micro benchmarks of device internals
+
+    python -m devices._bench
+    python -m devices._bench discovery --sizes 10 100 1000 10000
+    python -m devices._bench snapshot --devices 10000
+    python -m devices._bench keepalive --threads 2 --clients 8
+"""
+import argparse
+import http.client
+import importlib
+import random
+import os
+import socket
+import statistics
+import tempfile
+import threading
+import time
+import timeit
+
+from werkzeug.test import EnvironBuilder
+
+from . import _mdns as mdns
+from . import _snapshot as snapshot
+from ._device import ENVIRON_KEY, find_device_class
+from ._server import PooledServer, QuietRequestHandler
+from ._template import json_response
+
+# devices with payloads rendered from templates
+TEMPLATE_MODULES = (
+    "floodsensor_20210413",
+    "windrainsensor_20210413",
+    "multisensor_20230606",
+    "smartmeter_20230606",
+)
+
+# one device module per device type, with its polled endpoint
+FAST_ROUTES = (
+    ("switchbox_20180604", "/api/relay/state"),
+    ("switchbox_20220114", "/state"),
+    ("switchboxd_20200831", "/state"),
+    ("wlightbox_20200229", "/api/rgbw/state"),
+    ("shutterbox_20190911", "/api/shutter/state"),
+    ("gatebox_20230102", "/state"),
+    ("floodsensor_20210413", "/state"),
+    ("windrainsensor_20210413", "/state"),
+    ("multisensor_20230606", "/state"),
+    ("smartmeter_20230606", "/state"),
+    ("switchbox_20220114", "/api/device/uptime"),
+)
+
+
+def per_call(f, number: int) -> float:
+    """Return best time of a single f() call in microseconds"""
+    return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e6
+
+
+def bench_templates(number: int = 2000):
+    print("/state/extended payload encoding (dict -> jsonify vs template)")
+
+    for module_name in TEMPLATE_MODULES:
+        module = importlib.import_module(f"devices.{module_name}")
+        device_class = find_device_class(module)
+        templates = device_class.templates
+        app = device_class.get_app()
+
+        with app.app_context():
+            # note: templates must give exactly what jsonify() does
+            for _ in range(100):
+                values = {name: random.choice([0, 1, 42, -7, 1234567]) for name in templates.names}
+                assert templates.render(app.json, **values) == tuple(
+                    app.json.response(payload).get_data() for payload in module.payloads(**values)
+                ), module_name
+
+            values = {name: 42 for name in templates.names}
+            jsonify = per_call(lambda: app.json.response(module.payloads(**values)[1]).get_data(), number)
+            template = per_call(lambda: json_response(templates.render(app.json, **values)[1]).get_data(), number)
+
+        print(f"  {module_name:26} {jsonify:7.1f} us {template:7.1f} us  x{jsonify / template:.1f}")
+
+
+def call(app, environ: dict) -> bytes:
+    return b"".join(app(environ, lambda status, headers, exc_info=None: None))
+
+
+def bench_fast_routes(number: int = 2000):
+    print("GET requests per second of a single thread (Flask vs fast route)")
+
+    for module_name, path in FAST_ROUTES:
+        device = find_device_class(importlib.import_module(f"devices.{module_name}"))()
+        app = device.get_app()
+        environ = EnvironBuilder(path=path).get_environ()
+
+        flask = 1e6 / per_call(lambda: call(app, {**environ, ENVIRON_KEY: device}), number)
+        fast = 1e6 / per_call(lambda: call(device.wsgi_app, dict(environ)), number)
+        print(f"  {module_name:26} {path:20} {flask:8.0f} {fast:8.0f}  x{fast / flask:.1f}")
+
+
+def querier(interface: str, port: int) -> socket.socket:
+    """Return socket sending queries from the mDNS port, like a querier sharing it"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # note: answers are read by a single listener, queriers drop their copies
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    sock.bind(("", port))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    return sock
+
+
+def settle(responders: list, quiet: float = 0.5):
+    """Wait until responders are done with announcements of each other"""
+    received = -1
+    while received != (received := sum(responder.received for responder in responders)):
+        time.sleep(quiet)
+
+
+def discovery_burst(listener: socket.socket, queriers: list, size: int, port: int, timeout: float = 3.0):
+    """Send a PTR query from every querier at once
+
+    Returns latencies of queriers (seconds until all devices were seen, or None)
+    and number of answer packets, with the time they took.
+    """
+    query = mdns.HEADER.pack(0, 0, 1, 0, 0, 0) + b"".join(
+        bytes([len(label)]) + label.encode() for label in mdns.SERVICE
+    ) + b"\0" + mdns.QUESTION.pack(mdns.PTR, mdns.CLASS_IN)
+
+    while True:
+        try:
+            listener.recv(mdns.MAX_DATAGRAM)
+        except BlockingIOError:
+            break
+
+    sent = []
+    for sock in random.sample(queriers, len(queriers)):
+        sent.append(time.perf_counter())
+        sock.sendto(query, (mdns.GROUP, port))
+
+    instances = set()
+    packets = 0
+    last = deadline = sent[0] + timeout
+    listener.settimeout(0.05)
+    while len(instances) < size and time.perf_counter() < deadline:
+        try:
+            data = listener.recv(mdns.MAX_DATAGRAM)
+        except socket.timeout:
+            continue
+        if not data[2] & 0x80:
+            continue
+
+        last = time.perf_counter()
+        packets += 1
+        instances.update(rdata for _, rtype, _, rdata in mdns.parse(data)[3] if rtype == mdns.PTR)
+    listener.setblocking(False)
+
+    if len(instances) < size:
+        return [None] * len(queriers), packets, last - sent[0]
+    return [last - t for t in sent], packets, last - sent[0]
+
+
+def percentiles(values: list[float]) -> tuple[float, float, float]:
+    """Return 50th, 90th and 99th percentile of (some) values"""
+    if len(values) < 2:
+        return (values[0],) * 3
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return cuts[49], cuts[89], cuts[98]
+
+
+def bench_discovery(
+    sizes: tuple = (10, 100, 1000),
+    queriers: int = 20,
+    bursts: int = 3,
+    max_per_device: int = 1000,
+    interface: str = "127.0.0.1",
+    port: int = 5354,
+):
+    # note: latency includes the 20-120 ms responders wait for more queries, pps
+    #       are answer packets per second of a burst and `lost` counts queries
+    #       after which not all devices were seen within the timeout
+    print(f"discovery of N devices by bursts of {queriers} PTR queries (ms until all devices were seen)")
+    print(f"  {'devices':>8} {'advertiser':12} {'p50':>7} {'p90':>7} {'p99':>7} {'packets':>8} {'pps':>8}  lost")
+
+    for size in sizes:
+        services = [(f"device-{i}", f"127.1.{i >> 8 & 0xFF}.{i & 0xFF}", 80) for i in range(size)]
+        for mode in ("per-device", "batched"):
+            if mode == "per-device" and size > max_per_device:
+                continue
+
+            if mode == "per-device":
+                # note: like separate advertisers would, with default socket buffers
+                responders = [mdns.Responder([service], interface, port, receive_buffer=None) for service in services]
+            else:
+                responders = [mdns.Responder(services, interface, port)]
+
+            listener = mdns.open_socket(interface, port)
+            sockets = [querier(interface, port) for _ in range(queriers)]
+            try:
+                for responder in responders:
+                    responder.serve_in_background()
+                for responder in responders:
+                    responder.announced.wait()
+                settle(responders)
+
+                latencies, packets, elapsed = [], 0, 0.0
+                for _ in range(bursts):
+                    # note: responders answer the same question at most once a second
+                    time.sleep(mdns.MIN_INTERVAL + 0.1)
+                    burst, burst_packets, burst_elapsed = discovery_burst(listener, sockets, size, port)
+                    latencies += burst
+                    packets += burst_packets
+                    elapsed += burst_elapsed
+            finally:
+                for responder in responders:
+                    responder.stopped.set()
+                for responder in responders:
+                    responder.shutdown()
+                for sock in [listener, *sockets]:
+                    sock.close()
+
+            found = sorted(latency * 1000 for latency in latencies if latency is not None)
+            lost = len(latencies) - len(found)
+            times = " ".join(f"{p:7.1f}" for p in percentiles(found)) if found else f"{'-':>7} {'-':>7} {'-':>7}"
+            print(
+                f"  {size:>8} {mode:12} {times} {packets / bursts:8.0f} {packets / max(elapsed, 1e-9):8.0f}  {lost}",
+                flush=True,
+            )
+
+
+def bench_snapshot(count: int):
+    print(f"state of {count} switchboxes set with requests vs restored from a snapshot")
+
+    device_class = find_device_class(importlib.import_module("devices.switchbox_20220114"))
+    devices = [device_class(serial=serial) for serial in range(count)]
+    environ = EnvironBuilder(path="/s/1").get_environ()
+
+    started = time.perf_counter()
+    for device in devices:
+        call(device.wsgi_app, dict(environ))
+    print(f"  {'requests (in process)':24} {(time.perf_counter() - started) * 1000:8.1f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.snap")
+        snapshot.save(path, devices)
+        fresh = [device_class(serial=serial) for serial in range(count)]
+
+        started = time.perf_counter()
+        with snapshot.Snapshot(path) as snap:
+            snap.restore(fresh)
+        print(f"  {'snapshot restore':24} {(time.perf_counter() - started) * 1000:8.1f} ms")
+        assert all(device.relays["0"] == 1 for device in fresh)
+
+
+def bench_keepalive(threads: int, clients: int, requests: int = 50, pause: float = 0.01, keepalive: float = 5.0):
+    # note: clients pause between requests, so their connections are idle most of the time
+    print(f"{clients} clients polling over kept-alive connections, served by {threads} threads")
+
+    device = find_device_class(importlib.import_module("devices.switchbox_20220114"))()
+    server = PooledServer(threads=threads, keepalive=keepalive)
+    port = server.bind("127.0.0.1", 0, device.wsgi_app, QuietRequestHandler).server_port
+    server.serve_in_background()
+
+    latencies = []
+    # note: connections stay open until all clients are done, as those of pollers do
+    done = threading.Barrier(clients)
+
+    def poll():
+        connection = http.client.HTTPConnection("127.0.0.1", port)
+        for _ in range(requests):
+            started = time.perf_counter()
+            connection.request("GET", "/state")
+            connection.getresponse().read()
+            latencies.append(time.perf_counter() - started)
+            time.sleep(pause)
+        done.wait()
+        connection.close()
+
+    try:
+        pollers = [threading.Thread(target=poll) for _ in range(clients)]
+        for poller in pollers:
+            poller.start()
+        for poller in pollers:
+            poller.join()
+    finally:
+        server.shutdown()
+
+    times = " ".join(f"{p * 1000:7.1f}" for p in percentiles(latencies))
+    print(f"  {'p50 p90 p99 (ms)':24} {times}  max {max(latencies) * 1000:.1f}")
+    # note: a connection holding a thread while idle makes the others wait for keepalive
+    assert len(latencies) == clients * requests and max(latencies) < keepalive / 2, "clients waited for a thread"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro benchmarks of device internals")
+    parser.add_argument(
+        "benchmarks", nargs="*", choices=("templates", "fast_routes", "discovery", "snapshot", "keepalive"),
+        help="benchmarks to run (default: templates fast_routes)"
+    )
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="discovery: numbers of devices")
+    parser.add_argument("--queriers", type=int, default=20, help="discovery: queries in a burst (default: %(default)s)")
+    parser.add_argument("--bursts", type=int, default=3, help="discovery: bursts per fleet size (default: %(default)s)")
+    parser.add_argument(
+        "--max-per-device", type=int, default=1000,
+        help="discovery: largest fleet advertised per device as well (default: %(default)s)"
+    )
+    parser.add_argument("--devices", type=int, default=10000, help="snapshot: number of devices (default: %(default)s)")
+    parser.add_argument("--threads", type=int, default=2, help="keepalive: server threads (default: %(default)s)")
+    parser.add_argument(
+        "--clients", type=int, default=8, help="keepalive: kept-alive connections (default: %(default)s)"
+    )
+    args = parser.parse_args()
+
+    benchmarks = args.benchmarks or ["templates", "fast_routes"]
+    if "templates" in benchmarks:
+        bench_templates()
+    if "fast_routes" in benchmarks:
+        bench_fast_routes()
+    if "discovery" in benchmarks:
+        bench_discovery(tuple(args.sizes), args.queriers, args.bursts, args.max_per_device)
+    if "snapshot" in benchmarks:
+        bench_snapshot(args.devices)
+    if "keepalive" in benchmarks:
+        bench_keepalive(args.threads, args.clients)
+
+
+if __name__ == "__main__":
+    main()
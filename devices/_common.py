@@ -0,0 +1,184 @@
+"""Endpoints common to all devices, for every api level
+
+Api levels differ only in a handful of details listed in `API_LEVELS`. The blueprint
+of an api level is built once and shared by all device types (and so all devices)
+of that level:
+
+    class SwitchBox(Device):
+        API_VERSION = "20200831"
+        blueprint = make_blueprint(API_VERSION)
+"""
+import functools
+
+from flask import Blueprint, request
+
+from . import _kit as kit
+from ._device import cached_json, current_device
+
+# capabilities of the latest api level
+LATEST = {
+    # GET /info, with /api/device/state kept as deprecated
+    "info": True,
+    # product name in device info
+    "product": True,
+    # ip reported by /info and /api/device/state for devices without one
+    "info_ip": "192.168.1.11",
+    "state_ip": "192.168.1.11",
+}
+
+API_LEVELS = {
+    "20180604": {**LATEST, "info": False, "product": False},
+    "20190808": {**LATEST, "info": False, "product": False},
+    "20190911": {**LATEST, "info": False, "product": False},
+    "20200229": {**LATEST, "info_ip": "192.168.1.12", "state_ip": "192.168.1.13"},
+    "20200831": LATEST,
+    "20210413": LATEST,
+    "20220114": LATEST,
+    "20230102": LATEST,
+    "20230606": LATEST,
+}
+
+FIRMWARE = {
+    "hv": "0.2",
+    "fv": "0.247",
+}
+
+NETWORK = {
+    "bssid": "70:4f:25:24:11:ae",
+    "mac": "bb:50:ec:2d:22:17",
+    "tunnel_status": 5,
+    "channel": 7,
+}
+
+validate_device_set = kit.payload_validator({
+    ".network.apEnable": bool,
+    ".network.apSSID": str,
+    ".network.apPasswd": str,
+})
+
+validate_wifi_connect = kit.payload_validator({
+    ".ssid": str,
+    ".pwd": str,
+})
+
+WIFI_SCAN = {
+    "ap": [
+        {
+            "ssid": "Funny_WiFi_Name",
+            "rssi": -60,
+            "enc": 3
+        },
+        {
+            "ssid": "Less_Funny_WiFi_Name",
+            "rssi": -75,
+            "enc": 4
+        },
+        {
+            "ssid": "Not_Funny_WiFi_Name",
+            "rssi": -90,
+            "enc": 0
+        }
+    ]
+}
+
+
+@functools.cache
+def make_blueprint(api_version: str) -> Blueprint:
+    """Return blueprint of common endpoints of given api level"""
+    level = API_LEVELS[api_version]
+    bp = Blueprint(f'v{api_version}common', __name__)
+    static_info = {"apiLevel": api_version, **FIRMWARE}
+
+    def device_info(device, ip: str) -> dict:
+        info = {
+            "deviceName": device.name,
+            "type": device.DEVICE_TYPE,
+            **static_info,
+            "id": device.id,
+            "ip": device.ip or ip,
+        }
+        if level["product"]:
+            info["product"] = device.PRODUCT_NAME
+        return info
+
+    @bp.route("/", methods=["GET"])
+    def index():
+        device = current_device()
+        return f"I'm a {device.name}"
+
+    if level["info"]:
+        @bp.route("/info", methods=["GET"])
+        @cached_json
+        def info():
+            return {"device": device_info(current_device(), level["info_ip"])}
+
+    # deprecated since /info, and served by the `info` endpoint before it
+    @bp.route("/api/device/state", methods=["GET"], endpoint="api_device_state" if level["info"] else "info")
+    @cached_json
+    def api_device_state():
+        return {"device": device_info(current_device(), level["state_ip"])}
+
+    # note: /api/device/uptime is a fast route of every device, see Device
+
+    @bp.route("/api/ota/update", methods=["POST"])
+    def api_ota_update():
+        return
+
+    @bp.route("/api/device/network", methods=["GET"])
+    @cached_json
+    def api_device_network():
+        device = current_device()
+        res = {
+            **device.state_ap_network,
+            **device.state_network,
+            **NETWORK,
+            "ip": device.ip or "192.168.1.11",
+        }
+        res.pop("pwd")
+        return res
+
+    @bp.route("/api/device/set", methods=["POST"])
+    def api_device_set():
+        device = current_device()
+        ap_enable, ap_ssid, ap_passwd = validate_device_set(request.json)
+        device.state_ap_network.update({
+            "apEnable": ap_enable,
+            "apSSID": ap_ssid,
+            "apPasswd": ap_passwd,
+        })
+        device.responses.clear()
+
+        return {
+            "device": device_info(device, "192.168.1.11"),
+            "network": {
+                "ssid": "WiFi_Name",
+                "ip": device.ip or "192.168.1.11",
+                "station_status": 5,
+                **NETWORK,
+                **device.state_ap_network,
+            }
+        }
+
+    @bp.route("/api/wifi/scan", methods=["GET"])
+    @cached_json
+    def api_wifi_scan():
+        return WIFI_SCAN
+
+    @bp.route("/api/wifi/connect", methods=["POST"])
+    def api_wifi_connect():
+        device = current_device()
+        ssid, pwd = validate_wifi_connect(request.json)
+        device.state_network.update({
+            "ssid": ssid,
+            "pwd": pwd,
+        })
+        device.responses.clear()
+        return {
+            "ssid": device.state_network["ssid"],
+            "station_status": device.state_network["station_status"],
+        }
+
+    # note: disconnect behaves exactly like connect
+    bp.add_url_rule("/api/wifi/disconnect", "api_wifi_disconnect", api_wifi_connect, methods=["POST"])
+
+    return bp
@@ -0,0 +1,338 @@
+"""Base for device simulators
+
+Every device type is a `Device` subclass whose instances own their state, mode and
+variant. Route handlers are plain methods marked with `@route()`. Flask app with
+all of the routes (and the common blueprint) is built once per device type and
+shared by all of its instances. The instance handling a request is passed in the
+WSGI environ, so a single process can host any number of independent devices:
+
+    shutter = ShutterBox(mode=3, variant="tilt")
+    make_server("127.0.0.1", 5153, shutter.wsgi_app)
+
+Polling endpoints marked with `@fast_route()` skip Flask altogether: their exact
+paths are looked up in a dict and the handler result is encoded and written as is.
+"""
+import atexit
+import functools
+import hashlib
+import inspect
+import os
+import signal
+import sys
+import threading
+import time
+
+from flask import Flask, current_app, request
+
+from . import _kit as kit
+from ._scheduler import default_scheduler
+from ._statelog import StateLog
+from ._template import json_response
+
+ENVIRON_KEY = "fakebox.device"
+
+
+def route(rule: str, **options):
+    """Mark device method as a route handler, takes the same arguments as `Flask.route`"""
+    def decorator(f):
+        f.routes = [*getattr(f, "routes", []), (rule, options)]
+        return f
+    return decorator
+
+
+def fast_route(rule: str):
+    """Mark device method as a GET route handler that is served without Flask
+
+    Handler must not use `request`. It returns JSON payload, or payload already
+    encoded the way Flask would encode it (e.g. rendered from templates).
+    """
+    def decorator(f):
+        f.fast_routes = [*getattr(f, "fast_routes", []), rule]
+        return route(rule, methods=["GET"])(f)
+    return decorator
+
+
+def current_device() -> "Device":
+    """Return device instance handling the current request"""
+    return request.environ.get(ENVIRON_KEY) or current_app.config["DEVICE"]
+
+
+def cached_json(view):
+    """Serve view response from encoded bytes cached per device, with strong ETag
+
+    For endpoints whose response only changes when device settings do. Views that
+    change them must clear `device.responses`.
+    """
+    @functools.wraps(view)
+    def wrapper(**kwargs):
+        device = current_device()
+        key = request.endpoint
+
+        if (entry := device.responses.get(key)) is None:
+            response = current_app.make_response(view(**kwargs))
+            body = response.get_data()
+            etag = f'"{hashlib.md5(body).hexdigest()}"'
+            entry = (body, etag, [("Content-Type", response.content_type), ("ETag", etag)])
+            device.responses[key] = entry
+
+        body, etag, headers = entry
+        # note: cheap check for the exact tag we sent, falls back to full parsing
+        #       for lists of tags and weak comparison
+        if_none_match = request.environ.get("HTTP_IF_NONE_MATCH")
+        if if_none_match and (if_none_match == etag or request.if_none_match.contains_weak(etag[1:-1])):
+            return current_app.response_class(status=304, headers=headers[1:])
+
+        return current_app.response_class(body, headers=headers)
+
+    return wrapper
+
+
+def find_device_class(module) -> type["Device"]:
+    """Return device type defined in given device module"""
+    for value in vars(module).values():
+        if inspect.isclass(value) and issubclass(value, Device) and value.__module__ == module.__name__:
+            return value
+    raise LookupError(f"no device type defined in {module.__name__}")
+
+
+def module_app(module_name: str, device_type: type["Device"]):
+    """Return module `__getattr__` that creates the module's `device` and `app` on first use
+
+    Importing a device module only defines its device type. Device configured from
+    the environment (and so its logging and app) is created when `flask --app
+    devices.<module>` (or anything else) asks for it. With RELOAD set, the module is
+    reloaded on changes (see _reload.py), with STATE_LOG set device state is logged
+    there and replayed on the next start (see _statelog.py):
+
+        __getattr__ = module_app(__name__, ShutterBox)
+    """
+    def __getattr__(name: str):
+        if name not in ("device", "app"):
+            raise AttributeError(f"module {module_name!r} has no attribute {name!r}")
+
+        module = sys.modules[module_name]
+        variant = os.environ.get("VARIANT", "")
+        kit.setup_logging(module_name if not variant else f"{module_name}[{variant}]")
+        module.device = device_type.from_env()
+        module.device.start()
+        module.app = module.device.default_app()
+
+        if path := os.environ.get("STATE_LOG"):
+            state_log = StateLog(path, [module.device])
+            state_log.replay()
+            state_log.start()
+            atexit.register(state_log.stop)
+            # note: exit handlers don't run when terminated (e.g. by the launcher), unlike
+            #       when interrupted, which the development server takes for a normal exit
+            if threading.current_thread() is threading.main_thread():
+                signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+        if os.environ.get("RELOAD"):
+            # note: imported here, _reload.py needs this module first
+            from ._reload import Reloader
+            Reloader([module.device]).start()
+        return getattr(module, name)
+
+    return __getattr__
+
+
+def _view(name: str):
+    # note: method is resolved on every call, so views always use the device's
+    #       current class
+    def view(**kwargs):
+        return getattr(current_device(), name)(**kwargs)
+
+    view.__name__ = name
+    return view
+
+
+def _fast_view(name: str):
+    # note: fast route handlers may return encoded payloads
+    def view(**kwargs):
+        response = getattr(current_device(), name)(**kwargs)
+        if type(response) is bytes:
+            return json_response(response)
+        return response
+
+    view.__name__ = name
+    return view
+
+
+def _journal(response):
+    # note: fast routes change nothing, only requests served by Flask are logged
+    device = current_device()
+    if device.journal is not None:
+        device.journal.record(device)
+    return response
+
+
+def _compact(app: Flask) -> bool:
+    """Tell if app encodes JSON responses compact, i.e. as fast routes do"""
+    compact = app.json.compact
+    return compact is True or (compact is None and not app.debug)
+
+
+class Device:
+    DEVICE_TYPE: str
+    PRODUCT_NAME: str = None
+    # api level, selects the blueprint of common endpoints (see _common.py)
+    API_VERSION: str
+    blueprint = None
+    scheduler = None
+    # record in memory shared by worker processes, see _shared.py
+    shared = None
+    # log of device state that survives restarts, see _statelog.py
+    journal = None
+    # what relays are switched to after restart (`stateAfterRestart`): 0 off, 1 on, 2 last state
+    STATE_AFTER_RESTART = 2
+    # state that has to be shared by worker processes, (path, struct format) pairs
+    STATE_LAYOUT = (
+        ("state_ap_network.apEnable", "?"),
+        ("state_ap_network.apSSID", "64s"),
+        ("state_ap_network.apPasswd", "64s"),
+        ("state_network.ssid", "64s"),
+        ("state_network.pwd", "64s"),
+    )
+
+    def __init__(self, *, name_suffix: str = "", serial: int = None, ip: str = None):
+        product = self.PRODUCT_NAME or self.DEVICE_TYPE
+
+        self.name_suffix = name_suffix
+        self.serial = serial
+        # note: None means the api-level specific default used by _common.py blueprints
+        self.ip = ip
+
+        if serial is None:
+            self.name = f"My {product} {name_suffix} (v{self.API_VERSION})"
+        else:
+            self.name = f"My {product} {name_suffix} #{serial} (v{self.API_VERSION})"
+
+        self.id = kit.device_id(product + name_suffix, self.API_VERSION, serial)
+        self.ap_ssid = f"{product}-g650e32d2217"
+        self.ref_time = time.time()
+        # encoded responses of endpoints decorated with cached_json()
+        self.responses = {}
+
+        self.state_ap_network = {
+            "apEnable": True,
+            "apSSID": self.ap_ssid,
+            "apPasswd": "my_secret_password"
+        }
+
+        self.state_network = {
+            "ssid": "WiFi_Name",
+            "pwd": "my_secret_password",
+            "station_status": 5
+        }
+
+    @classmethod
+    def from_env(cls):
+        """Create device configured with MODE/VARIANT/FAULTY environment variables"""
+        return cls()
+
+    @classmethod
+    def make_app(cls) -> Flask:
+        app = Flask(cls.__module__)
+        app.register_blueprint(cls.blueprint)
+        app.after_request(_journal)
+
+        for name, member in inspect.getmembers(cls, inspect.isfunction):
+            if not hasattr(member, "routes"):
+                continue
+
+            view = _fast_view(name) if hasattr(member, "fast_routes") else _view(name)
+            for rule, options in member.routes:
+                app.add_url_rule(rule, name, view, **options)
+
+        return app
+
+    @classmethod
+    def make_fast_routes(cls) -> dict[str, str]:
+        """Return names of fast route handlers by their paths"""
+        fast_routes = {}
+        for name, member in inspect.getmembers(cls, inspect.isfunction):
+            for rule in getattr(member, "fast_routes", []):
+                fast_routes[rule] = name
+        return fast_routes
+
+    @classmethod
+    def get_app(cls) -> Flask:
+        """Return Flask app shared by all devices of this type"""
+        if "_app" not in cls.__dict__:
+            cls._fast_routes = cls.make_fast_routes()
+            cls._app = cls.make_app()
+        return cls._app
+
+    @property
+    def json(self):
+        """JSON provider of the device type app, usable outside of app context"""
+        return self.get_app().json
+
+    def default_app(self) -> Flask:
+        """Return device type app that serves this device when none is given in environ
+
+        This is what `flask --app devices.<module> run` uses.
+        """
+        app = self.get_app()
+        app.config["DEVICE"] = self
+        return app
+
+    def wsgi_app(self, environ, start_response):
+        environ[ENVIRON_KEY] = self
+        if self.shared is None:
+            return self.dispatch(environ, start_response)
+
+        with self.shared:
+            return self.dispatch(environ, start_response)
+
+    def dispatch(self, environ, start_response):
+        app = self.get_app()
+
+        if environ["REQUEST_METHOD"] == "GET" and (name := self._fast_routes.get(environ["PATH_INFO"])):
+            # note: debug mode makes Flask indent JSON, so leave it to Flask then
+            if _compact(app):
+                body = getattr(self, name)()
+                if type(body) is not bytes:
+                    body = f"{app.json.dumps(body, separators=(',', ':'))}\n".encode()
+
+                start_response("200 OK", [("Content-Type", app.json.mimetype), ("Content-Length", str(len(body)))])
+                return [body]
+
+        return app(environ, start_response)
+
+    @fast_route("/api/device/uptime")
+    def api_device_uptime(self):
+        return {"upTimeS": time.time() - self.ref_time}
+
+    def forget(self):
+        """Drop responses encoded by code that may have changed since, see _reload.py"""
+        self.responses.clear()
+        if (snapshots := getattr(self, "snapshots", None)) is not None:
+            snapshots.clear()
+
+    def state_locks(self) -> list:
+        """Return locks guarding state of moving devices, in the order their code takes them"""
+        locks = (getattr(self, name, None) for name in ("state_lock", "internal_state_lock"))
+        return [lock for lock in locks if lock is not None]
+
+    def restarted(self):
+        """Bring state restored from the state log to what device has after restart"""
+        if (relays := getattr(self, "relays", None)) is not None and self.STATE_AFTER_RESTART in (0, 1):
+            for relay in relays:
+                relays[relay] = self.STATE_AFTER_RESTART
+
+    def start(self, scheduler=None):
+        """Attach device to the scheduler that will tick it"""
+        self.scheduler = scheduler or default_scheduler()
+
+    def wake(self, delay: float):
+        """Request tick in `delay` seconds, e.g. when shutter will reach its target"""
+        if self.scheduler is not None:
+            self.scheduler.wake(self, delay)
+
+    def tick(self) -> float | None:
+        """Handle event that device asked for with `wake()`
+
+        Returns seconds until the next event, or None if there is none.
+        """
+        return None
@@ -0,0 +1,128 @@
+"""Fleet of simulated devices described with a manifest file
+
+Manifest (TOML or JSON) lists device groups. Every group is instantiated `count`
+times and each device gets distinct serial number (so distinct id and name),
+ip address and port:
+
+    # first port and the pool of reported ip addresses (both optional)
+    port = 6000
+    network = "192.168.0.0/16"
+
+    [[devices]]
+    type = "shutterbox"
+    api = "20190911"
+    mode = 3
+    variant = "tilt"
+    count = 500
+
+    [[devices]]
+    type = "switchboxd"
+    api = "20200831"
+    count = 1000
+
+Usage:
+
+    python -m devices._fleet fleet.example.toml
+    python -m devices._fleet fleet.example.toml --dry-run
+
+With `--loopback` devices get addresses of a loopback network instead (`port` and
+`network` of the manifest are ignored) and all of them are served on port 80:
+
+    python -m devices._fleet fleet.example.toml --loopback
+"""
+import argparse
+import ipaddress
+import json
+import logging
+import sys
+import time
+import tomllib
+import tracemalloc
+
+from ._host import add_server_arguments, by_address, make_device, run, server_options
+from ._registry import REGISTRY
+
+DEFAULT_PORT = 6000
+DEFAULT_NETWORK = "192.168.0.0/16"
+
+# manifest keys that are passed to device constructors
+DEVICE_OPTIONS = ("mode", "variant", "faulty", "amplitude", "snapshot_quantum")
+
+
+def load_manifest(path: str) -> dict:
+    with open(path, "rb") as f:
+        if path.endswith(".json"):
+            return json.load(f)
+        return tomllib.load(f)
+
+
+def build_fleet(manifest: dict):
+    """Instantiate devices listed in manifest
+
+    Returns list of (port, device, log prefix) bindings ready to be served.
+    """
+    port = manifest.get("port", DEFAULT_PORT)
+    ips = ipaddress.ip_network(manifest.get("network", DEFAULT_NETWORK)).hosts()
+    serial = 0
+    bindings = []
+
+    for group in manifest["devices"]:
+        module = REGISTRY.find(group["type"], group["api"])
+        options = {key: group[key] for key in DEVICE_OPTIONS if key in group}
+
+        for _ in range(group.get("count", 1)):
+            try:
+                ip = str(next(ips))
+            except StopIteration:
+                raise ValueError(f"network {manifest.get('network', DEFAULT_NETWORK)} is too small for the fleet")
+
+            device = make_device(module, {**options, "serial": serial, "ip": ip})
+            bindings.append((port, device, f"{module}#{serial}"))
+            port += 1
+            serial += 1
+
+    return bindings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run fleet of simulators described by a manifest")
+    parser.add_argument("manifest", help="path to TOML or JSON manifest")
+    parser.add_argument("--dry-run", action="store_true", help="only build the fleet and report its cost")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+    manifest = load_manifest(args.manifest)
+
+    # note: import device modules up front, so their cost is not counted per device
+    for group in manifest["devices"]:
+        REGISTRY.get(REGISTRY.find(group["type"], group["api"]))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    bindings = build_fleet(manifest)
+    elapsed = time.perf_counter() - started
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(
+        f"fleet: {len(bindings)} devices built in {elapsed:.2f}s, "
+        f"{memory / 1024:.0f} KiB total, {memory / max(len(bindings), 1) / 1024:.1f} KiB per device",
+        flush=True,
+    )
+    if args.loopback:
+        bindings = by_address(bindings, args.loopback, args.loopback_port)
+        ips = list(bindings[0][1].devices)
+        if ips:
+            print(f"addresses: {ips[0]}-{ips[-1]}, port {args.loopback_port}", flush=True)
+    elif bindings:
+        print(f"ports: {bindings[0][0]}-{bindings[-1][0]}", flush=True)
+
+    if args.dry_run:
+        return
+
+    run(bindings, **server_options(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""Single-process host for the whole simulator suite
+
+Instead of starting one `flask run` process per device (see all.sh) this imports
+every device module once and binds all of the ports inside a single interpreter:
+
+    python -m devices._host
+    python -m devices._host -k shutterbox
+
+Each entry is a separate instance of the device type, so variants of the same
+device (e.g. shutterbox modes) get their own state.
+
+To use more than one core, serve the same devices from several worker processes
+(their state is shared, see _shared.py):
+
+    python -m devices._host --workers 4
+
+Like real devices, all of them can listen on port 80, each at its own loopback
+address (see _addresses.py):
+
+    python -m devices._host --loopback
+
+Add `--mdns` to advertise the devices as `_bbxsrv._tcp` services (see _mdns.py),
+and `--reload` to reload device modules when they change, keeping the state of
+their devices (see _reload.py).
+
+With `--snapshot PATH` state of all devices is restored from PATH at startup (if it
+exists), saved to it on SIGUSR1 and restored from it again on SIGHUP (see
+_snapshot.py). With `--state-log PATH` changes of device state are logged to PATH and
+replayed on the next start (see _statelog.py).
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import threading
+
+from ._addresses import DEFAULT_NETWORK, DEFAULT_PORT, AddressIndex, loopback_addresses, restrict_to_loopback
+from ._aio import AsyncServer
+from ._mdns import Responder
+from ._server import DEFAULT_KEEPALIVE, DEFAULT_THREADS, KeepAliveRequestHandler, PooledServer, QuietRequestHandler
+from ._registry import REGISTRY
+from ._reload import Reloader
+from ._shared import SharedStates
+from ._snapshot import handle_signals, restore
+from ._statelog import StateLog
+
+# file descriptors besides listening sockets: connections, log files, selectors
+OPEN_FILES_HEADROOM = 256
+
+# (port, module, device options) - also run by `python -m devices`, one process each
+FLEET = [
+    # --- switchbox family
+    (5001, "switchboxd_20190808", {}),
+    (5002, "switchboxd_20200229", {}),
+    (5003, "switchboxd_20200831", {}),
+    (5011, "switchbox_20180604", {}),
+    (5012, "switchbox_20190808", {}),
+    (5013, "switchbox_20200229", {}),
+    (5014, "switchbox_20200831", {}),
+    (5015, "switchbox_20220114", {}),
+    # --- floodsensor family
+    (5021, "floodsensor_20200831", {}),
+    (5022, "floodsensor_20210413", {}),
+    # --- windrainsensor family
+    (5031, "windrainsensor_20200831", {}),
+    (5032, "windrainsensor_20210413", {}),
+    # --- lightbox family
+    (5041, "wlightbox_20200229", {"mode": 1}),  # RGBW
+    (5042, "wlightbox_20200229", {"mode": 2}),  # RGB
+    (5043, "wlightbox_20200229", {"mode": 3}),  # MONO
+    (5044, "wlightbox_20200229", {"mode": 4}),  # RGBorW
+    (5045, "wlightbox_20200229", {"mode": 5}),  # CT
+    (5046, "wlightbox_20200229", {"mode": 6}),  # CTx2
+    (5047, "wlightbox_20200229", {"mode": 7}),  # RGBWW
+    # --- multisensor family
+    (5051, "multisensor_20220114", {}),
+    (5052, "multisensor_20230606", {}),
+    # --- smartmeter family (multisensor flavour)
+    (5061, "smartmeter_20230606", {}),
+    # --- shutterbox family
+    (5151, "shutterbox_20190911", {"mode": 1, "variant": "segmented"}),
+    (5152, "shutterbox_20190911", {"mode": 2, "variant": "nocalib"}),
+    (5153, "shutterbox_20190911", {"mode": 3, "variant": "tilt"}),
+    (5155, "shutterbox_20190911", {"mode": 4, "variant": "window"}),
+    (5156, "shutterbox_20190911", {"mode": 5, "variant": "material"}),
+    (5157, "shutterbox_20190911", {"mode": 6, "variant": "awning"}),
+    (5158, "shutterbox_20190911", {"mode": 7, "variant": "screen"}),
+    (5159, "shutterbox_20190911", {"mode": 8, "variant": "curtain"}),
+    # --- gatebox family
+    (5161, "gatebox_20230102", {"mode": 0, "variant": "step-by-step"}),
+    (5162, "gatebox_20230102", {"mode": 1, "variant": "only-open"}),
+    (5163, "gatebox_20230102", {"mode": 2, "variant": "open-close"}),
+    # --- faulty devices ---
+    (5953, "shutterbox_20190911", {"faulty": True, "mode": 3, "variant": "tilt-faulty"}),
+]
+
+
+def make_device(module: str, options: dict):
+    """Create new instance of the device type defined in devices.<module>"""
+    return REGISTRY.create(module, **options)
+
+
+def by_address(bindings, network: str = DEFAULT_NETWORK, port: int = DEFAULT_PORT):
+    """Return binding that serves devices of given bindings on one port, each at its own address
+
+    Addresses come from given loopback network, devices report them as their ip.
+    """
+    index = AddressIndex()
+    addresses = loopback_addresses(network)
+    for _, device, _ in bindings:
+        try:
+            device.ip = next(addresses)
+        except StopIteration:
+            raise ValueError(f"network {network} is too small for {len(bindings)} devices")
+        index.add(device.ip, device)
+
+    return [(port, index, f"{network}:{port}")]
+
+
+def served_devices(bindings) -> list:
+    """Return all devices of given bindings, including the ones served by address"""
+    devices = []
+    for _, device, _ in bindings:
+        devices.extend(device.devices.values() if isinstance(device, AddressIndex) else [device])
+    return devices
+
+
+def advertised_services(bindings, host: str = "127.0.0.1") -> list[tuple[str, str, int]]:
+    """Return (instance name, ip, port) services of devices of given bindings"""
+    # note: devices bound to all addresses are advertised at the loopback one
+    ip = host if host != "0.0.0.0" else "127.0.0.1"
+    services = []
+    for port, device, prefix in bindings:
+        if isinstance(device, AddressIndex):
+            services.extend(
+                (f"{d.__module__.rsplit('.', 1)[-1]}@{address}", address, port) for address, d in device.devices.items()
+            )
+        else:
+            services.append((f"{prefix}@{ip}:{port}", ip, port))
+    return services
+
+
+class PrefixAdapter(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        return f"{self.extra['prefix']: <30} > {msg}", kwargs
+
+
+def access_logger(prefix: str) -> logging.LoggerAdapter:
+    return PrefixAdapter(logging.getLogger(f"fakebox.{prefix}"), {"prefix": prefix})
+
+
+def request_handler(prefix: str, quiet: bool = False):
+    logger = access_logger(prefix)
+
+    class Handler(QuietRequestHandler if quiet else KeepAliveRequestHandler):
+        def log(self, type: str, message: str, *args):
+            getattr(logger, type)(f"{self.address_string()} - {message}", *args)
+
+    return Handler
+
+
+def served_by_address(sock, device):
+    """Keep devices served by their loopback addresses off the network, see _addresses.py"""
+    if isinstance(device, AddressIndex) and not restrict_to_loopback(sock):
+        host, port = sock.getsockname()[:2]
+        print(f"warning: {host}:{port} is reachable from the network, not just the loopback one", flush=True)
+
+
+def serve(
+    bindings,
+    host: str = "127.0.0.1",
+    engine: str = "threads",
+    threads: int = DEFAULT_THREADS,
+    keepalive: float = DEFAULT_KEEPALIVE,
+    quiet: bool = False,
+    reuse_port: bool = False,
+    reload: bool = False,
+):
+    """Serve devices on their ports, bindings are (port, device, log prefix) tuples"""
+    if engine == "asyncio":
+        server = AsyncServer(keepalive=keepalive)
+        for port, device, prefix in bindings:
+            sock = server.bind(host, port, device, None if quiet else access_logger(prefix), reuse_port)
+            served_by_address(sock, device)
+    else:
+        server = PooledServer(threads=threads, keepalive=keepalive)
+        for port, device, prefix in bindings:
+            device.start()
+            sock = server.bind(host, port, device.wsgi_app, request_handler(prefix, quiet), reuse_port).socket
+            served_by_address(sock, device)
+
+    # note: device modules set up logging when their `app` is used and we
+    #       don't want every request to be logged once per such module
+    logging.getLogger("werkzeug").handlers.clear()
+
+    server.serve_in_background()
+    if reload:
+        Reloader(served_devices(bindings)).start()
+    return server
+
+
+def wait(server: PooledServer | AsyncServer):
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+
+def raise_open_files_limit(bindings, headroom: int = OPEN_FILES_HEADROOM):
+    """Let the process open a listening socket per binding, exit if it may not
+
+    The common soft limit of 1024 open files is far too low for fleets of thousands
+    of devices, it's raised to the hard limit.
+    """
+    needed = len(bindings) + headroom
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY or soft >= needed:
+        return
+
+    try:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ValueError, OSError):
+        # note: macOS refuses anything above OPEN_MAX, even with an unlimited hard limit
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(needed, hard), hard))
+
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        raise SystemExit(
+            f"serving {len(bindings)} ports needs about {needed} file descriptors, but only {soft} may be open "
+            f"(raise the hard limit, e.g. `ulimit -Hn {needed}` as root, or serve devices with --loopback)"
+        )
+
+
+def run(bindings, workers: int = 1, mdns: bool = False, snapshot: str = None, state_log: str = None, **options):
+    """Serve devices until interrupted, from given number of worker processes"""
+    raise_open_files_limit(bindings)
+    if snapshot and os.path.exists(snapshot):
+        restore(snapshot, served_devices(bindings))
+    # note: state log is more recent than any snapshot
+    if state_log:
+        state_log = StateLog(state_log, served_devices(bindings))
+        state_log.replay()
+
+    responder = Responder(advertised_services(bindings, options.get("host", "127.0.0.1"))) if mdns else None
+
+    if workers == 1:
+        server = serve(bindings, **options)
+        if state_log:
+            state_log.start()
+        if snapshot:
+            handle_signals(snapshot, served_devices(bindings), state_log)
+        if responder:
+            responder.serve_in_background()
+        # note: like an interrupt, so that queued state log records are written on `kill`
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        wait(server)
+        if responder:
+            responder.shutdown()
+        if state_log:
+            state_log.stop()
+        report_snapshots(bindings)
+        return
+
+    shared = SharedStates(served_devices(bindings))
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(target=run_worker, args=(bindings, options), name=f"fakebox-worker-{i}")
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    # note: started after forking, workers don't need its thread
+    if responder:
+        responder.serve_in_background()
+    # note: devices of the host are backed by the shared memory, so it saves and
+    #       restores state of all workers
+    if state_log:
+        state_log.start(polled=True)
+    if snapshot:
+        handle_signals(snapshot, served_devices(bindings), state_log)
+
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # note: workers got their own SIGINT, unless the host was terminated
+        for process in processes:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+    finally:
+        if responder:
+            responder.shutdown()
+        if state_log:
+            state_log.stop()
+        shared.close()
+
+
+def run_worker(bindings, options: dict):
+    wait(serve(bindings, reuse_port=True, **options))
+    report_snapshots(bindings)
+
+
+def report_snapshots(bindings):
+    """Print how many sensor reads were served from snapshots"""
+    caches = [device.snapshots for device in served_devices(bindings) if hasattr(device, "snapshots")]
+    if not caches:
+        return
+
+    hits = sum(cache.hits for cache in caches)
+    misses = sum(cache.misses for cache in caches)
+    print(f"snapshots: {hits} hits, {misses} misses ({hits / max(hits + misses, 1):.0%} served from cache)", flush=True)
+
+
+def add_server_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--host",
+        help="address to bind (default: 127.0.0.1, or all addresses of the loopback interface with --loopback)"
+    )
+    parser.add_argument(
+        "--engine", choices=("threads", "asyncio"), default="threads",
+        help="serve devices from a pool of threads or from a single asyncio loop (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=DEFAULT_THREADS,
+        help="number of worker threads shared by all devices (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--keepalive", type=float, default=DEFAULT_KEEPALIVE,
+        help="seconds after which idle connections are closed (default: %(default)s)"
+    )
+    parser.add_argument("--quiet", action="store_true", help="do not log requests")
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="number of processes serving all devices, with device state shared (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--loopback", nargs="?", const=DEFAULT_NETWORK, metavar="NETWORK",
+        help=f"serve all devices on one port, each at its own address of loopback network (default: {DEFAULT_NETWORK})"
+    )
+    parser.add_argument("--mdns", action="store_true", help="advertise devices with multicast DNS")
+    parser.add_argument(
+        "--reload", action="store_true", help="reload device modules when they change, keeping device state"
+    )
+    parser.add_argument(
+        "--snapshot", metavar="PATH",
+        help="restore device state from PATH at startup, save it there on SIGUSR1 and restore it on SIGHUP"
+    )
+    parser.add_argument(
+        "--state-log", metavar="PATH", help="log changes of device state to PATH and replay them on the next start"
+    )
+    parser.add_argument(
+        "--loopback-port", type=int, default=DEFAULT_PORT,
+        help="port of devices served with --loopback (default: %(default)s)"
+    )
+
+
+def server_options(args: argparse.Namespace) -> dict:
+    return {
+        "host": args.host or ("0.0.0.0" if args.loopback else "127.0.0.1"),
+        "engine": args.engine,
+        "threads": args.threads,
+        "keepalive": args.keepalive,
+        "quiet": args.quiet,
+        "workers": args.workers,
+        "mdns": args.mdns,
+        "reload": args.reload,
+        "snapshot": args.snapshot,
+        "state_log": args.state_log,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run all simulators in a single process")
+    parser.add_argument("-k", dest="filter", help="filter devices by name")
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+    bindings = []
+    for port, module, options in FLEET:
+        if args.filter and args.filter not in module:
+            continue
+
+        prefix = module if "variant" not in options else f"{module}[{options['variant']}]"
+        bindings.append((port, make_device(module, options), prefix))
+        if not args.loopback:
+            print(f"port[{port}]: {module}", flush=True)
+
+    if args.loopback:
+        bindings = by_address(bindings, args.loopback, args.loopback_port)
+        for ip, device in bindings[0][1].devices.items():
+            print(f"ip[{ip}]: {device.__module__.rsplit('.', 1)[-1]}", flush=True)
+
+    run(bindings, **server_options(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,18 @@
+import collections
 import hashlib
 import logging
 import math
 import sys
+import threading
 
 from werkzeug.exceptions import BadRequest
 
 
-# todo: make two param
-def device_id(name_ref: str, ver_ref: str):
+def device_id(name_ref: str, ver_ref: str, serial: int = None):
     """Return consistently unique device ID for (device name, api version) pair
 
+    Clones of the same device (e.g. in a fleet) are told apart with serial number.
+
     Example usage:
 
         @app.route("/api/device/state", methods=["GET"])
@@ -26,6 +29,8 @@ def device_id(name_ref: str, ver_ref: str):
                     "ip": "192.168.1.11"
                 }
     """
+    if serial is not None:
+        name_ref = f"{name_ref}#{serial}"
     return hashlib.md5(f"{name_ref}-{ver_ref}".encode()).hexdigest()
 
 
@@ -36,38 +41,246 @@ def synthetic_signal(t: float):
     return math.sin(math.sqrt(x)) + math.cos(x / 2) + 2 + math.cos(math.cos(x))
 
 
-def t_integral(t0, t1, f, steps=1000):
-    """Approximate integral of f() with trapeze method"""
-    assert t0 < t1
-    area = 0
-    delta = t1 - t0
-    dx = delta / steps
+def _bessel_j(n: int, x: float, terms: int = 20) -> float:
+    return sum((-1) ** m / (math.factorial(m) * math.factorial(m + n)) * (x / 2) ** (2 * m + n) for m in range(terms))
+
+
+# cos(cos(x)) = J0(1) + 2 * sum((-1)^k * J2k(1) * cos(2kx)), higher terms are negligible
+_COS_COS_MEAN = _bessel_j(0, 1)
+_COS_COS_HARMONICS = [(2 * k, (-1) ** k * _bessel_j(2 * k, 1) / k) for k in range(1, 8)]
+
+
+def synthetic_energy(t: float) -> float:
+    """Antiderivative of synthetic_signal(), i.e. energy [Ws] used since t=0
+
+    synthetic_signal() is positive, so it is strictly increasing and differences
+    of it are consistent with synthetic_signal() taken as power [W].
+    """
+    x = t / 10000
+    u = math.sqrt(x)
+    return 10000 * (
+        # sin(sqrt(x)), substituting u = sqrt(x)
+        2 * (math.sin(u) - u * math.cos(u))
+        + 2 * math.sin(x / 2)
+        + 2 * x
+        + _COS_COS_MEAN * x + sum(c * math.sin(k * x) for k, c in _COS_COS_HARMONICS)
+    )
+
+
+def energy_used(t0: float, t1: float) -> float:
+    """Return energy [kWh] used between t0 and t1 when drawing synthetic_signal() Watts"""
+    return (synthetic_energy(t1) - synthetic_energy(t0)) / (1000 * 3600)
+
+
+class SlidingWindow:
+    """Mean and max of per-second samples of f() over the last `size` seconds
+
+    Samples are taken at whole seconds and kept in a ring buffer with a running
+    sum, plus a monotonic deque of max candidates. Reading costs O(1) and the
+    window is advanced by one call per elapsed second: `current()` for the second
+    being read (e.g. served from a batch, see _signals.py), f() for the ones it
+    has to catch up on.
+    """
+    def __init__(self, f, size: int = 600, current=None):
+        self.f = f
+        self.current = current or f
+        self.size = size
+        self.samples = [0] * size
+        self.total = 0
+        # (second, value) pairs with decreasing values, head is the window max
+        self.maxima = collections.deque()
+        self.last = None
+        self.lock = threading.Lock()
+
+    def _push(self, second: int, f):
+        value = f(second)
+        slot = second % self.size
+        self.total += value - self.samples[slot]
+        self.samples[slot] = value
+
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((second, value))
+
+        while self.maxima[0][0] <= second - self.size:
+            self.maxima.popleft()
+
+    def stats(self, t: float) -> tuple[int, int, int]:
+        """Return (mean, max, newest sample) of the window ending at t"""
+        now = math.floor(t)
+
+        with self.lock:
+            if self.last is None or not 0 <= now - self.last < self.size:
+                # note: first read, long idle or clock going backwards
+                self.samples = [0] * self.size
+                self.total = 0
+                self.maxima.clear()
+                self.last = now - self.size
+
+            for second in range(self.last + 1, now):
+                self._push(second, self.f)
+            if now != self.last:
+                self._push(now, self.current)
+            self.last = now
+
+            return self.total // self.size, self.maxima[0][1], self.samples[now % self.size]
+
+
+class SnapshotCache:
+    """Value computed once per `quantum` seconds and shared by everyone reading it
+
+    Values are computed for the start of their quantum, so all readers within it
+    see exactly the same. Hit and miss counters show how much work it saves.
+    """
+    def __init__(self, quantum: float = 1):
+        self.quantum = quantum
+        # (quantum number, value) of the last snapshot
+        self.entry = (None, None)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, t: float, compute):
+        """Return compute(t) snapshot for the quantum of t"""
+        key = math.floor(t / self.quantum)
+        entry_key, value = self.entry
+
+        if entry_key == key:
+            self.hits += 1
+            return value
+
+        # note: concurrent misses may compute the same snapshot twice, which is
+        #       cheaper than making every reader take a lock
+        self.misses += 1
+        value = compute(key * self.quantum)
+        self.entry = (key, value)
+        return value
+
+    def clear(self):
+        self.entry = (None, None)
 
-    for i in range(steps):
-        area += ((f(t0 + i * dx)) + f(t0 + (i + 1) * dx)) / 2 * dx
-    return area
 
+class Items:
+    """List of mappings following `schema`, with min_len..max_len items"""
+    def __init__(self, schema: dict, min_len: int, max_len: int, message: str = None):
+        self.schema = schema
+        self.min_len = min_len
+        self.max_len = max_len
+        self.message = message
 
-def require_field(data: dict, path: str, of_type=None, _lead=""):
-    assert path.startswith(".")
-    assert len(path) > 1
 
-    if not isinstance(data, dict):
-        raise BadRequest(f"Bad payload: expected {_lead or 'payload'} to be mapping")
+class Optional:
+    """Field that may be missing, None then"""
+    def __init__(self, of_type=None):
+        self.of_type = of_type
 
-    head, *rest = path[1:].rsplit(".")
-    val = data.get(head)
 
-    if head not in data:
-        raise BadRequest(f"Bad payload: missing {_lead}.{head} field")
+def _compile_mapping(schema: dict, lead: str):
+    """Return (check, size) of mapping schema, check(data, out) fills out[0:size]"""
+    # note: paths are merged into a tree, so shared parents are checked once
+    tree = {}
+    for index, (path, spec) in enumerate(schema.items()):
+        assert path.startswith(".")
+        assert len(path) > 1
 
-    if rest:
-        return require_field(data[head], f".{rest[0]}", of_type=of_type, _lead=f"{_lead}.{head}")
+        *parents, name = path[1:].split(".")
+        node = tree
+        for parent in parents:
+            node = node.setdefault(parent, {})
+        node[name] = (index, spec)
 
-    if of_type and not isinstance(data[head], of_type):
-        raise BadRequest(f"Bad payload: {_lead}.{head} has wrong type")
+    return _compile_node(tree, lead), len(schema)
 
-    return val
+
+def _compile_node(tree: dict, lead: str):
+    fields = []
+    for name, node in tree.items():
+        path = f"{lead}.{name}"
+        missing = f"Bad payload: missing {path} field"
+        if isinstance(node, dict):
+            fields.append((name, missing, None, _compile_node(node, path)))
+            continue
+
+        index, spec = node
+        if isinstance(spec, Optional):
+            fields.append((name, missing, index, _compile_leaf(path, spec.of_type, index)))
+        elif isinstance(spec, Items):
+            fields.append((name, missing, None, _compile_items(path, spec, index)))
+        else:
+            fields.append((name, missing, None, _compile_leaf(path, spec, index)))
+
+    not_mapping = f"Bad payload: expected {lead or 'payload'} to be mapping"
+
+    def check(data, out: list):
+        if not isinstance(data, dict):
+            raise BadRequest(not_mapping)
+
+        for name, missing, optional_index, check_field in fields:
+            if name in data:
+                check_field(data[name], out)
+            elif optional_index is not None:
+                out[optional_index] = None
+            else:
+                raise BadRequest(missing)
+
+    return check
+
+
+def _compile_leaf(path: str, of_type, index: int):
+    wrong_type = f"Bad payload: {path} has wrong type"
+
+    def check(value, out: list):
+        if of_type and not isinstance(value, of_type):
+            raise BadRequest(wrong_type)
+        out[index] = value
+
+    return check
+
+
+def _compile_items(path: str, spec: Items, index: int):
+    # note: one check per list position, each with its own error messages
+    checks = [_compile_mapping(spec.schema, f"{path}[{i}]")[0] for i in range(spec.max_len)]
+    size = len(spec.schema)
+    not_list = f"Bad payload: {path} must be a list"
+    wrong_length = spec.message or f"Bad payload: {path} must have {spec.min_len}..{spec.max_len} items"
+
+    def check(value, out: list):
+        if not isinstance(value, list):
+            raise BadRequest(not_list)
+        if not spec.min_len <= len(value) <= spec.max_len:
+            raise BadRequest(wrong_length)
+
+        items = []
+        for check_item, item in zip(checks, value):
+            item_out = [None] * size
+            check_item(item, item_out)
+            items.append(tuple(item_out))
+        out[index] = items
+
+    return check
+
+
+def payload_validator(schema: dict):
+    """Compile payload schema into function returning all its fields in one pass
+
+    Schema maps field paths to their types, `Optional` or `Items` specs. Returned
+    tuple has field values in schema order, `Items` fields are lists of tuples:
+
+        validate = payload_validator({
+            ".network.apSSID": str,
+            ".relays": Items({".relay": int, ".state": int}, 1, 2),
+        })
+        ssid, relays = validate(request.json)
+
+    Invalid payloads raise BadRequest telling what's wrong and where.
+    """
+    check, size = _compile_mapping(schema, "")
+
+    def validate(data) -> tuple:
+        out = [None] * size
+        check(data, out)
+        return tuple(out)
+
+    return validate
 
 
 def setup_logging(name: str):
@@ -79,11 +292,35 @@ def setup_logging(name: str):
     logger.handlers.append(handler)
 
 
-def step_state(current: float, desired: float, step: float) -> float:
-    if desired == current:
-        return desired
+class Motion:
+    """Linear motion from `position` at `started` time towards `target`
+
+    Position is evaluated lazily for any point in time, so nothing has to step it
+    while the device is moving.
+    """
+    __slots__ = ("position", "started", "target", "velocity")
+
+    def __init__(self, position: float, started: float = 0, target: float = None, velocity: float = 0):
+        self.position = position
+        self.started = started
+        self.target = position if target is None else target
+        self.velocity = abs(velocity)
+
+    def at(self, t: float) -> float:
+        distance = self.velocity * max(t - self.started, 0)
+        if distance >= abs(self.target - self.position):
+            return self.target
+        return self.position + math.copysign(distance, self.target - self.position)
+
+    def arrival(self) -> float:
+        """Return time at which target is reached"""
+        if self.target == self.position:
+            return self.started
+        return self.started + abs(self.target - self.position) / self.velocity
 
-    if abs(desired - current) < step:
-        return desired
+    def moving(self, t: float) -> bool:
+        return t < self.arrival()
 
-    return current + math.copysign(step, desired - current)
+    def retarget(self, target: float, t: float, velocity: float) -> "Motion":
+        """Return motion that continues from where this one is at t towards new target"""
+        return Motion(self.at(t), t, target, velocity)
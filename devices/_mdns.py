@@ -0,0 +1,510 @@
+"""Multicast DNS responder advertising devices as `_bbxsrv._tcp` services
+
+Discovery (e.g. of Home Assistant) browses for `_bbxsrv._tcp.local.` services. A
+single responder advertises all devices of the process from one socket, instead of
+a `dns-sd` process per device:
+
+    responder = Responder([("switchbox_20220114@127.0.0.1:5015", "127.0.0.1", 5015), ...])
+    responder.serve_in_background()
+    ...
+    responder.shutdown()    # says goodbye, so browsers forget the devices
+
+Every device is a PTR record (service -> instance), a SRV record (instance -> host
+and port), an empty TXT record and an A record of its host. Answers are packed as
+densely as they fit into packets (a thousand devices take ~70 of them), answers
+cached by question and multicast questions of all queriers answered in a batch, at
+most once a second.
+
+Queries sent from any other port than the mDNS one (like the `browse()` below) are
+answered directly to the sender, which makes the responder easy to try over
+loopback multicast, without disturbing the system responder:
+
+    python -m devices._mdns --count 10000 --interface 127.0.0.1 --port 5354
+"""
+import argparse
+import random
+import select
+import socket
+import struct
+import threading
+import time
+
+GROUP = "224.0.0.251"
+PORT = 5353
+SERVICE = ("_bbxsrv", "_tcp", "local")
+SERVICES = ("_services", "_dns-sd", "_udp", "local")
+
+# record types
+A = 1
+PTR = 12
+TXT = 16
+SRV = 33
+ANY = 255
+
+CLASS_IN = 1
+# class bit of records which are the only ones with their name and type
+CACHE_FLUSH = 0x8000
+# class bit of questions asking for a unicast response
+UNICAST = 0x8000
+
+# flags of a response, i.e. authoritative answer
+RESPONSE = 0x8400
+
+# seconds, as recommended by RFC 6762 for records with and without host names
+HOST_TTL = 120
+TTL = 4500
+# seconds, the longest ttl allowed in responses to legacy unicast queries
+LEGACY_TTL = 10
+
+# bytes, fits into an ethernet frame
+MAX_PACKET = 1460
+MAX_DATAGRAM = 9000
+# bytes, the kernel caps it with net.core.rmem_max
+RECEIVE_BUFFER = 4 * 1024 * 1024
+
+# seconds to collect queries for before answering them (RFC 6762: 20-120 ms)
+MIN_DELAY = 0.02
+MAX_DELAY = 0.12
+# seconds before the same question gets another multicast answer
+MIN_INTERVAL = 1.0
+
+HEADER = struct.Struct("!6H")
+RECORD = struct.Struct("!HHIH")
+QUESTION = struct.Struct("!HH")
+
+
+def key(labels: tuple) -> tuple:
+    """Return name labels compared case-insensitively"""
+    return tuple(label.lower() for label in labels)
+
+
+class Packet:
+    """DNS message being built, with names compressed
+
+    Records go to the answer section; nothing requires the additional one and
+    browsers cache records from both.
+    """
+    def __init__(self, id: int = 0, max_size: int = MAX_PACKET, ttl: int | None = None, flush: bool = True):
+        self.buf = bytearray(HEADER.size)
+        self.names = {}
+        self.id = id
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush = flush
+        self.questions = 0
+        self.records = set()
+
+    def write_name(self, labels: tuple):
+        # note: names are compressed only with exact same suffixes, which is good
+        #       enough for names we made up ourselves
+        for i in range(len(labels)):
+            suffix = labels[i:]
+            if (offset := self.names.get(suffix)) is not None:
+                self.buf += struct.pack("!H", 0xC000 | offset)
+                return
+            if len(self.buf) < 0x3FFF:
+                self.names[suffix] = len(self.buf)
+            label = labels[i].encode()
+            self.buf.append(len(label))
+            self.buf += label
+        self.buf.append(0)
+
+    def add_question(self, labels: tuple, qtype: int):
+        self.write_name(labels)
+        self.buf += QUESTION.pack(qtype, CLASS_IN)
+        self.questions += 1
+
+    def write_record(self, record: tuple):
+        labels, rtype, ttl, rdata = record
+        self.write_name(labels)
+        flush = CACHE_FLUSH if self.flush and rtype != PTR else 0
+        if self.ttl is not None:
+            ttl = min(ttl, self.ttl)
+
+        start = len(self.buf)
+        self.buf += RECORD.pack(rtype, CLASS_IN | flush, ttl, 0)
+        if rtype == PTR:
+            self.write_name(rdata)
+        elif rtype == SRV:
+            port, target = rdata
+            self.buf += struct.pack("!HHH", 0, 0, port)
+            self.write_name(target)
+        else:
+            self.buf += rdata
+        struct.pack_into("!H", self.buf, start + RECORD.size - 2, len(self.buf) - start - RECORD.size)
+
+    def add(self, records: list) -> bool:
+        """Add records (unless they are in already), False if they don't fit"""
+        records = [record for record in records if record not in self.records]
+        mark = len(self.buf)
+        for record in records:
+            self.write_record(record)
+
+        if len(self.buf) > self.max_size and self.records:
+            del self.buf[mark:]
+            self.names = {name: offset for name, offset in self.names.items() if offset < mark}
+            return False
+
+        self.records.update(records)
+        return True
+
+    def to_bytes(self) -> bytes:
+        HEADER.pack_into(self.buf, 0, self.id, RESPONSE, self.questions, len(self.records), 0, 0)
+        return bytes(self.buf)
+
+
+def pack(groups: list[list], question: tuple | None = None, **options) -> list[bytes]:
+    """Pack groups of records into as few packets as possible, groups are never split"""
+    packets = []
+    packet = None
+    for group in groups:
+        if packet is not None and packet.add(group):
+            continue
+        if packet is not None:
+            packets.append(packet.to_bytes())
+        packet = Packet(**options)
+        if question is not None:
+            packet.add_question(*question)
+        packet.add(group)
+
+    if packet is not None:
+        packets.append(packet.to_bytes())
+    return packets
+
+
+def read_name(data: bytes, offset: int) -> tuple[tuple, int]:
+    """Return name labels at given offset of message and offset right after the name"""
+    labels = []
+    end = None
+    for _ in range(128):
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        offset += 1
+        if length == 0:
+            return tuple(labels), end if end is not None else offset
+        labels.append(data[offset:offset + length].decode(errors="replace"))
+        offset += length
+    raise ValueError("name compression loop")
+
+
+def parse(data: bytes):
+    """Return id, flags, questions and answer records of DNS message
+
+    Questions are (labels, type, unicast), records are (labels, type, ttl, rdata)
+    with rdata of PTR records parsed to labels.
+    """
+    id, flags, qdcount, ancount, _, _ = HEADER.unpack_from(data)
+    offset = HEADER.size
+
+    questions = []
+    for _ in range(qdcount):
+        labels, offset = read_name(data, offset)
+        qtype, qclass = QUESTION.unpack_from(data, offset)
+        offset += QUESTION.size
+        questions.append((labels, qtype, bool(qclass & UNICAST)))
+
+    records = []
+    for _ in range(ancount):
+        labels, offset = read_name(data, offset)
+        rtype, _, ttl, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        if rtype == PTR:
+            rdata = read_name(data, offset)[0]
+        elif rtype == SRV:
+            rdata = (struct.unpack_from("!H", data, offset + 4)[0], read_name(data, offset + 6)[0])
+        else:
+            rdata = data[offset:offset + length]
+        offset += length
+        records.append((labels, rtype, ttl, rdata))
+
+    return id, flags, questions, records
+
+
+def open_socket(interface: str = "0.0.0.0", port: int = PORT, receive_buffer: int | None = RECEIVE_BUFFER) -> socket.socket:
+    """Return socket receiving mDNS traffic on given interface, shared with other responders"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    # note: with many devices, our own (looped back) answers come in big bursts
+    if receive_buffer:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer)
+    sock.bind(("", port))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, socket.inet_aton(GROUP) + socket.inet_aton(interface))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 255)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    sock.setblocking(False)
+    return sock
+
+
+class Responder:
+    """Responder for given (instance name, ip, port) services"""
+    def __init__(
+        self,
+        services: list[tuple[str, str, int]],
+        interface: str = "0.0.0.0",
+        port: int = PORT,
+        max_packet: int = MAX_PACKET,
+        receive_buffer: int | None = RECEIVE_BUFFER,
+    ):
+        self.interface = interface
+        self.port = port
+        self.max_packet = max_packet
+        self.receive_buffer = receive_buffer
+
+        # record groups by the (name, type) they answer
+        self.answers = {(key(SERVICES), PTR): [[(SERVICES, PTR, TTL, SERVICE)]]}
+        self.instances = []
+        for name, ip, port in services:
+            instance = (name, *SERVICE)
+            host = (f"fakebox-{ip.replace('.', '-')}", "local")
+            ptr = (SERVICE, PTR, TTL, instance)
+            srv = (instance, SRV, HOST_TTL, (port, host))
+            txt = (instance, TXT, TTL, b"\0")
+            a = (host, A, HOST_TTL, socket.inet_aton(ip))
+
+            self.instances.append([ptr, srv, txt, a])
+            self.answers.setdefault((key(SERVICE), PTR), []).append([ptr, srv, txt, a])
+            self.answers[(key(instance), SRV)] = [[srv, a]]
+            self.answers[(key(instance), TXT)] = [[txt]]
+            self.answers[(key(instance), ANY)] = [[srv, txt, a]]
+            self.answers[(key(host), A)] = self.answers[(key(host), ANY)] = [[a]]
+
+        self.sock = None
+        self.cache = {}
+        # multicast questions waiting for an answer, with PTR records known to all
+        # of their queriers
+        self.pending = {}
+        self.deadline = None
+        self.answered = {}
+        self.stopped = threading.Event()
+        self.announced = threading.Event()
+        self.thread = None
+        self.sent = 0
+        self.received = 0
+
+    def groups(self, question: tuple, known: frozenset = frozenset()) -> list[list]:
+        groups = self.answers.get(question, [])
+        if known:
+            # note: known answer suppression, querier has these in its cache already
+            groups = [group for group in groups if group[0][3] not in known or group[0][1] != PTR]
+        return groups
+
+    def respond(self, questions: list[tuple], known: dict | None = None, legacy: tuple | None = None) -> list[bytes]:
+        """Return packets answering given (name key, type) questions
+
+        Legacy unicast responses repeat the (labels, type) question and shorten ttls.
+        """
+        cache_key = (tuple(questions), legacy)
+        if not known and (packets := self.cache.get(cache_key)) is not None:
+            return packets
+
+        groups = []
+        for question in questions:
+            groups.extend(self.groups(question, (known or {}).get(question, frozenset())))
+        if not groups:
+            return []
+
+        if legacy is not None:
+            packets = pack(groups, legacy, max_size=self.max_packet, ttl=LEGACY_TTL, flush=False)
+        else:
+            packets = pack(groups, max_size=self.max_packet)
+        if not known:
+            self.cache[cache_key] = packets
+        return packets
+
+    def send(self, packets: list[bytes], address: tuple, id: int = 0):
+        for packet in packets:
+            if id:
+                packet = struct.pack("!H", id) + packet[2:]
+            while True:
+                try:
+                    self.sock.sendto(packet, address)
+                    break
+                except BlockingIOError:
+                    # note: outgoing buffer is full, wait for it rather than drop answers
+                    select.select([], [self.sock], [], 1)
+            self.sent += 1
+
+    def handle(self, data: bytes, address: tuple, now: float):
+        # note: skip responses (including our own, looped back) without parsing them
+        if len(data) < HEADER.size or data[2] & 0x80:
+            return
+
+        try:
+            id, flags, questions, records = parse(data)
+        except (IndexError, ValueError, struct.error):
+            return
+        if not questions:
+            return
+
+        # PTR records the querier already knows, with at least half of their ttl left
+        known = frozenset(
+            rdata for labels, rtype, ttl, rdata in records if rtype == PTR and ttl >= TTL // 2
+        )
+
+        for labels, qtype, unicast in questions:
+            question = (key(labels), qtype)
+            if question not in self.answers:
+                continue
+
+            if address[1] != self.port:
+                # legacy unicast query, e.g. of a one-shot resolver
+                self.send(self.respond([question], legacy=(labels, qtype)), address, id)
+            elif unicast:
+                self.send(self.respond([question], {question: known} if known else None), address)
+            else:
+                pending = self.pending.get(question)
+                self.pending[question] = known if pending is None else pending & known
+                if self.deadline is None:
+                    self.deadline = now + random.uniform(MIN_DELAY, MAX_DELAY)
+
+    def flush(self, now: float):
+        """Multicast answers to pending questions, all in one batch"""
+        questions = [
+            question for question in self.pending
+            if now - self.answered.get(question, -MIN_INTERVAL) >= MIN_INTERVAL
+        ]
+        known = {question: self.pending[question] for question in questions}
+        self.pending.clear()
+        self.deadline = None
+
+        for question in questions:
+            self.answered[question] = now
+        self.send(self.respond(questions, known if any(known.values()) else None), (GROUP, self.port))
+
+    def announce(self, ttl: int | None = None):
+        """Multicast all records, with ttl 0 they are goodbyes"""
+        groups = [*self.answers[(key(SERVICES), PTR)], *self.instances]
+        self.send(pack(groups, max_size=self.max_packet, ttl=ttl), (GROUP, self.port))
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        self.sock = self.sock or open_socket(self.interface, self.port, self.receive_buffer)
+        # note: RFC 6762 wants at least two announcements, a second apart
+        self.announce()
+        announce_at = time.monotonic() + 1
+        # note: browsing for devices is by far the most common query, have it
+        #       answered from cache right away
+        self.respond([(key(SERVICE), PTR)])
+        self.respond([(key(SERVICE), PTR)], legacy=(SERVICE, PTR))
+
+        while not self.stopped.is_set():
+            now = time.monotonic()
+            wait = min(poll_interval, (announce_at or now + poll_interval) - now)
+            if self.deadline is not None:
+                wait = min(wait, self.deadline - now)
+
+            if select.select([self.sock], [], [], max(wait, 0))[0]:
+                while True:
+                    try:
+                        data, address = self.sock.recvfrom(MAX_DATAGRAM)
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    self.received += 1
+                    self.handle(data, address, time.monotonic())
+
+            now = time.monotonic()
+            if self.deadline is not None and now >= self.deadline:
+                self.flush(now)
+            if announce_at is not None and now >= announce_at:
+                self.announce()
+                announce_at = None
+                self.announced.set()
+
+    def serve_in_background(self):
+        self.sock = open_socket(self.interface, self.port, self.receive_buffer)
+        self.thread = threading.Thread(target=self.serve_forever, name="fakebox-mdns", daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.sock is not None:
+            self.announce(ttl=0)
+            self.sock.close()
+
+
+def browse(
+    interface: str = "0.0.0.0",
+    port: int = PORT,
+    timeout: float = 1.0,
+    service: tuple = SERVICE,
+) -> dict[str, tuple[str, int]]:
+    """Return (ip, port) of instances of service, found with a legacy unicast query
+
+    Waits until no answer came for `timeout` seconds.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER)
+    sock.settimeout(timeout)
+
+    query = bytearray(HEADER.pack(random.randrange(1, 0x10000), 0, 1, 0, 0, 0))
+    for label in service:
+        query += bytes([len(label)]) + label.encode()
+    query += b"\0" + QUESTION.pack(PTR, CLASS_IN)
+
+    # note: answers come in bursts, parsing them on the go would overflow the socket
+    packets = []
+    with sock:
+        sock.sendto(query, (GROUP, port))
+        while True:
+            try:
+                packets.append(sock.recv(MAX_DATAGRAM))
+            except socket.timeout:
+                break
+
+    instances, targets, addresses = set(), {}, {}
+    for data in packets:
+        for labels, rtype, _, rdata in parse(data)[3]:
+            if rtype == PTR and key(labels) == key(service):
+                instances.add(rdata)
+            elif rtype == SRV:
+                targets[key(labels)] = rdata
+            elif rtype == A:
+                addresses[key(labels)] = socket.inet_ntoa(rdata)
+
+    found = {}
+    for instance in instances:
+        if (target := targets.get(key(instance))) is not None:
+            found[instance[0]] = (addresses.get(key(target[1])), target[0])
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Advertise fake devices with mDNS and browse for them")
+    parser.add_argument("--count", type=int, default=1000, help="number of devices (default: %(default)s)")
+    parser.add_argument("--interface", default="127.0.0.1", help="interface address (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=5354, help="mDNS port (default: %(default)s)")
+    args = parser.parse_args()
+
+    services = [
+        (f"device-{i}", f"127.1.{i >> 8 & 0xFF}.{i & 0xFF}", 80) for i in range(args.count)
+    ]
+    responder = Responder(services, args.interface, args.port)
+    responder.serve_in_background()
+    try:
+        responder.announced.wait()
+        sent = responder.sent
+        started = time.perf_counter()
+        found = browse(args.interface, args.port)
+        elapsed = time.perf_counter() - started - 1.0
+        sent = responder.sent - sent
+    finally:
+        responder.shutdown()
+
+    missing = [name for name, ip, port in services if found.get(name) != (ip, port)]
+    print(f"found {len(found)}/{len(services)} devices in {elapsed * 1000:.0f} ms, {sent} packets", flush=True)
+    if missing:
+        print(f"missing: {', '.join(missing[:10])}{' ...' if len(missing) > 10 else ''}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Registry of device types, discovered by module name
+
+Device modules are named `<type>_<api level>.py`. The registry lists them without
+importing any, and imports a module (and builds its device type) only when it's
+first used:
+
+    registry = Registry()
+    registry.names()                              # ["floodsensor_20200831", ...]
+    registry.create("shutterbox_20190911", mode=3)
+
+Importing a device module only defines its device type (the app is built once per
+type on first request, see Device.get_app). To keep it that way check how long
+each module takes to import in a fresh interpreter (with `-X importtime`), and
+how long the first use of its `app` takes:
+
+    python -m devices._registry
+    python -m devices._registry -k shutterbox --budget 200
+"""
+import argparse
+import importlib
+import os
+import re
+import subprocess
+import sys
+import time
+
+from ._device import find_device_class
+
+# device module names, e.g. shutterbox_20190911
+MODULE_NAME = re.compile(r"(?P<type>[a-z]+)_(?P<api>\d{8})")
+
+# milliseconds a device module may take to import in a fresh interpreter, most
+# of which is importing Flask
+DEFAULT_BUDGET = 500
+
+
+class Registry:
+    def __init__(self, package: str = __package__):
+        self.package = package
+        self.path = os.path.dirname(importlib.import_module(package).__file__)
+        self.modules = {}
+        self.types = {}
+        # seconds spent importing each module, in this process
+        self.import_times = {}
+
+        for filename in sorted(os.listdir(self.path)):
+            name, ext = os.path.splitext(filename)
+            if ext == ".py" and (match := MODULE_NAME.fullmatch(name)):
+                self.modules[name] = (match["type"], match["api"])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.modules
+
+    def names(self, filter: str | None = None) -> list[str]:
+        return [name for name in self.modules if not filter or filter in name]
+
+    def find(self, device_type: str, api: str) -> str:
+        """Return name of the module of given device type and api level"""
+        name = f"{device_type}_{api}"
+        if name not in self.modules:
+            apis = [a for t, a in self.modules.values() if t == device_type]
+            if not apis:
+                raise LookupError(f"unknown device type {device_type!r}")
+            raise LookupError(f"no api level {api} of {device_type}, available: {', '.join(apis)}")
+        return name
+
+    def get(self, name: str) -> type:
+        """Return device type defined in given module, importing it on first use"""
+        if (device_type := self.types.get(name)) is not None:
+            return device_type
+
+        if name not in self.modules:
+            raise LookupError(f"unknown device module {name!r}")
+
+        started = time.perf_counter()
+        module = importlib.import_module(f"{self.package}.{name}")
+        self.import_times[name] = time.perf_counter() - started
+
+        device_type = self.types[name] = find_device_class(module)
+        return device_type
+
+    def create(self, name: str, **options):
+        """Create new instance of the device type defined in given module"""
+        return self.get(name)(**options)
+
+
+REGISTRY = Registry()
+
+
+def parse_importtime(output: str) -> list[tuple[int, int, int, str]]:
+    """Return (self us, cumulative us, nesting level, module) of `-X importtime` lines"""
+    lines = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+
+        own, cumulative, name = line[len("import time:"):].split("|")
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        lines.append((int(own), int(cumulative), level, name.strip()))
+    return lines
+
+
+# imports the module, then uses its app (which creates the device from the environment)
+# note: -X importtime only reports modules imported with the import statement
+PROBE = """\
+import sys, time
+__import__(sys.argv[1])
+module = sys.modules[sys.argv[1]]
+started = time.perf_counter()
+module.app
+print(time.perf_counter() - started)
+"""
+
+
+def measure(package: str, name: str) -> dict:
+    """Import device module in a fresh interpreter, return its import and first use times"""
+    module = f"{package}.{name}"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE, module],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    lines = parse_importtime(result.stderr)
+    index = next(i for i, (_, _, _, n) in enumerate(lines) if n == module)
+    own, cumulative, level, _ = lines[index]
+
+    # direct imports of the module are listed before it, one level deeper
+    children = []
+    for child in reversed(lines[:index]):
+        if child[2] <= level:
+            break
+        if child[2] == level + 1:
+            children.append(child)
+    heaviest = max(children, key=lambda child: child[1], default=None)
+
+    return {
+        "self": own / 1000,
+        "import": cumulative / 1000,
+        "app": float(result.stdout) * 1000,
+        "heaviest": f"{heaviest[3]} ({heaviest[1] / 1000:.0f} ms)" if heaviest else "",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report import time of device modules")
+    parser.add_argument("-k", dest="filter", help="filter devices by name")
+    parser.add_argument(
+        "--budget", type=float, default=DEFAULT_BUDGET,
+        help="milliseconds a module may take to import (default: %(default)s)"
+    )
+    args = parser.parse_args()
+
+    print(f"{'module':<26} {'self':>8} {'import':>8} {'app':>8}  heaviest import", flush=True)
+    over = []
+    for name in REGISTRY.names(args.filter):
+        times = measure(REGISTRY.package, name)
+        mark = ""
+        if times["import"] > args.budget:
+            over.append(name)
+            mark = " !"
+        print(
+            f"{name:<26} {times['self']:>5.1f} ms {times['import']:>5.0f} ms "
+            f"{times['app']:>5.0f} ms  {times['heaviest']}{mark}",
+            flush=True,
+        )
+
+    if over:
+        print(f"over budget of {args.budget:.0f} ms: {', '.join(over)}", flush=True)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Hot reload of device modules, keeping device state
+
+`flask run --reload` restarts the whole process on every change and every device
+starts over. Instead the reloader watches source files of the device modules served
+by this process and when one of them changes, re-imports just that module and moves
+its live devices over to the new device type (`device.__class__`). Devices keep
+their state (instance attributes), attributes new to the type are taken from a
+fresh device. Route handlers are resolved per request, and the Flask app of the new
+type is built on the first one:
+
+    reloader = Reloader(devices)
+    reloader.start()
+
+Changes to shared modules (`_device.py`, `_common.py`, ...) and to `STATE_LAYOUT` of
+devices served by several workers still need a restart.
+"""
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+
+from ._device import Device
+from ._registry import REGISTRY
+from ._signals import Signal
+
+logger = logging.getLogger(__name__)
+
+
+def mtime(module_name: str) -> int | None:
+    try:
+        return os.stat(sys.modules[module_name].__file__).st_mtime_ns
+    except OSError:
+        return None
+
+
+def discard(device: Device, kept: set = frozenset()):
+    """Release signals of device built only for its attributes, except the kept ones"""
+    for name, value in vars(device).items():
+        if isinstance(value, Signal) and name not in kept:
+            value.bank.unregister(value.index)
+
+
+class Reloader:
+    def __init__(self, devices: list, interval: float = 0.5):
+        self.devices = devices
+        self.interval = interval
+        self.mtimes = {}
+        for device in devices:
+            module_name = type(device).__module__
+            if module_name not in self.mtimes:
+                self.mtimes[module_name] = mtime(module_name)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def changed(self) -> list[str]:
+        """Return names of modules changed since the last check"""
+        changed = []
+        for module_name, last in self.mtimes.items():
+            if (current := mtime(module_name)) != last:
+                self.mtimes[module_name] = current
+                changed.append(module_name)
+        return changed
+
+    def reload(self, module_name: str) -> int:
+        """Re-import module and move its devices to the new device types, return their number"""
+        started = time.perf_counter()
+        try:
+            module = importlib.reload(sys.modules[module_name])
+        except Exception:
+            logger.exception(f"reloading {module_name} failed, its devices keep running the old code")
+            return 0
+
+        moved = 0
+        # names of attributes set by constructors of new device types
+        attributes = {}
+        for device in self.devices:
+            old = type(device)
+            if old.__module__ != module_name:
+                continue
+
+            new = getattr(module, old.__name__, None)
+            if not (isinstance(new, type) and issubclass(new, Device)):
+                logger.error(f"{module_name} no longer defines {old.__name__}, its devices keep running the old code")
+                continue
+
+            if new not in attributes:
+                fresh = new()
+                attributes[new] = set(vars(fresh))
+                discard(fresh)
+            if missing := attributes[new] - set(vars(device)):
+                fresh = new()
+                for name in missing:
+                    setattr(device, name, getattr(fresh, name))
+                discard(fresh, kept=missing)
+
+            device.__class__ = new
+            device.forget()
+            moved += 1
+
+        for name, device_type in REGISTRY.types.items():
+            if device_type.__module__ == module_name:
+                REGISTRY.types[name] = getattr(module, device_type.__name__, device_type)
+
+        # note: `flask --app` serves the app of the old type, make it pass requests on
+        if "app" in vars(module):
+            module.app.wsgi_app = module.device.default_app().wsgi_app
+
+        elapsed = (time.perf_counter() - started) * 1000
+        print(f"reloaded {module_name} in {elapsed:.1f} ms, {moved} devices kept their state", flush=True)
+        return moved
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            for module_name in self.changed():
+                self.reload(module_name)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name="fakebox-reloader", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
@@ -0,0 +1,117 @@
+"""Scheduler for time-driven devices
+
+A single thread (or the asyncio loop) ticks all time-driven devices. Device state
+is evaluated lazily from the clock, so devices are not stepped periodically: a
+device calls `wake(delay)` for the next moment something happens on its own (e.g.
+shutter reaches its target) and gets its `tick()` called then. `tick()` returns
+seconds until the next such event, or None. With nothing in motion the scheduler
+is completely idle.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    def __init__(self):
+        self.heap = []
+        self.due = {}
+        self.counter = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def wake(self, device, delay: float):
+        """Make sure device gets ticked in `delay` seconds (or earlier)"""
+        when = time.monotonic() + delay
+
+        with self.cond:
+            due = self.due.get(device)
+            if due is None or when < due:
+                # note: entry scheduled for later (if any) stays on the heap and
+                #       is skipped once popped
+                self.due[device] = when
+                heapq.heappush(self.heap, (when, next(self.counter), device))
+                self.cond.notify()
+
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="fakebox-scheduler", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.heap or (delay := self.heap[0][0] - time.monotonic()) > 0:
+                    self.cond.wait(delay if self.heap else None)
+
+                when, _, device = heapq.heappop(self.heap)
+                if self.due.get(device) != when:
+                    continue
+                del self.due[device]
+
+            delay = tick(device)
+            if delay is not None:
+                self.wake(device, delay)
+
+
+class AsyncScheduler:
+    """Scheduler that ticks devices with timers of the asyncio loop"""
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.due = {}
+
+    def wake(self, device, delay: float):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is self.loop:
+            self._schedule(device, delay)
+        else:
+            self.loop.call_soon_threadsafe(self._schedule, device, delay)
+
+    def _schedule(self, device, delay: float):
+        when = self.loop.time() + delay
+        if device in self.due:
+            due, handle = self.due[device]
+            if due <= when:
+                return
+            handle.cancel()
+
+        self.due[device] = when, self.loop.call_at(when, self._tick, device)
+
+    def _tick(self, device):
+        del self.due[device]
+        delay = tick(device)
+        if delay is not None:
+            self._schedule(device, delay)
+
+
+def tick(device) -> float | None:
+    try:
+        if device.shared is None:
+            return device.tick()
+
+        with device.shared:
+            return device.tick()
+    except Exception:
+        logger.exception("tick of %s failed", device.name)
+        return None
+
+
+_default = None
+_default_lock = threading.Lock()
+
+
+def default_scheduler() -> Scheduler:
+    global _default
+
+    with _default_lock:
+        if _default is None:
+            _default = Scheduler()
+        return _default
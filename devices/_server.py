@@ -0,0 +1,347 @@
+"""Multi-threaded keep-alive server for device apps
+
+Instead of a thread (or a process) per device, one acceptor thread watches the
+listening sockets of all devices and their open connections, and hands connections
+with a request in over to a fixed pool of worker threads. Connections speak HTTP/1.1
+and are kept alive until the client closes them (or asks to, or speaks HTTP/1.0
+without asking to keep it) or they stay idle for longer than `keepalive` seconds.
+Idle connections are watched by the acceptor again, so pollers may keep many more
+of them open than there are threads.
+
+    server = PooledServer(threads=64)
+    server.bind("127.0.0.1", 5001, device.wsgi_app)
+    server.serve_forever()
+"""
+import logging
+import selectors
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.exceptions import InternalServerError
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from werkzeug.wsgi import LimitedStream
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_THREADS = 32
+DEFAULT_KEEPALIVE = 5.0
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def __init__(self, request, client_address, server):
+        # note: unlike socketserver handlers it doesn't serve the connection right
+        #       away, PooledServer calls serve() whenever a request comes in
+        self.request = request
+        self.client_address = client_address
+        self.server = server
+        self.setup()
+
+    def serve(self) -> bool:
+        """Serve requests that came in on the connection, tell if it's kept open for more"""
+        self.close_connection = True
+        try:
+            self.handle_one_request()
+            while not self.close_connection and self.pending():
+                self.handle_one_request()
+        except (ConnectionError, socket.timeout) as e:
+            self.close_connection = True
+            self.connection_dropped(e)
+        return not self.close_connection
+
+    def pending(self) -> bool:
+        """Tell if (a part of) the next request is in already, without waiting for it"""
+        self.connection.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def close(self):
+        try:
+            self.finish()
+        except OSError:
+            pass
+        self.server.shutdown_request(self.request)
+
+    def setup(self):
+        super().setup()
+        self.local_address = self.connection.getsockname()
+        # note: headers and body are separate writes, with Nagle's algorithm the body
+        #       waits for the client to ack the headers on a kept-alive connection
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def make_environ(self):
+        environ = super().make_environ()
+        # note: address the client connected to, not the one the server is bound
+        #       to (e.g. 0.0.0.0), which is what devices served by address need
+        environ["SERVER_NAME"] = self.local_address[0]
+        return environ
+
+    def run_wsgi(self):
+        # note: werkzeug's own run_wsgi always closes the connection, this one
+        #       keeps it open unless the request (or the response) says otherwise
+        if self.headers.get("Expect", "").lower().strip(" \t") == "100-continue":
+            self.wfile.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        self.environ = environ = self.make_environ()
+        if environ.get("wsgi.input_terminated"):
+            # note: chunked body, what's left of it can't be told from the next request
+            self.close_connection = True
+            body = None
+        else:
+            body = environ["wsgi.input"] = LimitedStream(self.rfile, int(environ.get("CONTENT_LENGTH") or 0))
+
+        status_set = headers_set = None
+        headers_sent = False
+        chunk_response = False
+
+        def write(data: bytes):
+            nonlocal headers_sent, chunk_response
+            if not headers_sent:
+                headers_sent = True
+                code, _, message = status_set.partition(" ")
+                self.send_response(int(code), message)
+                keys = set()
+                for key, value in headers_set:
+                    self.send_header(key, value)
+                    keys.add(key.lower())
+
+                if not (
+                    "content-length" in keys
+                    or environ["REQUEST_METHOD"] == "HEAD"
+                    or 100 <= int(code) < 200
+                    or int(code) in (204, 304)
+                ):
+                    if self.request_version == "HTTP/1.1":
+                        chunk_response = True
+                        self.send_header("Transfer-Encoding", "chunked")
+                    else:
+                        # note: body ends when the connection does
+                        self.close_connection = True
+
+                if self.close_connection:
+                    self.send_header("Connection", "close")
+                elif self.request_version != "HTTP/1.1":
+                    self.send_header("Connection", "keep-alive")
+                self.end_headers()
+
+            if data:
+                if chunk_response:
+                    self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                else:
+                    self.wfile.write(data)
+
+        def start_response(status, headers, exc_info=None):
+            nonlocal status_set, headers_set
+            if exc_info:
+                try:
+                    if headers_sent:
+                        raise exc_info[1].with_traceback(exc_info[2])
+                finally:
+                    exc_info = None
+            status_set, headers_set = status, headers
+            return write
+
+        def execute(app):
+            response = app(environ, start_response)
+            try:
+                for data in response:
+                    write(data)
+                if not headers_sent:
+                    write(b"")
+                if chunk_response:
+                    self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            finally:
+                if hasattr(response, "close"):
+                    response.close()
+
+        try:
+            execute(self.server.app)
+            # note: whatever the app didn't read of the body precedes the next request
+            if body is not None:
+                body.exhaust()
+        except (ConnectionError, socket.timeout) as e:
+            self.close_connection = True
+            self.connection_dropped(e, environ)
+        except Exception:
+            self.close_connection = True
+            if self.server.passthrough_errors:
+                raise
+            if not headers_sent:
+                status_set = headers_set = None
+                try:
+                    execute(InternalServerError())
+                except Exception:
+                    pass
+            logger.exception("error on request %s %s", environ["REQUEST_METHOD"], environ["PATH_INFO"])
+
+    def log_error(self, format: str, *args):
+        # note: idle keep-alive connections timing out is business as usual
+        if format.startswith("Request timed out"):
+            return
+        super().log_error(format, *args)
+
+
+class QuietRequestHandler(KeepAliveRequestHandler):
+    def log_request(self, code="-", size="-"):
+        pass
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+    request_queue_size = 1024
+
+
+class ReusePortWSGIServer(PooledWSGIServer):
+    # note: lets worker processes accept connections on the same port
+    allow_reuse_port = True
+
+
+class PooledServer:
+    def __init__(self, threads: int = DEFAULT_THREADS, keepalive: float = DEFAULT_KEEPALIVE):
+        self.threads = threads
+        self.keepalive = keepalive
+        self.servers = []
+        self.selector = selectors.DefaultSelector()
+        self.pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="fakebox")
+        # idle connections (handlers) watched by the acceptor, by when they're closed
+        self.idle = {}
+        # handlers done with their requests, for the acceptor to watch again
+        self.parked = []
+        self.lock = threading.Lock()
+        # note: wakes up the acceptor to watch parked connections
+        self.waker, self.wakeup = socket.socketpair()
+        self.waker.setblocking(False)
+        self.wakeup.setblocking(False)
+        self.selector.register(self.wakeup, selectors.EVENT_READ, None)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def bind(
+        self,
+        host: str,
+        port: int,
+        app,
+        request_handler: type[KeepAliveRequestHandler] = KeepAliveRequestHandler,
+        reuse_port: bool = False,
+    ):
+        handler = type(request_handler.__name__, (request_handler,), {"timeout": self.keepalive})
+        server_class = ReusePortWSGIServer if reuse_port else PooledWSGIServer
+        server = server_class(host, port, app, handler=handler)
+        server.socket.setblocking(False)
+
+        self.selector.register(server.socket, selectors.EVENT_READ, server)
+        self.servers.append(server)
+        return server
+
+    def serve_forever(self, poll_interval: float = 0.5):
+        while not self.stopped.is_set():
+            timeout = poll_interval
+            if self.idle:
+                timeout = min(timeout, max(next(iter(self.idle.values())) - time.monotonic(), 0))
+
+            for key, _ in self.selector.select(timeout):
+                if key.data is None:
+                    self.drain()
+                elif isinstance(key.data, PooledWSGIServer):
+                    self.accept(key.data)
+                else:
+                    self.selector.unregister(key.fileobj)
+                    del self.idle[key.data]
+                    self.pool.submit(self.process_request, key.data)
+
+            self.watch()
+            self.expire()
+
+    def accept(self, server: PooledWSGIServer):
+        try:
+            request, client_address = server.get_request()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            logger.exception("accept failed")
+            return
+
+        try:
+            handler = server.RequestHandlerClass(request, client_address, server)
+        except Exception:
+            server.handle_error(request, client_address)
+            server.shutdown_request(request)
+            return
+        # note: no thread is taken until the first request comes in
+        self.selector.register(request, selectors.EVENT_READ, handler)
+        self.idle[handler] = time.monotonic() + self.keepalive
+
+    def process_request(self, handler: KeepAliveRequestHandler):
+        try:
+            keep = handler.serve()
+        except Exception:
+            handler.server.handle_error(handler.request, handler.client_address)
+            keep = False
+
+        if not keep:
+            handler.close()
+            return
+
+        with self.lock:
+            self.parked.append(handler)
+        try:
+            self.waker.send(b"\0")
+        except BlockingIOError:
+            # note: acceptor has plenty of wakeups to notice it already
+            pass
+
+    def drain(self):
+        try:
+            while self.wakeup.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def watch(self):
+        """Watch connections parked by worker threads until their next request"""
+        with self.lock:
+            parked, self.parked = self.parked, []
+        deadline = time.monotonic() + self.keepalive
+        for handler in parked:
+            self.selector.register(handler.request, selectors.EVENT_READ, handler)
+            self.idle[handler] = deadline
+
+    def expire(self):
+        """Close connections idle for longer than keepalive"""
+        now = time.monotonic()
+        # note: idle connections are in the order they were parked, i.e. of their deadlines
+        while self.idle:
+            handler, deadline = next(iter(self.idle.items()))
+            if deadline > now:
+                break
+            del self.idle[handler]
+            self.selector.unregister(handler.request)
+            handler.close()
+
+    def serve_in_background(self):
+        self.thread = threading.Thread(target=self.serve_forever, name="fakebox-acceptor", daemon=True)
+        self.thread.start()
+
+    def shutdown(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        for handler in self.idle:
+            handler.close()
+        self.idle.clear()
+        for server in self.servers:
+            self.selector.unregister(server.socket)
+            server.server_close()
+        self.selector.close()
+        self.waker.close()
+        self.wakeup.close()
@@ -0,0 +1,142 @@
+"""Device state shared by worker processes
+
+With `--workers N` the host forks N processes that accept connections on the same
+ports (SO_REUSEPORT), so any of them may serve any request. State of every device
+lives in a fixed-layout record in one `multiprocessing.shared_memory` block, and
+each request (and tick) runs with the device record locked and loaded:
+
+    shared = SharedStates(devices)    # before forking workers
+    with device.shared:
+        ...                           # state is up to date and written back after
+
+Device types describe their state with `STATE_LAYOUT`, i.e. (path, struct format)
+pairs. Path starts with device attribute, followed by dict keys or attributes:
+
+    STATE_LAYOUT = Device.STATE_LAYOUT + (
+        ("relays.0", "B"),
+        ("internal_state.motion.started", "d"),
+    )
+
+Text fields (format "<n>s") are truncated to their size.
+"""
+import multiprocessing
+import struct
+from multiprocessing import shared_memory
+
+# version of record, bumped on every change
+VERSION = struct.Struct("<Q")
+# locks are striped, so workers serving different devices rarely wait for each other
+LOCKS = 64
+
+
+class StateLayout:
+    def __init__(self, layout: tuple[tuple[str, str], ...]):
+        self.struct = struct.Struct("<" + "".join(fmt for _, fmt in layout))
+        self.fields = [(path.split("."), fmt.endswith("s")) for path, fmt in layout]
+        self.size = VERSION.size + self.struct.size
+
+    def read(self, device) -> bytes:
+        """Return device state packed into a record"""
+        values = []
+        for (attr, *keys), text in self.fields:
+            value = getattr(device, attr)
+            for key in keys:
+                value = value[key] if isinstance(value, dict) else getattr(value, key)
+            values.append(value.encode() if text else value)
+        return self.struct.pack(*values)
+
+    def write(self, device, data: bytes):
+        """Set device state from a record"""
+        for ((attr, *keys), text), value in zip(self.fields, self.struct.unpack(data)):
+            if text:
+                value = value.rstrip(b"\0").decode(errors="ignore")
+
+            if not keys:
+                setattr(device, attr, value)
+                continue
+
+            target = getattr(device, attr)
+            for key in keys[:-1]:
+                target = target[key] if isinstance(target, dict) else getattr(target, key)
+
+            if isinstance(target, dict):
+                target[keys[-1]] = value
+            else:
+                setattr(target, keys[-1], value)
+
+
+class SharedRecord:
+    """State record of a single device, used as context manager"""
+    def __init__(self, device, layout: StateLayout, buf: memoryview, offset: int, lock):
+        self.device = device
+        self.layout = layout
+        self.buf = buf
+        self.offset = offset
+        self.lock = lock
+
+        self.version = 1
+        self.data = layout.read(device)
+        VERSION.pack_into(buf, offset, self.version)
+        buf[offset + VERSION.size:offset + layout.size] = self.data
+
+    def stale(self) -> bool:
+        """Tell if record was changed by another process since this one last used it"""
+        (version,) = VERSION.unpack_from(self.buf, self.offset)
+        return version != self.version
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            (version,) = VERSION.unpack_from(self.buf, self.offset)
+            if version != self.version:
+                self.data = bytes(self.buf[self.offset + VERSION.size:self.offset + self.layout.size])
+                self.layout.write(self.device, self.data)
+                self.version = version
+                # note: settings may have changed, responses cached from them can't be trusted
+                self.device.responses.clear()
+        except BaseException:
+            self.lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            data = self.layout.read(self.device)
+            if data != self.data:
+                self.version += 1
+                self.data = data
+                self.buf[self.offset + VERSION.size:self.offset + self.layout.size] = data
+                VERSION.pack_into(self.buf, self.offset, self.version)
+        finally:
+            self.lock.release()
+
+
+class SharedStates:
+    """State records of all given devices in one shared memory block
+
+    Must be created before worker processes are forked, which inherit both the
+    memory and the locks.
+    """
+    def __init__(self, devices: list, locks: int = LOCKS):
+        context = multiprocessing.get_context("fork")
+        layouts = {}
+        for device in devices:
+            if type(device) not in layouts:
+                layouts[type(device)] = StateLayout(type(device).STATE_LAYOUT)
+
+        self.devices = devices
+        self.memory = shared_memory.SharedMemory(
+            create=True, size=max(sum(layouts[type(device)].size for device in devices), 1)
+        )
+        self.locks = [context.Lock() for _ in range(max(min(locks, len(devices)), 1))]
+
+        offset = 0
+        for index, device in enumerate(devices):
+            layout = layouts[type(device)]
+            device.shared = SharedRecord(device, layout, self.memory.buf, offset, self.locks[index % len(self.locks)])
+            offset += layout.size
+
+    def close(self):
+        for device in self.devices:
+            device.shared = None
+        self.memory.close()
+        self.memory.unlink()
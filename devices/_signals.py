@@ -0,0 +1,124 @@
+"""Batch evaluation of sensor signals
+
+Sensors of a fleet tend to be polled within the same second, and each of them
+used to evaluate its signal on its own. A `SignalBank` knows phase and amplitude
+of every sensor following given waveform, evaluates all of them in one go for a
+whole second and serves the rest of that second from the batch. The batch is
+computed with NumPy. Without it, a batch would cost as much as evaluating every
+signal on its own, so each read evaluates just its own signal then:
+
+    signal = Signal(SINE, phase=3)
+    signal.at(time.time())   # current value, from the batch
+    signal(t)                # value at any t, evaluated on its own
+"""
+import math
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class SignalBank:
+    def __init__(self, f, f_array=None):
+        # note: f_array is f() working on NumPy arrays
+        self.f = f
+        self.f_array = f_array if numpy is not None else None
+        self.phases = []
+        self.amplitudes = []
+        # indices of unregistered signals, taken by the next ones
+        self.free = []
+        self.arrays = None
+        # (second, values) of the last evaluated batch
+        self.batch = (None, None)
+        self.lock = threading.Lock()
+
+    def register(self, phase: float = 0, amplitude: float = 1) -> int:
+        """Add signal to the bank, return its index in every batch"""
+        with self.lock:
+            if self.free:
+                index = self.free.pop()
+                self.phases[index] = phase
+                self.amplitudes[index] = amplitude
+            else:
+                index = len(self.phases)
+                self.phases.append(phase)
+                self.amplitudes.append(amplitude)
+            self.arrays = None
+            self.batch = (None, None)
+            return index
+
+    def unregister(self, index: int):
+        """Remove signal from the bank, its index is given to the next one registered"""
+        with self.lock:
+            self.amplitudes[index] = 0
+            self.free.append(index)
+            self.arrays = None
+            self.batch = (None, None)
+
+    def evaluate(self, second: int) -> list[float]:
+        if self.arrays is None:
+            self.arrays = numpy.array(self.phases, dtype=float), numpy.array(self.amplitudes, dtype=float)
+
+        phases, amplitudes = self.arrays
+        return (amplitudes * self.f_array(second + phases)).tolist()
+
+    def value(self, index: int, t: float) -> float:
+        """Return value of signal with given index in the second of t"""
+        second = math.floor(t)
+        if self.f_array is None:
+            # note: sensors that are not read in this second would be evaluated for nothing
+            return self.amplitudes[index] * self.f(second + self.phases[index])
+
+        batch_second, values = self.batch
+
+        if batch_second != second:
+            with self.lock:
+                batch_second, values = self.batch
+                if batch_second != second:
+                    values = self.evaluate(second)
+                    self.batch = (second, values)
+
+        return values[index]
+
+
+class Signal:
+    """Signal of a single sensor, phase shifted and scaled waveform of its bank"""
+    __slots__ = ("bank", "index", "phase", "amplitude")
+
+    def __init__(self, bank: SignalBank, phase: float = 0, amplitude: float = 1):
+        self.bank = bank
+        self.phase = phase
+        self.amplitude = amplitude
+        self.index = bank.register(phase, amplitude)
+
+    def at(self, t: float) -> float:
+        """Return current value, evaluated with the rest of the bank once per second"""
+        return self.bank.value(self.index, t)
+
+    def __call__(self, x: float) -> float:
+        return self.amplitude * self.bank.f(x + self.phase)
+
+
+def _sine(x):
+    return abs(math.sin(x)) * 100
+
+
+def _sine_array(x):
+    return numpy.abs(numpy.sin(x)) * 100
+
+
+# rectified sine in 0-100 range followed by multiSensor sensors
+SINE = SignalBank(_sine, _sine_array)
+
+
+def sensor_signal(bank: SignalBank, serial: int = None, phase: float = None, amplitude: float = 1) -> Signal:
+    """Return signal of a sensor device
+
+    Unless given explicitly, phase comes from device serial number, so clones in
+    a fleet don't all read the same.
+    """
+    if phase is None:
+        phase = 0 if serial is None else serial
+    return Signal(bank, phase, amplitude)
@@ -0,0 +1,261 @@
+"""Snapshots of device state, restored from a memory-mapped file
+
+Setting up a large fleet in an interesting state (relays switched, shutters half
+closed, lightbox colours set) takes thousands of requests. Instead, take a
+snapshot once and restore it at startup, or between test cases, without
+restarting anything:
+
+    save("scenario.snap", devices)
+    restore("scenario.snap", devices)
+
+State of a device is its `STATE_LAYOUT` record (see _shared.py), i.e. the same
+state that worker processes share. File starts with a table of device types and
+a table of devices (by id), followed by the records:
+
+    header     magic, format version, number of types, number of devices
+    types      type name, digest of its STATE_LAYOUT, record size
+    devices    device id, type index, offset of its record
+    records    packed with StateLayout of the device type, shared by devices in
+               the same state
+
+Restoring only maps the file and unpacks records of given devices, so even tens of
+thousands of them take a fraction of a second. Devices are matched by their id,
+devices missing from the snapshot and the ones whose STATE_LAYOUT has changed
+since are left as they are.
+"""
+import argparse
+import contextlib
+import hashlib
+import logging
+import mmap
+import os
+import signal
+import struct
+import time
+from collections import Counter
+from typing import NamedTuple
+
+from ._shared import StateLayout
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FAKEBOX\0"
+FORMAT = 1
+HEADER = struct.Struct("<8sHHI")
+TYPE = struct.Struct("<64s16sI")
+ENTRY = struct.Struct("<16sHQ")
+
+# note: per device type, StateLayout and digest of STATE_LAYOUT it was made of
+_layouts = {}
+
+
+class Restored(NamedTuple):
+    restored: int
+    # devices with no record in the snapshot
+    missing: int
+    # devices whose STATE_LAYOUT differs from the one in the snapshot
+    stale: int
+
+
+def type_name(device_type: type) -> str:
+    return f"{device_type.__module__}.{device_type.__qualname__}"
+
+
+def layout_of(device_type: type) -> tuple[StateLayout, bytes]:
+    """Return StateLayout of device type, and digest of STATE_LAYOUT it was made of"""
+    if (entry := _layouts.get(device_type)) is None:
+        digest = hashlib.md5(repr(device_type.STATE_LAYOUT).encode()).digest()
+        entry = _layouts[device_type] = (StateLayout(device_type.STATE_LAYOUT), digest)
+    return entry
+
+
+@contextlib.contextmanager
+def locked(device):
+    """Context in which device state is up to date and not changed by anything else
+
+    With worker processes state is written back to shared memory after, otherwise
+    requests and ticks of the device wait for it.
+    """
+    if device.shared is not None:
+        with device.shared:
+            yield
+        return
+
+    with contextlib.ExitStack() as stack:
+        for lock in device.state_locks():
+            stack.enter_context(lock)
+        yield
+
+
+def read_records(devices: list) -> list[bytes]:
+    """Return STATE_LAYOUT records of given devices"""
+    records = []
+    for device in devices:
+        with locked(device):
+            records.append(layout_of(type(device))[0].read(device))
+    return records
+
+
+def pack(devices: list, records: list[bytes] = None) -> bytes:
+    """Return snapshot of state of given devices, from their records if already read"""
+    if records is None:
+        records = read_records(devices)
+
+    types = {}
+    entries = []
+    # note: clones tend to be in the same state, devices with equal records share one
+    offsets = {}
+    offset = 0
+    seen = set()
+
+    for device, record in zip(devices, records):
+        if device.id in seen:
+            raise ValueError(f"device id {device.id} is not unique, snapshot could not tell devices apart")
+        seen.add(device.id)
+
+        layout, digest = layout_of(type(device))
+        if type(device) not in types:
+            types[type(device)] = (len(types), digest, layout.struct.size)
+
+        if record not in offsets:
+            offsets[record] = offset
+            offset += len(record)
+        entries.append((bytes.fromhex(device.id), types[type(device)][0], offsets[record]))
+
+    start = HEADER.size + TYPE.size * len(types) + ENTRY.size * len(entries)
+    parts = [HEADER.pack(MAGIC, FORMAT, len(types), len(entries))]
+    parts += [TYPE.pack(type_name(t).encode(), digest, size) for t, (_, digest, size) in types.items()]
+    parts += [ENTRY.pack(device_id, index, start + offset) for device_id, index, offset in entries]
+    parts += offsets.keys()
+    return b"".join(parts)
+
+
+def save(path: str, devices: list) -> int:
+    """Write snapshot of state of given devices, return its size in bytes"""
+    started = time.perf_counter()
+    data = pack(devices)
+
+    # note: replaced at once, so a host restoring it never sees half of the file
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+    elapsed = (time.perf_counter() - started) * 1000
+    print(f"saved {len(devices)} devices to {path} ({len(data) / 1024:.0f} KiB) in {elapsed:.1f} ms", flush=True)
+    return len(data)
+
+
+class Snapshot:
+    """Snapshot file mapped to memory, used as context manager"""
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, version, types, count = HEADER.unpack_from(self.map)
+        except struct.error:
+            magic, version = None, None
+        if magic != MAGIC or version != FORMAT:
+            self.map.close()
+            raise ValueError(f"{path} is not a device state snapshot (of format {FORMAT})")
+
+        self.types = [
+            (name.rstrip(b"\0").decode(), digest, size)
+            for name, digest, size in TYPE.iter_unpack(self.map[HEADER.size:HEADER.size + TYPE.size * types])
+        ]
+        start = HEADER.size + TYPE.size * types
+        # device id -> (type index, offset of record)
+        self.entries = {
+            device_id: (index, offset)
+            for device_id, index, offset in ENTRY.iter_unpack(self.map[start:start + ENTRY.size * count])
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.map.close()
+
+    def restore(self, devices: list) -> Restored:
+        """Set state of given devices from their records"""
+        view = memoryview(self.map)
+        restored = missing = stale = 0
+        try:
+            for device in devices:
+                entry = self.entries.get(bytes.fromhex(device.id))
+                if entry is None:
+                    missing += 1
+                    continue
+
+                index, offset = entry
+                name, digest, size = self.types[index]
+                layout, current = layout_of(type(device))
+                if name != type_name(type(device)) or digest != current:
+                    stale += 1
+                    continue
+
+                with locked(device):
+                    layout.write(device, view[offset:offset + size])
+                    # note: settings may have changed, responses cached from them can't be trusted
+                    device.responses.clear()
+                restored += 1
+        finally:
+            view.release()
+
+        return Restored(restored, missing, stale)
+
+
+def restore(path: str, devices: list) -> Restored:
+    """Set state of given devices from snapshot file"""
+    started = time.perf_counter()
+    with Snapshot(path) as snapshot:
+        result = snapshot.restore(devices)
+
+    elapsed = (time.perf_counter() - started) * 1000
+    skipped = ""
+    if result.missing or result.stale:
+        skipped = f" ({result.missing} not in snapshot, {result.stale} with changed STATE_LAYOUT)"
+    print(f"restored {result.restored} devices from {path} in {elapsed:.1f} ms{skipped}", flush=True)
+    return result
+
+
+def handle_signals(path: str, devices: list, state_log=None):
+    """Save snapshot of devices on SIGUSR1 and restore it on SIGHUP
+
+    Restored state is not changed by requests, so it's written to the state log
+    (see _statelog.py) as a whole.
+    """
+    def handler(f):
+        def handle(signum, frame):
+            try:
+                f(path, devices)
+                if f is restore and state_log is not None:
+                    state_log.compact()
+            except Exception:
+                logger.exception(f"{signal.Signals(signum).name}: {f.__name__} of {path} failed")
+        return handle
+
+    signal.signal(signal.SIGUSR1, handler(save))
+    signal.signal(signal.SIGHUP, handler(restore))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show what a device state snapshot holds")
+    parser.add_argument("path", help="path to snapshot file")
+    args = parser.parse_args()
+
+    with Snapshot(args.path) as snapshot:
+        counts = Counter(index for index, _ in snapshot.entries.values())
+        records = len({offset for _, offset in snapshot.entries.values()})
+        size = len(snapshot.map) / 1024
+        print(f"{args.path}: {len(snapshot.entries)} devices, {records} distinct records, {size:.0f} KiB")
+        for index, (name, _, size) in enumerate(snapshot.types):
+            print(f"  {name:50} {counts[index]:>7} x {size} B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""Append-only log of device state, replayed on restart
+
+Relays advertise `stateAfterRestart`, which is only true if their state survives a
+restart. With a state log every request that changes the state of a device appends
+the device's new `STATE_LAYOUT` record (see _shared.py) to the log, and on startup
+the last record of every device is restored:
+
+    log = StateLog("fleet.log", devices)
+    log.replay()        # before serving the devices
+    log.start()
+    ...
+    log.stop()
+
+Requests only queue records, a background thread appends them (and syncs the file)
+every `interval` seconds, so requests never wait for the disk. Fast routes are
+polls that change nothing and are not logged at all.
+
+Once the log grows over `compact_size`, it is compacted: state of all devices is
+written as a snapshot (see _snapshot.py) next to it, `<path>.base`, and the log
+starts over. Log starts with a digest of the base it follows, so a log left over by
+compaction that was interrupted is never replayed over a newer base.
+
+With worker processes, the process that forked them appends records of devices
+whose shared state has changed since the last write instead.
+"""
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+
+from ._snapshot import Snapshot, layout_of, locked, pack, read_records
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"FBXSLOG\0"
+FORMAT = 1
+# magic, format version, digest of the base snapshot
+HEADER = struct.Struct("<8sH16s")
+# device id, digest of STATE_LAYOUT, size of the record that follows
+ENTRY = struct.Struct("<16s16sH")
+
+INTERVAL = 0.2
+COMPACT_SIZE = 4 * 1024 * 1024
+
+
+def write_file(path: str, data: bytes):
+    """Write file and make sure it's on disk before it replaces the one at path"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+class StateLog:
+    def __init__(
+        self,
+        path: str,
+        devices: list,
+        interval: float = INTERVAL,
+        compact_size: int = COMPACT_SIZE,
+        fsync: bool = True,
+    ):
+        self.path = path
+        self.base = f"{path}.base"
+        self.devices = devices
+        self.interval = interval
+        self.compact_size = compact_size
+        self.fsync = fsync
+
+        # device id -> last record queued for the log
+        self.last = {}
+        self.pending = []
+        # note: guards `last` and `pending`, taken by requests
+        self.lock = threading.Lock()
+        # note: guards the log file, taken by the writer and compaction
+        self.file_lock = threading.Lock()
+        self.fd = None
+        self.size = 0
+        # log changes of shared state instead of recorded ones, see _shared.py
+        self.polled = False
+
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def read(self) -> dict[bytes, tuple[bytes, bytes]]:
+        """Return last (STATE_LAYOUT digest, record) of every device in the log"""
+        try:
+            with open(self.base, "rb") as f:
+                base_digest = hashlib.md5(f.read()).digest()
+        except FileNotFoundError:
+            base_digest = bytes(16)
+
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+
+        try:
+            magic, version, digest = HEADER.unpack_from(data)
+        except struct.error:
+            magic, version, digest = None, None, None
+        if magic != MAGIC or version != FORMAT:
+            raise ValueError(f"{self.path} is not a device state log (of format {FORMAT})")
+        if digest != base_digest:
+            logger.warning(f"{self.path} precedes {self.base}, skipping it")
+            return {}
+
+        records = {}
+        offset = HEADER.size
+        # note: a record cut short by a crash ends the log
+        while offset + ENTRY.size <= len(data):
+            device_id, layout_digest, size = ENTRY.unpack_from(data, offset)
+            offset += ENTRY.size
+            if offset + size > len(data):
+                break
+            records[device_id] = (layout_digest, data[offset:offset + size])
+            offset += size
+        return records
+
+    def replay(self):
+        """Restore state of devices from the base and the log
+
+        Devices are then restarted (see `Device.restarted()`) and the log is compacted.
+        """
+        started = time.perf_counter()
+        restored = 0
+        if os.path.exists(self.base):
+            with Snapshot(self.base) as snapshot:
+                restored = snapshot.restore(self.devices).restored
+
+        records = self.read()
+        replayed = 0
+        for device in self.devices:
+            if (entry := records.get(bytes.fromhex(device.id))) is None:
+                continue
+
+            layout_digest, record = entry
+            layout, digest = layout_of(type(device))
+            if layout_digest != digest or len(record) != layout.struct.size:
+                continue
+
+            with locked(device):
+                layout.write(device, record)
+                device.responses.clear()
+            replayed += 1
+
+        for device in self.devices:
+            with locked(device):
+                device.restarted()
+
+        self.compact()
+        elapsed = (time.perf_counter() - started) * 1000
+        print(
+            f"replayed {self.path} in {elapsed:.1f} ms: {restored} devices from the base, "
+            f"{replayed} from {len(records)} log records",
+            flush=True,
+        )
+
+    def compact(self):
+        """Write state of all devices as the base and start the log over"""
+        with self.file_lock:
+            # note: records queued so far are older than the base, and what's logged
+            #       next must be compared with the base
+            with self.lock:
+                records = read_records(self.devices)
+                self.pending = []
+                self.last = {device.id: record for device, record in zip(self.devices, records)}
+            base = pack(self.devices, records)
+            write_file(self.base, base)
+            header = HEADER.pack(MAGIC, FORMAT, hashlib.md5(base).digest())
+            write_file(self.path, header)
+
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+            self.size = len(header)
+
+    def record(self, device):
+        """Queue current state of device for the log, unless it's the one logged last"""
+        # note: not in the middle of a tick, which is never logged on its own
+        with self.lock, locked(device):
+            self.queue(device)
+
+    def queue(self, device):
+        # note: called with `lock` taken and the device state up to date, in the order
+        #       compaction takes them
+        layout, digest = layout_of(type(device))
+        data = layout.read(device)
+        if self.last.get(device.id) == data:
+            return
+        self.last[device.id] = data
+        self.pending.append(ENTRY.pack(bytes.fromhex(device.id), digest, len(data)) + data)
+
+    def poll(self):
+        """Queue state of devices changed by worker processes"""
+        for device in self.devices:
+            if device.shared.stale():
+                with self.lock, device.shared:
+                    self.queue(device)
+
+    def flush(self):
+        """Append queued records to the log, compact it once it's too big"""
+        if self.polled:
+            self.poll()
+
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+
+        with self.file_lock:
+            data = b"".join(pending)
+            os.write(self.fd, data)
+            if self.fsync:
+                os.fsync(self.fd)
+            self.size += len(data)
+
+        if self.size > self.compact_size:
+            self.compact()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception(f"writing {self.path} failed")
+
+    def start(self, polled: bool = False):
+        """Start logging changes of devices, recorded by their requests or polled from shared memory"""
+        self.polled = polled
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        if not polled:
+            for device in self.devices:
+                device.journal = self
+
+        self.thread = threading.Thread(target=self.run, name="fakebox-statelog", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        for device in self.devices:
+            device.journal = None
+        if self.fd is not None:
+            self.flush()
+            os.close(self.fd)
+            self.fd = None
@@ -6,30 +6,21 @@ API docs: https://technical.blebox.eu/openapi_multisensor/openAPI_multiSensor_20
 import math
 import time
 
-from flask import Flask
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import SnapshotCache
+from ._template import Templates, json_response
 
-from ._kit import setup_logging
-from ._common_20200831 import make_blueprint
 
-DEVICE_TYPE = "multiSensor"
-PRODUCT_NAME = "floodsensor"
-
-setup_logging(__name__)
-app = Flask(__name__)
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE, product=PRODUCT_NAME))
-
-
-@app.route("/state", methods=["GET"])
-def state():
-    t = time.time()
-
-    return {
+def payloads(flood) -> tuple[dict, dict]:
+    """Return /state and /state/extended payloads with given readings"""
+    state = {
       "multiSensor": {
         "sensors": [
           {
             "id": 0,
             "type": "flood",
-            "value": int(math.sin(t) > 0),
+            "value": flood,
             "state": 2
           },
           {
@@ -48,18 +39,13 @@ def state():
       }
     }
 
-
-@app.route("/state/extended", methods=["GET"])
-def state_extended():
-    t = time.time()
-
-    return {
+    state_extended = {
         "multiSensor": {
             "sensors": [
                 {
                     "id": 0,
                     "type": "flood",
-                    "value": int(math.sin(t) > 0),
+                    "value": flood,
                     "state": 2,
                     "iconSet": 10
                 },
@@ -80,3 +66,32 @@ def state_extended():
             ]
         }
     }
+
+    return state, state_extended
+
+
+class FloodSensor(Device):
+    DEVICE_TYPE = "multiSensor"
+    PRODUCT_NAME = "floodsensor"
+    API_VERSION = "20200831"
+    blueprint = make_blueprint(API_VERSION)
+    templates = Templates(payloads)
+
+    def __init__(self, *, snapshot_quantum: float = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.snapshots = SnapshotCache(snapshot_quantum)
+
+    def snapshot(self, t: float) -> tuple[bytes, bytes]:
+        """Return encoded /state and /state/extended payloads at given time"""
+        return self.templates.render(self.json, flood=int(math.sin(t) > 0))
+
+    @fast_route("/state")
+    def state(self):
+        return self.snapshots.get(time.time(), self.snapshot)[0]
+
+    @route("/state/extended", methods=["GET"])
+    def state_extended(self):
+        return json_response(self.snapshots.get(time.time(), self.snapshot)[1])
+
+
+__getattr__ = module_app(__name__, FloodSensor)
@@ -2,24 +2,14 @@
 
 API docs: https://technical.blebox.eu/openapi_gatebox/openAPI_gateBox_20230102.html
 """
-import itertools
 import os
 import threading
 import time
 from enum import IntEnum, StrEnum
 
-from flask import Flask
-
-from ._kit import setup_logging, step_state
-from ._common_20230102 import make_blueprint
-
-DEVICE_TYPE = "gateBox"
-
-VARIANT = os.environ.get("VARIANT", "")
-
-setup_logging(__name__ if not VARIANT else f"{__name__}[{VARIANT}]")
-app = Flask(__name__)
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE, name_suffix=VARIANT))
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import Motion
 
 
 class OutputStateEnum(IntEnum):
@@ -80,233 +70,282 @@ class CommandEnum(StrEnum):
     next = "n"
 
 
-STATE_CURRENT = {
-    # note: 100 means fully closed, "moving down" means increasing it
-    "position": 50,
-}
-
-STATE_DESIRED = {
-    "position": 50,
-}
-
-STATE_GATE = {
-    "gateOutputState": OutputStateEnum.NOT_TRIGGERED,
-    "extraButtonOutputState": OutputStateEnum.NOT_TRIGGERED,
-}
-
-INIT_MODE = OpenCloseModeEnum(int(os.environ.get("MODE", OpenCloseModeEnum.STEP_BY_STEP)))
-
-STATE_GATE_EXTENDED = {
-    "openCloseMode": INIT_MODE,
-    "gateType": GateTypeEnum.GARAGE_DOOR,
-    "gatePulseTimeMs": 20000,
-}
-
-INTERNAL_STATE = {
-    "real_position": 50,
-    "last_pulse": OutputEnum.PRIMARY,
-    "primary_activated": 0,
-    "secondary_activated": 0,
-    "next": itertools.cycle([
-        MovementEnum.UP,
-        MovementEnum.STOP,
-        MovementEnum.DOWN,
-        MovementEnum.STOP
-    ])
-}
-
-STATE_LOCK = threading.Lock()
-INTERNAL_STATE_LOCK = threading.Lock()
-
+def position_as_enum(position: int) -> PositionStateEnum:
+    if position <= 0:
+        return PositionStateEnum.FULLY_CLOSED
+    if position >= 100:
+        return PositionStateEnum.FULLY_OPEN
+    return PositionStateEnum.HALF_OPEN
 
-def driver(step: float = 5, interval: float = 1):
-    while True:
-        time.sleep(interval)
 
-        real_position = INTERNAL_STATE["real_position"]
-        desired_position = STATE_DESIRED["position"]
-        is_moving = real_position != desired_position
+# movements the primary output goes through in step-by-step mode
+NEXT_MOVEMENTS = (
+    MovementEnum.UP,
+    MovementEnum.STOP,
+    MovementEnum.DOWN,
+    MovementEnum.STOP,
+)
+
+
+class GateBox(Device):
+    DEVICE_TYPE = "gateBox"
+    API_VERSION = "20230102"
+    blueprint = make_blueprint(API_VERSION)
+    STATE_LAYOUT = Device.STATE_LAYOUT + (
+        ("state_desired.position", "q"),
+        ("state_gate.gateOutputState", "B"),
+        ("state_gate.extraButtonOutputState", "B"),
+        ("internal_state.real_position", "q"),
+        ("internal_state.motion.position", "d"),
+        ("internal_state.motion.started", "d"),
+        ("internal_state.motion.target", "d"),
+        ("internal_state.motion.velocity", "d"),
+        ("internal_state.last_pulse", "B"),
+        ("internal_state.primary_activated", "d"),
+        ("internal_state.secondary_activated", "d"),
+        ("internal_state.next", "B"),
+    )
+    # position change per second
+    SPEED = 5
+    # seconds after which pulse is cancelled and output is no longer triggered
+    PULSE_DURATION = 1
+
+    def __init__(self, *, mode: int = OpenCloseModeEnum.STEP_BY_STEP, variant: str = "", **kwargs):
+        super().__init__(name_suffix=variant, **kwargs)
+        self.mode = OpenCloseModeEnum(mode)
+        self.variant = variant
+
+        self.state_current = {
+            # note: 100 means fully closed, "moving down" means increasing it
+            "position": 50,
+        }
+
+        self.state_desired = {
+            "position": 50,
+        }
+
+        self.state_gate = {
+            "gateOutputState": OutputStateEnum.NOT_TRIGGERED,
+            "extraButtonOutputState": OutputStateEnum.NOT_TRIGGERED,
+        }
+
+        self.state_gate_extended = {
+            "openCloseMode": self.mode,
+            "gateType": GateTypeEnum.GARAGE_DOOR,
+            "gatePulseTimeMs": 20000,
+        }
+
+        self.internal_state = {
+            "real_position": 50,
+            "motion": Motion(50),
+            "last_pulse": OutputEnum.PRIMARY,
+            "primary_activated": 0,
+            "secondary_activated": 0,
+            # note: index of the next of NEXT_MOVEMENTS
+            "next": 0,
+        }
+
+        self.state_lock = threading.Lock()
+        self.internal_state_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=int(os.environ.get("MODE", OpenCloseModeEnum.STEP_BY_STEP)),
+            variant=os.environ.get("VARIANT", ""),
+        )
+
+    def next_movement(self) -> MovementEnum:
+        index = self.internal_state["next"]
+        self.internal_state["next"] = (index + 1) % len(NEXT_MOVEMENTS)
+        return NEXT_MOVEMENTS[index]
+
+    def react(self, t: float):
+        """Decide where to move after a pulse and start moving there"""
+        real_position = self.internal_state["real_position"]
+        desired_position = self.state_desired["position"]
+        is_moving = self.internal_state["motion"].moving(t)
 
         def desire(position: PositionStateEnum):
             nonlocal desired_position
-            STATE_DESIRED["position"] = position
+            self.state_desired["position"] = position
             desired_position = position
 
         def decide_movement() -> MovementEnum:
-            direction = next(INTERNAL_STATE["next"])
+            direction = self.next_movement()
 
             # note: it may happen that gate stopped by itself. If that's the case next
             # gets out of sync, and we need to move extra step
             if is_moving and direction in (MovementEnum.UP, MovementEnum.DOWN):
-                direction = next(INTERNAL_STATE["next"])
+                direction = self.next_movement()
             elif not is_moving and direction == MovementEnum.STOP:
-                direction = next(INTERNAL_STATE["next"])
+                direction = self.next_movement()
 
             return direction
 
-        with STATE_LOCK, INTERNAL_STATE_LOCK:
-            if STATE_GATE_EXTENDED["openCloseMode"] == OpenCloseModeEnum.OPEN_CLOSE:
-                if INTERNAL_STATE["primary_activated"]:
-                    desire(PositionStateEnum.FULLY_OPEN)
-                if INTERNAL_STATE["secondary_activated"]:
-                    desire(PositionStateEnum.FULLY_CLOSED)
-
-            else:
-                if INTERNAL_STATE["primary_activated"]:
-                    movement = decide_movement()
-
-                    match movement:
-                        case MovementEnum.UP:
-                            desire(PositionStateEnum.FULLY_OPEN)
-                        case MovementEnum.DOWN:
-                            desire(PositionStateEnum.FULLY_CLOSED)
-                        case MovementEnum.STOP:
-                            desire(real_position)
-
-                if INTERNAL_STATE["secondary_activated"]:
-                    # in this mode secondary acts as a stop button
-                    desire(real_position)
-
-            new_position = int(step_state(real_position, desired_position, step))
-
-            if new_position != real_position:
-                print("gate moved ->", new_position, flush=True)
-
-            INTERNAL_STATE["real_position"] = int(step_state(real_position, desired_position, step))
-
-            # note: we are canceling pulses at every tick
-            INTERNAL_STATE["primary_activated"] = 0
-            INTERNAL_STATE["secondary_activated"] = 0
-            STATE_GATE["gateOutputState"] = OutputStateEnum.NOT_TRIGGERED
-            STATE_GATE["extraButtonOutputState"] = OutputStateEnum.NOT_TRIGGERED
-
-
-# note: this is hacky, it will break autoreload
-t = threading.Thread(target=driver, daemon=True)
-t.start()
-
-
-def position_as_enum(position: int) -> PositionStateEnum:
-    if position <= 0:
-        return PositionStateEnum.FULLY_CLOSED
-    if position >= 100:
-        return PositionStateEnum.FULLY_OPEN
-    return PositionStateEnum.HALF_OPEN
-
-
-@app.route("/state", methods=["GET"])
-def state():
-    with STATE_LOCK:
-        return {"gate": {
-            "currentPos": position_as_enum(INTERNAL_STATE["real_position"]),
-            **STATE_GATE,
-        }}
-
-
-@app.route("/state/extended", methods=["GET"])
-def state_extended():
-    with STATE_LOCK:
-        return {"gate": {
-            "currentPos": position_as_enum(INTERNAL_STATE["real_position"]),
-            **STATE_GATE,
-            **STATE_GATE_EXTENDED,
-        }}
-
-
-def driver_pulse_primary():
-    INTERNAL_STATE["last_pulse"] = OutputEnum.PRIMARY
-    INTERNAL_STATE["primary_activated"] = time.time()
-    INTERNAL_STATE["secondary_activated"] = 0
-    STATE_GATE["gateOutputState"] = OutputStateEnum.TRIGGERED
-    STATE_GATE["extraButtonOutputState"] = OutputStateEnum.NOT_TRIGGERED
-
-
-def driver_pulse_secondary():
-    INTERNAL_STATE["last_pulse"] = OutputEnum.SECONDARY
-    INTERNAL_STATE["primary_activated"] = 0
-    INTERNAL_STATE["secondary_activated"] = time.time()
-    STATE_GATE["gateOutputState"] = OutputStateEnum.NOT_TRIGGERED
-    STATE_GATE["extraButtonOutputState"] = OutputStateEnum.TRIGGERED
-
-
-def driver_pulse_reverse():
-    match INTERNAL_STATE["last_pulse"]:
-        case OutputEnum.PRIMARY:
-            driver_pulse_secondary()
-
-        case OutputEnum.SECONDARY:
-            driver_pulse_primary()
-
-
-def execute_command(command):
-    if command not in CommandEnum:
-        return f"unrecognized command: <{command}>", 400
-
-    with STATE_LOCK, INTERNAL_STATE_LOCK:
-        mode = STATE_GATE_EXTENDED["openCloseMode"]
-        position = position_as_enum(INTERNAL_STATE["real_position"])
-
-        match mode:
-            case OpenCloseModeEnum.STEP_BY_STEP:
-                match command:
-                    case CommandEnum.open:
-                        if position == PositionStateEnum.FULLY_CLOSED:
-                            driver_pulse_primary()
-                        if position == PositionStateEnum.FULLY_OPEN:
-                            pass
-                        else:
-                            return "can't execute", 409
-                    case CommandEnum.close:
-                        if position == PositionStateEnum.FULLY_OPEN:
-                            driver_pulse_primary()
-                        if position == PositionStateEnum.FULLY_CLOSED:
-                            pass
-                        else:
+        if self.state_gate_extended["openCloseMode"] == OpenCloseModeEnum.OPEN_CLOSE:
+            if self.internal_state["primary_activated"]:
+                desire(PositionStateEnum.FULLY_OPEN)
+            if self.internal_state["secondary_activated"]:
+                desire(PositionStateEnum.FULLY_CLOSED)
+
+        else:
+            if self.internal_state["primary_activated"]:
+                movement = decide_movement()
+
+                match movement:
+                    case MovementEnum.UP:
+                        desire(PositionStateEnum.FULLY_OPEN)
+                    case MovementEnum.DOWN:
+                        desire(PositionStateEnum.FULLY_CLOSED)
+                    case MovementEnum.STOP:
+                        desire(real_position)
+
+            if self.internal_state["secondary_activated"]:
+                # in this mode secondary acts as a stop button
+                desire(real_position)
+
+        motion = self.internal_state["motion"].retarget(desired_position, t, self.SPEED)
+        self.internal_state["motion"] = motion
+        if motion.moving(t):
+            self.wake(motion.arrival() - t)
+
+    def update(self, t: float):
+        """Bring gate position and pulse outputs up to given time"""
+        self.internal_state["real_position"] = int(self.internal_state["motion"].at(t))
+
+        for activated, output in (
+            ("primary_activated", "gateOutputState"),
+            ("secondary_activated", "extraButtonOutputState"),
+        ):
+            if self.internal_state[activated] and t - self.internal_state[activated] >= self.PULSE_DURATION:
+                self.internal_state[activated] = 0
+                self.state_gate[output] = OutputStateEnum.NOT_TRIGGERED
+
+    def tick(self):
+        with self.state_lock, self.internal_state_lock:
+            t = time.time()
+            self.update(t)
+
+            arrival = self.internal_state["motion"].arrival()
+            if arrival > t:
+                return arrival - t
+
+            print("gate moved ->", self.internal_state["real_position"], flush=True)
+            return None
+
+    @fast_route("/state")
+    def state(self):
+        with self.state_lock, self.internal_state_lock:
+            self.update(time.time())
+            return {"gate": {
+                "currentPos": position_as_enum(self.internal_state["real_position"]),
+                **self.state_gate,
+            }}
+
+    @route("/state/extended", methods=["GET"])
+    def state_extended(self):
+        with self.state_lock, self.internal_state_lock:
+            self.update(time.time())
+            return {"gate": {
+                "currentPos": position_as_enum(self.internal_state["real_position"]),
+                **self.state_gate,
+                **self.state_gate_extended,
+            }}
+
+    def driver_pulse_primary(self):
+        t = time.time()
+        self.internal_state["last_pulse"] = OutputEnum.PRIMARY
+        self.internal_state["primary_activated"] = t
+        self.internal_state["secondary_activated"] = 0
+        self.state_gate["gateOutputState"] = OutputStateEnum.TRIGGERED
+        self.state_gate["extraButtonOutputState"] = OutputStateEnum.NOT_TRIGGERED
+        self.react(t)
+
+    def driver_pulse_secondary(self):
+        t = time.time()
+        self.internal_state["last_pulse"] = OutputEnum.SECONDARY
+        self.internal_state["primary_activated"] = 0
+        self.internal_state["secondary_activated"] = t
+        self.state_gate["gateOutputState"] = OutputStateEnum.NOT_TRIGGERED
+        self.state_gate["extraButtonOutputState"] = OutputStateEnum.TRIGGERED
+        self.react(t)
+
+    def driver_pulse_reverse(self):
+        match self.internal_state["last_pulse"]:
+            case OutputEnum.PRIMARY:
+                self.driver_pulse_secondary()
+
+            case OutputEnum.SECONDARY:
+                self.driver_pulse_primary()
+
+    def execute_command(self, command):
+        if command not in CommandEnum:
+            return f"unrecognized command: <{command}>", 400
+
+        with self.state_lock, self.internal_state_lock:
+            self.update(time.time())
+            mode = self.state_gate_extended["openCloseMode"]
+            position = position_as_enum(self.internal_state["real_position"])
+
+            match mode:
+                case OpenCloseModeEnum.STEP_BY_STEP:
+                    match command:
+                        case CommandEnum.open:
+                            if position == PositionStateEnum.FULLY_CLOSED:
+                                self.driver_pulse_primary()
+                            if position == PositionStateEnum.FULLY_OPEN:
+                                pass
+                            else:
+                                return "can't execute", 409
+                        case CommandEnum.close:
+                            if position == PositionStateEnum.FULLY_OPEN:
+                                self.driver_pulse_primary()
+                            if position == PositionStateEnum.FULLY_CLOSED:
+                                pass
+                            else:
+                                return "can't execute", 409
+                        case CommandEnum.next:
+                            self.driver_pulse_primary()
+                        # note: these work the same regardless of the mode
+                        case CommandEnum.primary:
+                            self.driver_pulse_primary()
+                        case CommandEnum.secondary:
+                            self.driver_pulse_secondary()
+
+                case OpenCloseModeEnum.ONLY_OPEN:
+                    match command:
+                        case CommandEnum.open:
+                            self.driver_pulse_primary()
+                        case CommandEnum.close:
                             return "can't execute", 409
-                    case CommandEnum.next:
-                        driver_pulse_primary()
-                    # note: these work the same regardless of the mode
-                    case CommandEnum.primary:
-                        driver_pulse_primary()
-                    case CommandEnum.secondary:
-                        driver_pulse_secondary()
-
-            case OpenCloseModeEnum.ONLY_OPEN:
-                match command:
-                    case CommandEnum.open:
-                        driver_pulse_primary()
-                    case CommandEnum.close:
-                        return "can't execute", 409
-                    case CommandEnum.next:
-                        driver_pulse_primary()
-                    # ditto
-                    case CommandEnum.primary:
-                        driver_pulse_primary()
-                    case CommandEnum.secondary:
-                        driver_pulse_secondary()
-
-            case OpenCloseModeEnum.OPEN_CLOSE:
-                match command:
-                    case CommandEnum.open:
-                        driver_pulse_primary()
-                    case CommandEnum.close:
-                        driver_pulse_secondary()
-                    case CommandEnum.next:
-                        driver_pulse_reverse()
-                    # ditto
-                    case CommandEnum.primary:
-                        driver_pulse_primary()
-                    case CommandEnum.secondary:
-                        driver_pulse_secondary()
-
-        return {"shutter": {**STATE_GATE}}
-
-
-@app.route("/s/<command>", methods=["GET"])
-def s_command(command):
-    return execute_command(command)
-
-
-@app.route("/s/<command>", methods=["POST"])
-def post_s_command(command):
-    return execute_command(command)
+                        case CommandEnum.next:
+                            self.driver_pulse_primary()
+                        # ditto
+                        case CommandEnum.primary:
+                            self.driver_pulse_primary()
+                        case CommandEnum.secondary:
+                            self.driver_pulse_secondary()
+
+                case OpenCloseModeEnum.OPEN_CLOSE:
+                    match command:
+                        case CommandEnum.open:
+                            self.driver_pulse_primary()
+                        case CommandEnum.close:
+                            self.driver_pulse_secondary()
+                        case CommandEnum.next:
+                            self.driver_pulse_reverse()
+                        # ditto
+                        case CommandEnum.primary:
+                            self.driver_pulse_primary()
+                        case CommandEnum.secondary:
+                            self.driver_pulse_secondary()
+
+            return {"shutter": {**self.state_gate}}
+
+    @route("/s/<command>", methods=["GET", "POST"])
+    def s_command(self, command):
+        return self.execute_command(command)
+
+
+__getattr__ = module_app(__name__, GateBox)
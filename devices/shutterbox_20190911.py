@@ -4,25 +4,14 @@ API docs: https://technical.blebox.eu/openapi_shutterbox/openAPI_shutterBox_2019
 """
 import random
 
-import itertools
 import os
 import threading
 import time
 from enum import IntEnum, StrEnum
 
-from flask import Flask
-
-from ._kit import setup_logging, step_state
-from ._common_20190911 import make_blueprint
-
-DEVICE_TYPE = "shutterBox"
-
-VARIANT = os.environ.get("VARIANT", "")
-FAULTY = bool(os.environ.get("FAULTY"))
-
-setup_logging(__name__ if not VARIANT else f"{__name__}[{VARIANT}]")
-app = Flask(__name__)
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE, name_suffix=VARIANT))
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import Motion
 
 
 class StateEnum(IntEnum):
@@ -59,191 +48,257 @@ class CommandEnum(StrEnum):
     down_or_stop = "ds"
 
 
-INIT_MODE = ControlTypeEnum(int(os.environ.get("MODE", ControlTypeEnum.TILT_SHUTTER)))
-
-STATE_CURRENT = {
-    # note: 100 means fully closed, "moving down" means increasing it
-    "position": 50,
-    "tilt": 0,
-}
-
-STATE_DESIRED = {
-    "position": 50,
-    "tilt": 0,
-}
-
-STATE_FAV = {
-    "position": 50,
-    "tilt": 0,
-}
-
-STATE_SHUTTER = {
-    "state": StateEnum.UPPER_LIMIT_REACHED,
-    "currentPos": STATE_CURRENT,
-    "desiredPos": STATE_DESIRED,
-    "favPos": STATE_FAV,
-}
-
-STATE_SHUTTER_EXTENDED = {
-    "calibrationParameters": {
-        "isCalibrated": 1,
-        "maxMoveTimeUpMs": 32423,
-        "maxMoveTimeDownMs": 29815,
-        "maxTiltTimeUpMs": 1250,
-        "maxTiltTimeDownMs": 1250
-    },
-    "controlType": INIT_MODE,
-}
-
-INTERNAL_STATE = {
-    "next": itertools.cycle([
-        StateEnum.MOVING_UP,
-        StateEnum.MANUALLY_STOPPED,
-        StateEnum.MOVING_DOWN,
-        StateEnum.MANUALLY_STOPPED
-    ])
-}
-
-STATE_LOCK = threading.Lock()
-INTERNAL_STATE_LOCK = threading.Lock()
-
-
-def driver(step: float = 5, interval: float = 1):
-    while True:
-        time.sleep(interval)
-        with STATE_LOCK, INTERNAL_STATE_LOCK:
-            current_tilt = STATE_CURRENT["tilt"]
-            desired_tilt = STATE_DESIRED["tilt"]
-            current_pos = STATE_CURRENT["position"]
-            desired_pos = STATE_DESIRED["position"]
-
-            if current_tilt == desired_tilt and current_pos == desired_pos:
-                continue
-
-            new_tilt = int(step_state(current_tilt, desired_tilt, step))
-            new_pos = int(step_state(current_pos, desired_pos, step))
-            # todo: set moving state depending on the delta sign
-            delta_pos = new_pos - current_pos
-
-            if delta_pos > 0:
-                STATE_SHUTTER["state"] = StateEnum.MOVING_DOWN
-
-            if delta_pos < 0:
-                STATE_SHUTTER["state"] = StateEnum.MOVING_UP
-
-            if new_pos == desired_pos:
-                # note: not sure about this eventual state it may be upper/lower
-                #       limit depending on the moving state
-                STATE_SHUTTER["state"] = StateEnum.MANUALLY_STOPPED
-
-            if new_pos >= 100:
-                new_pos = 100
-                STATE_SHUTTER["state"] = StateEnum.LOWER_LIMIT_REACHED
-
-            if new_pos <= 0:
-                new_pos = 0
-                STATE_SHUTTER["state"] = StateEnum.UPPER_LIMIT_REACHED
-
-            if new_tilt != current_tilt:
-                print("state:", StateEnum(STATE_SHUTTER["state"]).name, "tilt ->", new_tilt, flush=True)
-
-            if new_pos != current_pos:
-                print("state:", StateEnum(STATE_SHUTTER["state"]).name, "pos ->", new_pos, flush=True)
-
-            STATE_CURRENT["position"] = new_pos
-            STATE_CURRENT["tilt"] = new_tilt
-
-
-# note: this is hacky, it will break autoreload
-t = threading.Thread(target=driver, daemon=True)
-t.start()
-
-
-@app.route("/api/shutter/state", methods=["GET"])
-def api_shutter_state():
-    with STATE_LOCK:
-        return {"shutter": {**STATE_SHUTTER}}
-
-
-@app.route("/api/shutter/extended/state", methods=["GET"])
-def api_shutter_extended_state():
-    with STATE_LOCK:
-        return {"shutter": {**STATE_SHUTTER, ** STATE_SHUTTER_EXTENDED}}
-
-
-@app.route("/s/<command>", methods=["GET"])
-def s_command(command):
-    if command not in CommandEnum:
-        return f"unrecognized command: <{command}>", 400
-
-    def set_state(state: StateEnum):
-        match state:
-            case StateEnum.MOVING_UP:
-                STATE_DESIRED["position"] = 0
-            case StateEnum.MOVING_DOWN:
-                STATE_DESIRED["position"] = 100
-            case StateEnum.MANUALLY_STOPPED:
-                STATE_DESIRED["position"] = STATE_CURRENT["position"]
-            case StateEnum.OVERLOAD | StateEnum.MOTOR_FAILURE | StateEnum.SAFETY_STOP:
-                STATE_DESIRED["position"] = STATE_CURRENT["position"]
-        STATE_SHUTTER["state"] = state
-
-    with STATE_LOCK, INTERNAL_STATE_LOCK:
-        current_state = STATE_SHUTTER["state"]
-
-        match command:
-            case CommandEnum.up:
-                set_state(StateEnum.MOVING_UP)
-
-            case CommandEnum.down:
-                if FAULTY:
-                    set_state(random.choice([
-                        StateEnum.SAFETY_STOP,
-                        StateEnum.OVERLOAD,
-                        StateEnum.MOTOR_FAILURE
-                    ]))
-                else:
-                    set_state(StateEnum.MOVING_DOWN)
-
-            case CommandEnum.stop:
-                set_state(StateEnum.MANUALLY_STOPPED)
-
-            case CommandEnum.down_or_stop:
-                if current_state in {StateEnum.MOVING_DOWN, StateEnum.MOVING_UP}:
-                    set_state(StateEnum.MANUALLY_STOPPED)
-                else:
-                    set_state(StateEnum.MOVING_DOWN)
-
-            case CommandEnum.up_or_stop:
-                if current_state in {StateEnum.MOVING_DOWN, StateEnum.MOVING_UP}:
-                    set_state(StateEnum.MANUALLY_STOPPED)
-                else:
+# states the "next" command goes through
+NEXT_STATES = (
+    StateEnum.MOVING_UP,
+    StateEnum.MANUALLY_STOPPED,
+    StateEnum.MOVING_DOWN,
+    StateEnum.MANUALLY_STOPPED,
+)
+
+
+class ShutterBox(Device):
+    DEVICE_TYPE = "shutterBox"
+    API_VERSION = "20190911"
+    blueprint = make_blueprint(API_VERSION)
+    STATE_LAYOUT = Device.STATE_LAYOUT + (
+        ("state_shutter.state", "B"),
+        ("state_current.position", "q"),
+        ("state_current.tilt", "q"),
+        ("state_desired.position", "q"),
+        ("state_desired.tilt", "q"),
+        ("internal_state.position.position", "d"),
+        ("internal_state.position.started", "d"),
+        ("internal_state.position.target", "d"),
+        ("internal_state.position.velocity", "d"),
+        ("internal_state.tilt.position", "d"),
+        ("internal_state.tilt.started", "d"),
+        ("internal_state.tilt.target", "d"),
+        ("internal_state.tilt.velocity", "d"),
+        ("internal_state.moved", "?"),
+        ("internal_state.next", "B"),
+    )
+    # position and tilt change per second
+    SPEED = 5
+
+    def __init__(self, *, mode: int = ControlTypeEnum.TILT_SHUTTER, variant: str = "", faulty: bool = False, **kwargs):
+        super().__init__(name_suffix=variant, **kwargs)
+        self.mode = ControlTypeEnum(mode)
+        self.variant = variant
+        self.faulty = faulty
+
+        self.state_current = {
+            # note: 100 means fully closed, "moving down" means increasing it
+            "position": 50,
+            "tilt": 0,
+        }
+
+        self.state_desired = {
+            "position": 50,
+            "tilt": 0,
+        }
+
+        self.state_fav = {
+            "position": 50,
+            "tilt": 0,
+        }
+
+        self.state_shutter = {
+            "state": StateEnum.UPPER_LIMIT_REACHED,
+            "currentPos": self.state_current,
+            "desiredPos": self.state_desired,
+            "favPos": self.state_fav,
+        }
+
+        self.state_shutter_extended = {
+            "calibrationParameters": {
+                "isCalibrated": 1,
+                "maxMoveTimeUpMs": 32423,
+                "maxMoveTimeDownMs": 29815,
+                "maxTiltTimeUpMs": 1250,
+                "maxTiltTimeDownMs": 1250
+            },
+            "controlType": self.mode,
+        }
+
+        self.internal_state = {
+            "position": Motion(self.state_current["position"]),
+            "tilt": Motion(self.state_current["tilt"]),
+            # note: True until the state after last move is settled
+            "moved": False,
+            # note: index of the next of NEXT_STATES
+            "next": 0,
+        }
+
+        self.state_lock = threading.Lock()
+        self.internal_state_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            mode=int(os.environ.get("MODE", ControlTypeEnum.TILT_SHUTTER)),
+            variant=os.environ.get("VARIANT", ""),
+            faulty=bool(os.environ.get("FAULTY")),
+        )
+
+    def next_state(self) -> StateEnum:
+        index = self.internal_state["next"]
+        self.internal_state["next"] = (index + 1) % len(NEXT_STATES)
+        return NEXT_STATES[index]
+
+    def move(self, t: float):
+        """Start moving towards desired position and tilt"""
+        position = self.internal_state["position"].retarget(
+            # note: shutter won't get past its limits, no matter what was desired
+            min(max(self.state_desired["position"], 0), 100), t, self.SPEED
+        )
+        tilt = self.internal_state["tilt"].retarget(self.state_desired["tilt"], t, self.SPEED)
+
+        self.internal_state["position"] = position
+        self.internal_state["tilt"] = tilt
+        self.internal_state["moved"] = position.moving(t) or tilt.moving(t)
+
+        if self.internal_state["moved"]:
+            self.wake(max(position.arrival(), tilt.arrival()) - t)
+
+    def update(self, t: float):
+        """Bring current position, tilt and state up to given time"""
+        position = self.internal_state["position"]
+        tilt = self.internal_state["tilt"]
+
+        self.state_current["position"] = int(position.at(t))
+        self.state_current["tilt"] = int(tilt.at(t))
+
+        if position.moving(t):
+            if position.target > position.position:
+                self.state_shutter["state"] = StateEnum.MOVING_DOWN
+            else:
+                self.state_shutter["state"] = StateEnum.MOVING_UP
+
+        elif self.internal_state["moved"]:
+            # note: not sure about this eventual state it may be upper/lower
+            #       limit depending on the moving state
+            self.state_shutter["state"] = StateEnum.MANUALLY_STOPPED
+
+            if self.state_current["position"] >= 100:
+                self.state_shutter["state"] = StateEnum.LOWER_LIMIT_REACHED
+
+            if self.state_current["position"] <= 0:
+                self.state_shutter["state"] = StateEnum.UPPER_LIMIT_REACHED
+
+            self.internal_state["moved"] = tilt.moving(t)
+
+    def tick(self):
+        with self.state_lock, self.internal_state_lock:
+            t = time.time()
+            self.update(t)
+
+            arrival = max(self.internal_state["position"].arrival(), self.internal_state["tilt"].arrival())
+            if arrival > t:
+                # note: moved again (or further) since it asked for this tick
+                return arrival - t
+
+            state = StateEnum(self.state_shutter["state"]).name
+            print("state:", state, "pos ->", self.state_current["position"], "tilt ->", self.state_current["tilt"], flush=True)
+            return None
+
+    @fast_route("/api/shutter/state")
+    def api_shutter_state(self):
+        with self.state_lock, self.internal_state_lock:
+            self.update(time.time())
+            return {"shutter": {**self.state_shutter}}
+
+    @route("/api/shutter/extended/state", methods=["GET"])
+    def api_shutter_extended_state(self):
+        with self.state_lock, self.internal_state_lock:
+            self.update(time.time())
+            return {"shutter": {**self.state_shutter, **self.state_shutter_extended}}
+
+    @route("/s/<command>", methods=["GET"])
+    def s_command(self, command):
+        if command not in CommandEnum:
+            return f"unrecognized command: <{command}>", 400
+
+        def set_state(state: StateEnum):
+            match state:
+                case StateEnum.MOVING_UP:
+                    self.state_desired["position"] = 0
+                case StateEnum.MOVING_DOWN:
+                    self.state_desired["position"] = 100
+                case StateEnum.MANUALLY_STOPPED:
+                    self.state_desired["position"] = self.state_current["position"]
+                case StateEnum.OVERLOAD | StateEnum.MOTOR_FAILURE | StateEnum.SAFETY_STOP:
+                    self.state_desired["position"] = self.state_current["position"]
+            self.state_shutter["state"] = state
+
+        with self.state_lock, self.internal_state_lock:
+            t = time.time()
+            self.update(t)
+            current_state = self.state_shutter["state"]
+
+            match command:
+                case CommandEnum.up:
                     set_state(StateEnum.MOVING_UP)
 
-        if command == CommandEnum.next:
-            while (new := next(INTERNAL_STATE["next"])) != current_state:
-                set_state(new)
-
-        return {"shutter": {**STATE_SHUTTER}}
-
-
-@app.route("/s/t/<int:tilt>")
-def s_t_tilt(tilt):
-    with STATE_LOCK, INTERNAL_STATE_LOCK:
-        STATE_DESIRED["tilt"] = tilt
-        return {"shutter": {**STATE_SHUTTER}}
-
-
-@app.route("/s/p/<int:position>")
-def s_p_position(position):
-    with STATE_LOCK, INTERNAL_STATE_LOCK:
-        STATE_DESIRED["position"] = position
-        return {"shutter": {**STATE_SHUTTER}}
-
+                case CommandEnum.down:
+                    if self.faulty:
+                        set_state(random.choice([
+                            StateEnum.SAFETY_STOP,
+                            StateEnum.OVERLOAD,
+                            StateEnum.MOTOR_FAILURE
+                        ]))
+                    else:
+                        set_state(StateEnum.MOVING_DOWN)
+
+                case CommandEnum.stop:
+                    set_state(StateEnum.MANUALLY_STOPPED)
 
-@app.route("/s/p/<int:position>/t/<int:tilt>")
-def s_p_position_t_tilt(position, tilt):
-    with STATE_LOCK, INTERNAL_STATE_LOCK:
-        STATE_DESIRED["position"] = position
-        STATE_DESIRED["tilt"] = tilt
-        return {"shutter": {**STATE_SHUTTER}}
+                case CommandEnum.down_or_stop:
+                    if current_state in {StateEnum.MOVING_DOWN, StateEnum.MOVING_UP}:
+                        set_state(StateEnum.MANUALLY_STOPPED)
+                    else:
+                        set_state(StateEnum.MOVING_DOWN)
+
+                case CommandEnum.up_or_stop:
+                    if current_state in {StateEnum.MOVING_DOWN, StateEnum.MOVING_UP}:
+                        set_state(StateEnum.MANUALLY_STOPPED)
+                    else:
+                        set_state(StateEnum.MOVING_UP)
+
+            if command == CommandEnum.next:
+                while (new := self.next_state()) != current_state:
+                    set_state(new)
+
+            self.move(t)
+            return {"shutter": {**self.state_shutter}}
+
+    @route("/s/t/<int:tilt>")
+    def s_t_tilt(self, tilt):
+        with self.state_lock, self.internal_state_lock:
+            t = time.time()
+            self.update(t)
+            self.state_desired["tilt"] = tilt
+            self.move(t)
+            return {"shutter": {**self.state_shutter}}
+
+    @route("/s/p/<int:position>")
+    def s_p_position(self, position):
+        with self.state_lock, self.internal_state_lock:
+            t = time.time()
+            self.update(t)
+            self.state_desired["position"] = position
+            self.move(t)
+            return {"shutter": {**self.state_shutter}}
+
+    @route("/s/p/<int:position>/t/<int:tilt>")
+    def s_p_position_t_tilt(self, position, tilt):
+        with self.state_lock, self.internal_state_lock:
+            t = time.time()
+            self.update(t)
+            self.state_desired["position"] = position
+            self.state_desired["tilt"] = tilt
+            self.move(t)
+            return {"shutter": {**self.state_shutter}}
+
+
+__getattr__ = module_app(__name__, ShutterBox)
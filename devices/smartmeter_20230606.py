@@ -3,302 +3,286 @@
 Important: uses multiSensor API specification
 API docs: https://technical.blebox.eu/openapi_multisensor/openAPI_multiSensor_20230606.html
 """
-import math
 import time
 
-from flask import Flask
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import SnapshotCache
+from ._signals import SINE, sensor_signal
+from ._template import Templates, json_response
 
-from ._kit import setup_logging
-from ._common_20230606 import make_blueprint
-
-DEVICE_TYPE = "multiSensor"
-PRODUCT_NAME = "SmartMeter"
-
-setup_logging(__name__)
-app = Flask(__name__)
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE, product=PRODUCT_NAME))
-
-
-def signal(x):
-    return int(abs(math.sin(x)) * 100)
 
+def payloads(first_set, second_set, third_set) -> tuple[dict, dict]:
+    """Return /state and /state/extended payloads with given readings"""
+    # too many sensors to play with, these do not matter that much for smartmeter
+    extra = {
+        "iconSet": 10,
+        "elapsedTimeS": 10,
+        "trend": 1,
+        "name": "n/a"
+    }
 
-@app.route("/state", methods=["GET"])
-def state():
-    t = time.time()
-    return {
+    state = {
         "multiSensor": {
             "sensors": [
                 # first sensor set
                 {
                     "id": 0,
                     "type": "forwardActiveEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "reverseActiveEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "forwardReactiveEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "reverseReactiveEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "apparentEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "activePower",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "apparentPower",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "voltage",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "current",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "frequency",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                 },
                 # second sensor set
                 {
                     "id": 1,
                     "type": "forwardActiveEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "reverseActiveEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "forwardReactiveEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "reverseReactiveEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "apparentEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "activePower",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "apparentPower",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "voltage",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "current",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "frequency",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                 },
                 # third sensor set
                 {
                     "id": 2,
                     "type": "forwardActiveEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "reverseActiveEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "forwardReactiveEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "reverseReactiveEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "apparentEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "activePower",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "apparentPower",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "voltage",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "current",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
                 {
                     "id": 2,
                     "type": "frequency",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                 },
             ]
         }
     }
 
-
-@app.route("/state/extended", methods=["GET"])
-def state_extended():
-    t = time.time()
-    # too many sensors to play with, these do not matter that much for smartmeter
-    extra = {
-        "iconSet": 10,
-        "elapsedTimeS": 10,
-        "trend": 1,
-        "name": "n/a"
-    }
-
-    return {
+    state_extended = {
         "multiSensor": {
             "sensors": [
                 # first sensor set
                 {
                     "id": 0,
                     "type": "forwardActiveEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "reverseActiveEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "forwardReactiveEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "reverseReactiveEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "apparentEnergy",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "activePower",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "apparentPower",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "voltage",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "current",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 0,
                     "type": "frequency",
-                    "value": signal(t),
+                    "value": first_set,
                     "state": 2,
                     **extra,
                 },
@@ -306,70 +290,70 @@ def state_extended():
                 {
                     "id": 1,
                     "type": "forwardActiveEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "reverseActiveEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "forwardReactiveEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "reverseReactiveEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "apparentEnergy",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "activePower",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "apparentPower",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "voltage",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "current",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 1,
                     "type": "frequency",
-                    "value": signal(t) + 1,
+                    "value": second_set,
                     "state": 2,
                     **extra,
                 },
@@ -377,70 +361,70 @@ def state_extended():
                 {
                     "id": 2,
                     "type": "forwardActiveEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "reverseActiveEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "forwardReactiveEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "reverseReactiveEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "apparentEnergy",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "activePower",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "apparentPower",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "voltage",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "current",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
                 {
                     "id": 2,
                     "type": "frequency",
-                    "value": signal(t) + 2,
+                    "value": third_set,
                     "state": 2,
                     **extra,
                 },
@@ -449,3 +433,39 @@ def state_extended():
             "notConfiguredProbes": 0,
         }
     }
+
+    return state, state_extended
+
+
+class SmartMeter(Device):
+    DEVICE_TYPE = "multiSensor"
+    PRODUCT_NAME = "SmartMeter"
+    API_VERSION = "20230606"
+    blueprint = make_blueprint(API_VERSION)
+    templates = Templates(payloads)
+
+    def __init__(self, *, phase: float = None, amplitude: float = 1, snapshot_quantum: float = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.signal = sensor_signal(SINE, self.serial, phase, amplitude)
+        self.snapshots = SnapshotCache(snapshot_quantum)
+
+    def snapshot(self, t: float) -> tuple[bytes, bytes]:
+        """Return encoded /state and /state/extended payloads at given time"""
+        signal_now = int(self.signal.at(t))
+        return self.templates.render(
+            self.json,
+            first_set=signal_now,
+            second_set=signal_now + 1,
+            third_set=signal_now + 2,
+        )
+
+    @fast_route("/state")
+    def state(self):
+        return self.snapshots.get(time.time(), self.snapshot)[0]
+
+    @route("/state/extended", methods=["GET"])
+    def state_extended(self):
+        return json_response(self.snapshots.get(time.time(), self.snapshot)[1])
+
+
+__getattr__ = module_app(__name__, SmartMeter)
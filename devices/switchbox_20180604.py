@@ -2,88 +2,91 @@
 
 API docs: https://technical.blebox.eu/openapi_switchbox/openAPI_switchBox_20180604.html
 """
-from flask import Flask, request
+from flask import request
 from werkzeug.exceptions import BadRequest
 
-from ._common_20180604 import make_blueprint
-from ._kit import require_field, setup_logging
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import Items, payload_validator
 
-DEVICE_TYPE = "switchBox"
 
-setup_logging(__name__)
-app = Flask(__name__)
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE))
+validate_relays = payload_validator({
+    ".relays": Items({".relay": int, ".state": int}, 1, 1, "Error: this device has only one relay"),
+})
 
-STATE_RELAYS = {
-    "0": 0,
-}
 
+class SwitchBox(Device):
+    DEVICE_TYPE = "switchBox"
+    API_VERSION = "20180604"
+    blueprint = make_blueprint(API_VERSION)
+    STATE_LAYOUT = Device.STATE_LAYOUT + (
+        ("relays.0", "B"),
+    )
 
-@app.route("/api/relay/state", methods=["GET"])
-def api_relay_state():
-    # note: in this api level, relay state is just an array. In later versions
-    # it is {"relays": []} object
-    return [
-        {
-            "relay": 0,
-            "state": STATE_RELAYS["0"]
-        },
-    ]
-
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.relays = {
+            "0": 0,
+        }
 
-@app.route("/api/relay/extended/state", methods=["GET"])
-def api_relay_extended_state():
-    return {
-        "relays": [
+    @fast_route("/api/relay/state")
+    def api_relay_state(self):
+        # note: in this api level, relay state is just an array. In later versions
+        # it is {"relays": []} object
+        return [
             {
                 "relay": 0,
-                "state": STATE_RELAYS["0"],
-                "stateAfterRestart": 2,
-                "defaultForTime": 0,
+                "state": self.relays["0"]
             },
-        ],
-    }
-
-
-@app.route("/api/relay/set", methods=["POST"])
-def api_relay_set():
-    relays = require_field(request.json, ".relays")
-    if not isinstance(relays, list):
-        raise BadRequest("Bad payload: .relays must be a list")
-
-    if not (len(relays) == 1):
-        raise BadRequest("Error: this device has only one relay")
-
-    # todo: forTime control
-    states = {}
-    for i, relay in enumerate(relays):
-        lead = f".relays[{i}]"
-        idx = str(require_field(relay, ".relay", int, _lead=lead))
-        state = require_field(relay, ".state", int, _lead=lead)
-        state = int(not STATE_RELAYS[idx]) if state == 2 else int(state)
-        states[idx] = state
-
-    if len(states) != len(relays):
-        raise BadRequest("Error: duplicated relays")
-
-    STATE_RELAYS.update(states)
-    return {
-        "relays": [
+        ]
+
+    @route("/api/relay/extended/state", methods=["GET"])
+    def api_relay_extended_state(self):
+        return {
+            "relays": [
+                {
+                    "relay": 0,
+                    "state": self.relays["0"],
+                    "stateAfterRestart": self.STATE_AFTER_RESTART,
+                    "defaultForTime": 0,
+                },
+            ],
+        }
+
+    @route("/api/relay/set", methods=["POST"])
+    def api_relay_set(self):
+        (relays,) = validate_relays(request.json)
+
+        # todo: forTime control
+        states = {}
+        for relay, state in relays:
+            idx = str(relay)
+            state = int(not self.relays[idx]) if state == 2 else int(state)
+            states[idx] = state
+
+        if len(states) != len(relays):
+            raise BadRequest("Error: duplicated relays")
+
+        self.relays.update(states)
+        return {
+            "relays": [
+                {
+                    "relay": 0,
+                    "state": self.relays["0"]
+                },
+            ]
+        }
+
+    @route("/s/<state>", methods=["GET"])
+    def s_state(self, state):
+        relay = "0"
+        self.relays[relay] = int(not self.relays[relay]) if state == 2 else int(state)
+        return [
             {
                 "relay": 0,
-                "state": STATE_RELAYS["0"]
-            },
+                "state": self.relays["0"]
+            }
         ]
-    }
 
 
-@app.route("/s/<state>", methods=["GET"])
-def s_state(state):
-    relay = "0"
-    STATE_RELAYS[relay] = int(not STATE_RELAYS[relay]) if state == 2 else int(state)
-    return [
-        {
-            "relay": 0,
-            "state": STATE_RELAYS["0"]
-        }
-    ]
+__getattr__ = module_app(__name__, SwitchBox)
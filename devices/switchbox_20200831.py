@@ -4,122 +4,125 @@ API docs: https://technical.blebox.eu/openapi_switchbox/openAPI_switchBox_202008
 """
 import time
 
-from flask import Flask, request
+from flask import request
 from werkzeug.exceptions import BadRequest
 
-from ._common_20200831 import make_blueprint
-from ._kit import synthetic_signal, t_integral, require_field, setup_logging
-
-DEVICE_TYPE = "switchBox"
-
-setup_logging(__name__)
-app = Flask(__name__)
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE))
-
-
-POWER_MEASURING_ENABLED = 1
-STATE_RELAYS = {
-    "0": 0,
-}
-
-
-@app.route("/state", methods=["GET"])
-def state():
-    return {
-        "relays": [
-            {
-                "relay": 0,
-                "state": STATE_RELAYS["0"]
-            },
-        ]
-    }
-
-
-@app.route("/state", methods=["POST"])
-def state_post():
-    relays = require_field(request.json, ".relays")
-    if not isinstance(relays, list):
-        raise BadRequest("Bad payload: .relays must be a list")
-
-    if not (len(relays) == 1):
-        raise BadRequest("Error: this device has only one relay")
-
-    # todo: forTime control
-    states = {}
-    for i, relay in enumerate(relays):
-        lead = f".relays[{i}]"
-        idx = str(require_field(relay, ".relay", int, _lead=lead))
-        state = require_field(relay, ".state", int, _lead=lead)
-        state = int(not STATE_RELAYS[idx]) if state == 2 else int(state)
-        states[idx] = state
-
-    if len(states) != len(relays):
-        raise BadRequest("Error: duplicated relays")
-
-    STATE_RELAYS.update(states)
-    return {
-        "relays": [
-            {
-                "relay": 0,
-                "state": STATE_RELAYS["0"]
-            },
-        ]
-    }
-
-
-@app.route("/state/extended", methods=["GET"])
-def state_extended():
-    # scale to minutes
-    t = time.time()
-    delta_t = 3600
-
-    if POWER_MEASURING_ENABLED:
-        power_measuring = {
-            "enabled": 1,
-            "powerConsumption": [
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import Items, energy_used, synthetic_signal, payload_validator
+
+
+validate_relays = payload_validator({
+    ".relays": Items({".relay": int, ".state": int}, 1, 1, "Error: this device has only one relay"),
+})
+
+
+class SwitchBox(Device):
+    DEVICE_TYPE = "switchBox"
+    API_VERSION = "20200831"
+    blueprint = make_blueprint(API_VERSION)
+    STATE_LAYOUT = Device.STATE_LAYOUT + (
+        ("relays.0", "B"),
+    )
+
+    POWER_MEASURING_ENABLED = 1
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.relays = {
+            "0": 0,
+        }
+
+    @fast_route("/state")
+    def state(self):
+        return {
+            "relays": [
                 {
-                    "periodS": delta_t,
+                    "relay": 0,
+                    "state": self.relays["0"]
+                },
+            ]
+        }
 
-                    # note: let's assume synthetic_signal is power consumption
-                    # at the moment in Watts. Itegral will be in Ws. We need to
-                    # rescale to keep consistent with activePower
-                    "value": t_integral(t - delta_t, t, synthetic_signal) / (1000 * 3600)  # kWh
-                }
+    @route("/state", methods=["POST"])
+    def state_post(self):
+        (relays,) = validate_relays(request.json)
+
+        # todo: forTime control
+        states = {}
+        for relay, state in relays:
+            idx = str(relay)
+            state = int(not self.relays[idx]) if state == 2 else int(state)
+            states[idx] = state
+
+        if len(states) != len(relays):
+            raise BadRequest("Error: duplicated relays")
+
+        self.relays.update(states)
+        return {
+            "relays": [
+                {
+                    "relay": 0,
+                    "state": self.relays["0"]
+                },
             ]
         }
-    else:
-        power_measuring = {"enabled": 0}
-
-    return {
-        "relays": [
-            {
-                "relay": 0,
-                "state": STATE_RELAYS["0"],
-                "stateAfterRestart": 2,
-                "defaultForTime": 0,
-            },
-        ],
-        "powerMeasuring": power_measuring,
-        "sensors": [
-            {
-                "type": "activePower",
-                "value": synthetic_signal(t),  # [Watt]
-                "trend": 0,
-                "state": 4
-            }
-        ]
-    }
-
-
-@app.route("/s/<state>", methods=["GET"])
-def s_state(state):
-    relay = "0"
-    STATE_RELAYS[relay] = int(not STATE_RELAYS[relay]) if state == 2 else int(state)
-    return {
-        "relays": [
-            {
-                "relay": 0,
-                "state": STATE_RELAYS["0"]
+
+    @route("/state/extended", methods=["GET"])
+    def state_extended(self):
+        # scale to minutes
+        t = time.time()
+        delta_t = 3600
+
+        if self.POWER_MEASURING_ENABLED:
+            power_measuring = {
+                "enabled": 1,
+                "powerConsumption": [
+                    {
+                        "periodS": delta_t,
+
+                        # note: let's assume synthetic_signal is power consumption
+                        # at the moment in Watts. Its integral is rescaled to kWh to
+                        # keep consistent with activePower
+                        "value": energy_used(t - delta_t, t)  # kWh
+                    }
+                ]
             }
-        ]
-    }
+        else:
+            power_measuring = {"enabled": 0}
+
+        return {
+            "relays": [
+                {
+                    "relay": 0,
+                    "state": self.relays["0"],
+                    "stateAfterRestart": self.STATE_AFTER_RESTART,
+                    "defaultForTime": 0,
+                },
+            ],
+            "powerMeasuring": power_measuring,
+            "sensors": [
+                {
+                    "type": "activePower",
+                    "value": synthetic_signal(t),  # [Watt]
+                    "trend": 0,
+                    "state": 4
+                }
+            ]
+        }
+
+    @route("/s/<state>", methods=["GET"])
+    def s_state(self, state):
+        relay = "0"
+        self.relays[relay] = int(not self.relays[relay]) if state == 2 else int(state)
+        return {
+            "relays": [
+                {
+                    "relay": 0,
+                    "state": self.relays["0"]
+                }
+            ]
+        }
+
+
+__getattr__ = module_app(__name__, SwitchBox)
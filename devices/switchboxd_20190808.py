@@ -4,141 +4,146 @@ API docs: https://technical.blebox.eu/openapi_switchboxd/openAPI_switchBoxD_2019
 """
 import time
 
-from flask import Flask, request
+from flask import request
 from werkzeug.exceptions import BadRequest
 
-from ._common_20190808 import make_blueprint
-from ._kit import require_field, synthetic_signal, t_integral, setup_logging
-
-DEVICE_TYPE = "switchBoxD"
-
-setup_logging(__name__)
-app = Flask(__name__)
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE))
-
-POWER_MEASURING_ENABLED = 1
-STATE_RELAYS = {
-    "0": 0,
-    "1": 0,
-}
-
-
-@app.route("/api/relay/state", methods=["GET"])
-def api_relay_state():
-    return {
-        "relays": [
-            {
-                "relay": 0,
-                "state": STATE_RELAYS["0"]
-            },
-            {
-                "relay": 1,
-                "state": STATE_RELAYS["1"]
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import Items, energy_used, payload_validator, synthetic_signal
+
+
+validate_relays = payload_validator({
+    ".relays": Items({".relay": int, ".state": int}, 1, 2, "Error: this device has only two relays"),
+})
+
+
+class SwitchBoxD(Device):
+    DEVICE_TYPE = "switchBoxD"
+    API_VERSION = "20190808"
+    blueprint = make_blueprint(API_VERSION)
+    STATE_LAYOUT = Device.STATE_LAYOUT + (
+        ("relays.0", "B"),
+        ("relays.1", "B"),
+    )
+
+    POWER_MEASURING_ENABLED = 1
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.relays = {
+            "0": 0,
+            "1": 0,
+        }
+
+    @fast_route("/api/relay/state")
+    def api_relay_state(self):
+        return {
+            "relays": [
+                {
+                    "relay": 0,
+                    "state": self.relays["0"]
+                },
+                {
+                    "relay": 1,
+                    "state": self.relays["1"]
+                }
+            ]
+        }
+
+    @route("/api/relay/extended/state", methods=["GET"])
+    def api_relay_extended_state(self):
+        # scale to minutes
+        t = time.time()
+        delta_t = 3600
+
+        if self.POWER_MEASURING_ENABLED:
+            power_measuring = {
+                "enabled": 1,
+                "powerConsumption": [
+                    {
+                        "periodS": delta_t,
+
+                        # note: let's assume synthetic_signal is power consumption
+                        # at the moment in Watts. Its integral is rescaled to kWh to
+                        # keep consistent with activePower
+                        "value": energy_used(t - delta_t, t)  # kWh
+                    }
+                ]
             }
-        ]
-    }
+        else:
+            power_measuring = {"enabled": 0}
 
+        return {
+            "relays": [
+                {
+                    "relay": 0,
+                    "state": self.relays["0"],
+                    "stateAfterRestart": self.STATE_AFTER_RESTART,
+                    "defaultForTime": 0,
+                    "name": "Output no 1"
+                },
+                {
+                    "relay": 1,
+                    "state": self.relays["1"],
+                    "stateAfterRestart": self.STATE_AFTER_RESTART,
+                    "defaultForTime": 0,
+                    "name": "Output no 2"
+                }
+            ],
+            "powerMeasuring": power_measuring,
+            "sensors": [
+                {
+                    "type": "activePower",
+                    "value": synthetic_signal(t),  # [Watt]
+                    "trend": 0,  # not used, always 0
+                    "state": 0,  # not used, always 0
+                }
+            ]
+        }
+
+    @route("/api/relay/set", methods=["POST"])
+    def api_relay_set(self):
+        (relays,) = validate_relays(request.json)
+
+        # todo: forTime control
+        states = {}
+        for relay, state in relays:
+            idx = str(relay)
+            state = int(not self.relays[idx]) if state == 2 else int(state)
+            states[idx] = state
 
-@app.route("/api/relay/extended/state", methods=["GET"])
-def api_relay_extended_state():
-    # scale to minutes
-    t = time.time()
-    delta_t = 3600
+        if len(states) != len(relays):
+            raise BadRequest("Error: duplicated relays")
 
-    if POWER_MEASURING_ENABLED:
-        power_measuring = {
-            "enabled": 1,
-            "powerConsumption": [
+        self.relays.update(states)
+        return {
+            "relays": [
                 {
-                    "periodS": delta_t,
+                    "relay": 0,
+                    "state": self.relays["0"]
+                },
+                {
+                    "relay": 1,
+                    "state": self.relays["1"]
+                }
+            ]
+        }
 
-                    # note: let's assume synthetic_signal is power consumption
-                    # at the moment in Watts. Itegral will be in Ws. We need to
-                    # rescale to keep consistent with activePower
-                    "value": t_integral(t - delta_t, t, synthetic_signal) / (1000 * 3600)  # kWh
+    @route("/s/<relay>/<state>", methods=["GET"])
+    def s_relay_state(self, relay, state):
+        self.relays[relay] = int(not self.relays[relay]) if state == 2 else int(state)
+        return {
+            "relays": [
+                {
+                    "relay": 0,
+                    "state": self.relays["0"]
+                },
+                {
+                    "relay": 1,
+                    "state": self.relays["1"]
                 }
             ]
         }
-    else:
-        power_measuring = {"enabled": 0}
-
-    return {
-        "relays": [
-            {
-                "relay": 0,
-                "state": STATE_RELAYS["0"],
-                "stateAfterRestart": 2,
-                "defaultForTime": 0,
-                "name": "Output no 1"
-            },
-            {
-                "relay": 1,
-                "state": STATE_RELAYS["1"],
-                "stateAfterRestart": 2,
-                "defaultForTime": 0,
-                "name": "Output no 2"
-            }
-        ],
-        "powerMeasuring": power_measuring,
-        "sensors": [
-            {
-                "type": "activePower",
-                "value": synthetic_signal(t),  # [Watt]
-                "trend": 0,  # not used, always 0
-                "state": 0,  # not used, always 0
-            }
-        ]
-    }
-
-
-@app.route("/api/relay/set", methods=["POST"])
-def api_relay_set():
-    relays = require_field(request.json, ".relays")
-    if not isinstance(relays, list):
-        raise BadRequest("Bad payload: .relays must be a list")
-
-    if not (1 <= len(relays) <= 2):
-        raise BadRequest("Error: this device has only two relays")
-
-    # todo: forTime control
-    states = {}
-    for i, relay in enumerate(relays):
-        lead = f".relays[{i}]"
-        idx = str(require_field(relay, ".relay", int, _lead=lead))
-        state = require_field(relay, ".state", int, _lead=lead)
-        state = int(not STATE_RELAYS[idx]) if state == 2 else int(state)
-        states[idx] = state
-
-    if len(states) != len(relays):
-        raise BadRequest("Error: duplicated relays")
-
-    STATE_RELAYS.update(states)
-    return {
-        "relays": [
-            {
-                "relay": 0,
-                "state": STATE_RELAYS["0"]
-            },
-            {
-                "relay": 1,
-                "state": STATE_RELAYS["1"]
-            }
-        ]
-    }
-
-
-@app.route("/s/<relay>/<state>", methods=["GET"])
-def s_relay_state(relay, state):
-    STATE_RELAYS[relay] = int(not STATE_RELAYS[relay]) if state == 2 else int(state)
-    return {
-        "relays": [
-            {
-                "relay": 0,
-                "state": STATE_RELAYS["0"]
-            },
-            {
-                "relay": 1,
-                "state": STATE_RELAYS["1"]
-            }
-        ]
-    }
+
+
+__getattr__ = module_app(__name__, SwitchBoxD)
@@ -4,72 +4,55 @@ Important: uses multiSensor API specification
 API docs: https://technical.blebox.eu/openapi_multisensor/openAPI_multiSensor_20210413.html
 """
 import math
-import statistics
 import time
 
-from flask import Flask
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import SlidingWindow, SnapshotCache
+from ._signals import SINE, sensor_signal
+from ._template import Templates, json_response
 
-from ._kit import setup_logging
-from ._common_20210413 import make_blueprint
 
-DEVICE_TYPE = "multiSensor"
-PRODUCT_NAME = "wind&rainsensor"
-
-setup_logging(__name__)
-app = Flask(__name__)
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE, product=PRODUCT_NAME))
-
-
-def signal(x):
-    return int(abs(math.sin(x)) * 100)
-
-@app.route("/state", methods=["GET"])
-def state():
-    t = time.time()
-    return {
+def payloads(signal_now, signal_avg, signal_max, rain) -> tuple[dict, dict]:
+    """Return /state and /state/extended payloads with given readings"""
+    state = {
         "multiSensor": {
             "sensors": [
                 {
                     "id": 0,
                     "type": "wind",
-                    "value": signal(t),
+                    "value": signal_now,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "windAvg",
-                    # avg of last 10 min
-                    "value": int(statistics.mean([signal(t-x) for x in range(600)])),
+                    "value": signal_avg,
                     "state": 2,
                 },
                 {
                     "id": 0,
                     "type": "windMax",
-                    # max of last 10 min
-                    "value": max(*[signal(t-x) for x in range(600)]),
+                    "value": signal_max,
                     "state": 2,
                 },
                 {
                     "id": 1,
                     "type": "rain",
-                    "value": int(math.sin(t) > 0),
+                    "value": rain,
                     "state": 2,
                 }
             ]
         }
     }
 
-
-@app.route("/state/extended", methods=["GET"])
-def state_extended():
-    t = time.time()
-    return {
+    state_extended = {
         "multiSensor": {
             "sensors": [
                 {
                     "id": 0,
                     "type": "wind",
-                    "value": signal(t),
+                    "value": signal_now,
                     "state": 2,
                     "iconSet": 10,
                     "elapsedTimeS": 10,
@@ -79,8 +62,7 @@ def state_extended():
                 {
                     "id": 0,
                     "type": "windAvg",
-                    # avg of last 10 min
-                    "value": int(statistics.mean([signal(t-x) for x in range(600)])),
+                    "value": signal_avg,
                     "state": 2,
                     "iconSet": 10,
                     "elapsedTimeS": 10,
@@ -90,8 +72,7 @@ def state_extended():
                 {
                     "id": 0,
                     "type": "windMax",
-                    # max of last 10 min
-                    "value": max(*[signal(t - x) for x in range(600)]),
+                    "value": signal_max,
                     "state": 2,
                     "iconSet": 10,
                     "elapsedTimeS": 10,
@@ -101,7 +82,7 @@ def state_extended():
                 {
                     "id": 1,
                     "type": "rain",
-                    "value": int(math.sin(t) > 0),
+                    "value": rain,
                     "state": 2,
                     "iconSet": 10,
                     "elapsedTimeS": 10,
@@ -112,3 +93,42 @@ def state_extended():
             "notConfiguredProbes": 0,
         }
     }
+
+    return state, state_extended
+
+
+class WindRainSensor(Device):
+    DEVICE_TYPE = "multiSensor"
+    PRODUCT_NAME = "wind&rainsensor"
+    API_VERSION = "20210413"
+    blueprint = make_blueprint(API_VERSION)
+    templates = Templates(payloads)
+
+    def __init__(self, *, phase: float = None, amplitude: float = 1, snapshot_quantum: float = 1, **kwargs):
+        super().__init__(**kwargs)
+        self.signal = sensor_signal(SINE, self.serial, phase, amplitude)
+        self.snapshots = SnapshotCache(snapshot_quantum)
+        self.signal_window = SlidingWindow(lambda x: int(self.signal(x)), current=lambda x: int(self.signal.at(x)))
+
+    def snapshot(self, t: float) -> tuple[bytes, bytes]:
+        """Return encoded /state and /state/extended payloads at given time"""
+        # avg and max of last 10 min
+        signal_avg, signal_max, signal_now = self.signal_window.stats(t)
+        return self.templates.render(
+            self.json,
+            signal_now=signal_now,
+            signal_avg=signal_avg,
+            signal_max=signal_max,
+            rain=int(math.sin(t) > 0),
+        )
+
+    @fast_route("/state")
+    def state(self):
+        return self.snapshots.get(time.time(), self.snapshot)[0]
+
+    @route("/state/extended", methods=["GET"])
+    def state_extended(self):
+        return json_response(self.snapshots.get(time.time(), self.snapshot)[1])
+
+
+__getattr__ = module_app(__name__, WindRainSensor)
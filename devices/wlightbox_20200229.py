@@ -11,15 +11,22 @@ from enum import IntEnum
 
 from itertools import zip_longest
 
-from flask import Flask, request
+from flask import request
 
-from ._common_20200229 import make_blueprint
-from ._kit import require_field, setup_logging
+from ._common import make_blueprint
+from ._device import Device, fast_route, module_app, route
+from ._kit import Optional, payload_validator
 
-DEVICE_TYPE = "wLightBox"
 
-setup_logging(__name__)
-app = Flask(__name__)
+validate_rgbw_set = payload_validator({
+    ".rgbw": dict,
+})
+
+# note: fields of .rgbw, reported without the .rgbw lead as they always were
+validate_rgbw = payload_validator({
+    ".effectID": Optional(int),
+    ".desiredColor": Optional(str),
+})
 
 
 class BleboxColorMode(IntEnum):
@@ -32,56 +39,6 @@ class BleboxColorMode(IntEnum):
     RGBWW = 7  # RGB with two color-temperature sliders(warm, cold)
 
 
-INIT_MODE = BleboxColorMode(int(os.environ.get("MODE", BleboxColorMode.CTx2)))
-
-app.register_blueprint(make_blueprint(device_type=DEVICE_TYPE, name_suffix=INIT_MODE.name))
-
-STATE_RGBW = {
-    # modes according to docs
-    # * 1 RGBW
-    # * 2 RGB
-    # * 3 MONO: 4 separated channel (LED strips)
-    # * 4 RGBorW: RGBW but with exceptive parts: color (RGB) and white (W), where
-    #     white (W) part has priority*
-    # * 5 CT (color temperature). For one 2-channel LED strips
-    #     (warm white - 1:(R); cold white - 1:(G))
-    # * 6 CTx2: 2 separated LED strips (color temperature)
-    #     For two separated 2-channel LED strips
-    #     (warm white - 1:(R),2:(B); cold white - 1:(G),2:(W)
-    # Note: support for mode 7 (RGBWW) missing
-    "colorMode": INIT_MODE,
-    "effectID": 2,
-    "desiredColor": "ff003000",
-    "currentColor": "ff003000",
-    "lastOnColor": "ff003000",
-    "durationsMs": {},
-}
-
-STATE_RGBW_EXTENDED = {
-    "effectNames": {
-        "0": "NONE",
-        "1": "FADE",
-        "2": "RGB",
-        "3": "POLICE",
-        "4": "RELAX",
-        "5": "STROBO",
-        "6": "BELL"
-    },
-    "favColors": {
-        "0": "ff000000",
-        "1": "00ff0000",
-        "2": "0000ff00",
-        "3": "000000ff",
-        "4": "00000000",
-        "5": "ff00ff00",
-        "6": "ffff0000",
-        "7": "00ffff00",
-        "8": "ff800000",
-        "9": "0080ff00"
-    },
-}
-
-
 def apply_color(original: str, new: str, color_mode=None):
     # note: logic here is strange, not sure if W priority works that way
     #       needs to be checked with real device
@@ -97,49 +54,110 @@ def apply_color(original: str, new: str, color_mode=None):
     return "".join(v)
 
 
-@app.route("/api/rgbw/state", methods=["GET"])
-def api_rgbw_state():
-    return {
-        "rgbw": STATE_RGBW
+class WLightBox(Device):
+    DEVICE_TYPE = "wLightBox"
+    API_VERSION = "20200229"
+    blueprint = make_blueprint(API_VERSION)
+    STATE_LAYOUT = Device.STATE_LAYOUT + (
+        ("rgbw.effectID", "q"),
+        ("rgbw.desiredColor", "64s"),
+    )
+
+    STATE_RGBW_EXTENDED = {
+        "effectNames": {
+            "0": "NONE",
+            "1": "FADE",
+            "2": "RGB",
+            "3": "POLICE",
+            "4": "RELAX",
+            "5": "STROBO",
+            "6": "BELL"
+        },
+        "favColors": {
+            "0": "ff000000",
+            "1": "00ff0000",
+            "2": "0000ff00",
+            "3": "000000ff",
+            "4": "00000000",
+            "5": "ff00ff00",
+            "6": "ffff0000",
+            "7": "00ffff00",
+            "8": "ff800000",
+            "9": "0080ff00"
+        },
     }
 
+    def __init__(self, *, mode: int = BleboxColorMode.CTx2, **kwargs):
+        mode = BleboxColorMode(mode)
+        super().__init__(name_suffix=mode.name, **kwargs)
+        self.mode = mode
+        self.rgbw = {
+            # modes according to docs
+            # * 1 RGBW
+            # * 2 RGB
+            # * 3 MONO: 4 separated channel (LED strips)
+            # * 4 RGBorW: RGBW but with exceptive parts: color (RGB) and white (W), where
+            #     white (W) part has priority*
+            # * 5 CT (color temperature). For one 2-channel LED strips
+            #     (warm white - 1:(R); cold white - 1:(G))
+            # * 6 CTx2: 2 separated LED strips (color temperature)
+            #     For two separated 2-channel LED strips
+            #     (warm white - 1:(R),2:(B); cold white - 1:(G),2:(W)
+            # Note: support for mode 7 (RGBWW) missing
+            "colorMode": mode,
+            "effectID": 2,
+            "desiredColor": "ff003000",
+            "currentColor": "ff003000",
+            "lastOnColor": "ff003000",
+            "durationsMs": {},
+        }
 
-@app.route("/api/rgbw/set", methods=["POST"])
-def api_rgbw_set():
-    # note: wlightbox always expects JSON and does not look at content type.
-    #       Also, homeassistant doesn't send content-type header. Probably should.
-    payload = json.loads(request.data)
-    rgbw = require_field(payload, ".rgbw", of_type=dict)
-
-    effect_id = STATE_RGBW["effectID"]
-    desired_color = STATE_RGBW["desiredColor"]
-
-    if "effectID" in rgbw:
-        effect_id = require_field(rgbw, ".effectID", of_type=int)
+    @classmethod
+    def from_env(cls):
+        return cls(mode=int(os.environ.get("MODE", BleboxColorMode.CTx2)))
 
-    if "desiredColor" in rgbw:
-        requested = require_field(rgbw, ".desiredColor", of_type=str)
-        print("color prev:", desired_color)
-        print("color req: ", requested)
-        desired_color = apply_color(desired_color, requested, STATE_RGBW["colorMode"])
-        print("color next:", desired_color)
+    @fast_route("/api/rgbw/state")
+    def api_rgbw_state(self):
+        return {
+            "rgbw": self.rgbw
+        }
 
-    STATE_RGBW.update({
-        "effectID": effect_id,
-        "desiredColor": desired_color,
-        # note: skipping durationMs for now
-    })
+    @route("/api/rgbw/set", methods=["POST"])
+    def api_rgbw_set(self):
+        # note: wlightbox always expects JSON and does not look at content type.
+        #       Also, homeassistant doesn't send content-type header. Probably should.
+        payload = json.loads(request.data)
+        (rgbw,) = validate_rgbw_set(payload)
+        effect_id, requested = validate_rgbw(rgbw)
+        desired_color = self.rgbw["desiredColor"]
+
+        if effect_id is None:
+            effect_id = self.rgbw["effectID"]
+
+        if requested is not None:
+            print("color prev:", desired_color)
+            print("color req: ", requested)
+            desired_color = apply_color(desired_color, requested, self.rgbw["colorMode"])
+            print("color next:", desired_color)
+
+        self.rgbw.update({
+            "effectID": effect_id,
+            "desiredColor": desired_color,
+            # note: skipping durationMs for now
+        })
+
+        return {
+            "rgbw": self.rgbw
+        }
 
-    return {
-        "rgbw": STATE_RGBW
-    }
+    @route("/api/rgbw/extended/state", methods=["GET"])
+    def api_rgbw_extended_state(self):
+        return {
+            "rgbw": {
+                **self.rgbw,
+                **self.STATE_RGBW_EXTENDED,
+            }
+        }
 
 
-@app.route("/api/rgbw/extended/state", methods=["GET"])
-def api_rgbw_extended_state():
-    return {
-        "rgbw": {
-            **STATE_RGBW,
-            **STATE_RGBW_EXTENDED,
-        }
-    }
+__getattr__ = module_app(__name__, WLightBox)